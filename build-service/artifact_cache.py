@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Artifact Cache - Content-addressed store of built APKs under RELEASES_DIR
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+import config
+
+logger = logging.getLogger("ArtifactCache")
+
+APK_NAME = "app.apk"
+META_NAME = "meta.json"
+
+
+class ArtifactCache:
+    """Stores built APKs keyed on everything that determines their content.
+
+    Each entry is a directory <key>/ holding the APK and a meta.json with its
+    SHA-256 and size. Entries are evicted by age and, oldest use first, by
+    total size, except while pinned: a pinned entry is being read by a publish
+    or a mirror download until it is unpinned.
+    """
+
+    def __init__(self, root: Optional[Path] = None, max_bytes: Optional[int] = None,
+                 max_age: Optional[int] = None):
+        self.root = Path(root) if root else Path(config.RELEASES_DIR) / "cache"
+        self.max_bytes = max_bytes if max_bytes is not None else config.ARTIFACT_CACHE_MAX_MB * 1024 * 1024
+        self.max_age = max_age if max_age is not None else config.ARTIFACT_CACHE_MAX_AGE_DAYS * 86400
+        self.lock = threading.Lock()
+        self.pins: Dict[str, int] = {}  # key -> readers of the entry
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def make_key(commit: str, version: str, version_code: int,
+                 image_id: str, build_command: str) -> str:
+        """Derive the cache key from the build inputs."""
+        inputs = json.dumps({
+            "commit": commit,
+            "version": version,
+            "versionCode": int(version_code),
+            "image": image_id,
+            "command": build_command
+        }, sort_keys=True)
+        return hashlib.sha256(inputs.encode("utf-8")).hexdigest()
+
+    def lookup(self, key: str, pin: bool = False) -> Optional[dict]:
+        """Return metadata (with 'path' to the APK) for key, or None on a miss.
+
+        With pin, a hit is kept from eviction until unpin(key).
+        """
+        entry = self.root / key
+        with self.lock:
+            try:
+                meta = json.loads((entry / META_NAME).read_text())
+            except (FileNotFoundError, json.JSONDecodeError):
+                return None
+            apk_path = entry / APK_NAME
+            if not apk_path.exists():
+                return None
+            os.utime(entry / META_NAME)  # mark as recently used
+            if pin:
+                self.pins[key] = self.pins.get(key, 0) + 1
+        meta["path"] = apk_path
+        return meta
+
+    def unpin(self, key: str):
+        """Release a pin taken by lookup()."""
+        with self.lock:
+            if self.pins.get(key, 0) > 1:
+                self.pins[key] -= 1
+            else:
+                self.pins.pop(key, None)
+
+    def begin(self, key: str) -> Path:
+        """Return a staging path to write the APK for key to."""
+        staging = self.root / f".{key}.tmp"
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir(parents=True)
+        return staging / APK_NAME
+
+    def commit(self, key: str, sha256: str, **meta) -> Path:
+        """Publish a staged APK as the entry for key and return its path."""
+        entry = self.root / key
+        staging = self.root / f".{key}.tmp"
+        meta.update({
+            "sha256": sha256,
+            "size": (staging / APK_NAME).stat().st_size,
+            "createdAt": int(time.time())
+        })
+        (staging / META_NAME).write_text(json.dumps(meta))
+
+        with self.lock:
+            shutil.rmtree(entry, ignore_errors=True)
+            staging.rename(entry)
+        logger.info(f"Stored APK in artifact cache as {key[:12]}")
+
+        # The build being published reads the entry it just stored
+        self.evict(keep=key)
+        return entry / APK_NAME
+
+    def discard(self, key: str):
+        """Drop an entry (or a staged one)."""
+        with self.lock:
+            shutil.rmtree(self.root / key, ignore_errors=True)
+            shutil.rmtree(self.root / f".{key}.tmp", ignore_errors=True)
+
+    def store(self, key: str, apk_path: Path, sha256: str, **meta) -> Path:
+        """Copy a built APK into the cache and return its cached path."""
+        shutil.copyfile(apk_path, self.begin(key))
+        return self.commit(key, sha256, **meta)
+
+    def ingest(self, key: str, apk_path: Path, **meta) -> str:
+        """Copy an APK into the cache, hashing it on the way; returns its SHA-256."""
+        sha256 = hashlib.sha256()
+        with open(apk_path, "rb") as src, open(self.begin(key), "wb") as dst:
+            for chunk in iter(lambda: src.read(1024 * 1024), b""):
+                sha256.update(chunk)
+                dst.write(chunk)
+        self.commit(key, sha256.hexdigest(), **meta)
+        return sha256.hexdigest()
+
+    def clear_staging(self):
+        """Drop staged entries an interrupted build never committed."""
+        with self.lock:
+            for staging in self.root.glob(".*.tmp"):
+                shutil.rmtree(staging, ignore_errors=True)
+
+    def evict(self, keep: Optional[str] = None):
+        """Drop entries older than max_age, then least recently used past max_bytes.
+
+        The entry of key keep and pinned entries are never dropped.
+        """
+        now = time.time()
+        with self.lock:
+            entries = []
+            for entry in self.root.iterdir():
+                if not entry.is_dir() or entry.name.startswith("."):
+                    continue
+                try:
+                    last_used = (entry / META_NAME).stat().st_mtime
+                    size = (entry / APK_NAME).stat().st_size
+                except FileNotFoundError:
+                    shutil.rmtree(entry, ignore_errors=True)
+                    continue
+                entries.append((last_used, size, entry))
+
+            total = sum(size for _, size, _ in entries)
+            for last_used, size, entry in sorted(entries):
+                if entry.name == keep or entry.name in self.pins:
+                    continue
+                expired = self.max_age > 0 and now - last_used > self.max_age
+                oversize = self.max_bytes > 0 and total > self.max_bytes
+                if not (expired or oversize):
+                    continue
+                logger.info(f"Evicting {entry.name[:12]} from artifact cache")
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= size
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Artifact Server - LAN mirror of published APKs for devices
+"""
+import json
+import logging
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Tuple
+
+import config
+from artifact_cache import ArtifactCache
+
+logger = logging.getLogger("ArtifactServer")
+
+# /apk/<artifact cache key>/<asset name>, with .sha256 appended for its checksum
+PATH_PATTERN = re.compile(r"^/apk/([0-9a-f]{64})/([A-Za-z0-9._-]+?)(\.sha256)?$")
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+APK_CONTENT_TYPE = "application/vnd.android.package-archive"
+# Seconds a device is told to wait when every download slot is taken
+RETRY_AFTER = 5
+
+
+def byte_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """First and last byte of a Range header, or None if it should be ignored.
+
+    Only single ranges are served; multiple ranges and malformed headers get
+    the whole file. Raises ValueError if the range lies outside the file.
+    """
+    match = RANGE_PATTERN.match(header.strip())
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    first, last = match.groups()
+    if first == "":
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError(f"Range {header} outside {size} bytes")
+    return start, end
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # A fleet starting its downloads at once overflows the default backlog of 5
+    request_queue_size = 128
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep-alive, and DownloadManager resumes with Range/If-Range
+    protocol_version = "HTTP/1.1"
+    mirror: "ArtifactServer" = None
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def do_GET(self):
+        self._serve(body=True)
+
+    def do_HEAD(self):
+        self._serve(body=False)
+
+    def _serve(self, body: bool):
+        path = self.path.split("?", 1)[0]
+        if path == "/stats":
+            self._respond(200, json.dumps(self.mirror.stats()).encode("utf-8"),
+                          "application/json", body=body)
+            return
+
+        match = PATH_PATTERN.match(path)
+        entry = self.mirror.cache.lookup(match.group(1), pin=True) if match else None
+        if entry is None:
+            self._respond(404, body=body)
+            return
+        # Pinned so eviction leaves the APK alone while it is sent
+        try:
+            self._serve_entry(entry, match, body)
+        finally:
+            self.mirror.cache.unpin(match.group(1))
+
+    def _serve_entry(self, entry: dict, match: re.Match, body: bool):
+        etag = f'"{entry["sha256"]}"'
+        if match.group(3):
+            checksum = f"{entry['sha256']}  {match.group(2)}\n".encode("utf-8")
+            self._respond(200, checksum, "text/plain", body=body, headers={"ETag": etag})
+            return
+
+        if self._not_modified(etag):
+            self.mirror.count("notModified")
+            self._respond(304, body=False, headers={"ETag": etag})
+            return
+
+        if not self.mirror.slots.acquire(blocking=False):
+            self.mirror.count("rejected")
+            self._respond(503, body=body, headers={"Retry-After": str(RETRY_AFTER)})
+            return
+        try:
+            self._send_apk(entry, etag, body)
+        finally:
+            self.mirror.slots.release()
+
+    def _not_modified(self, etag: str) -> bool:
+        tags = [t.strip() for t in self.headers.get("If-None-Match", "").split(",")]
+        return etag in tags or "*" in tags
+
+    def _send_apk(self, entry: dict, etag: str, body: bool):
+        try:
+            f = open(entry["path"], "rb")
+        except FileNotFoundError:
+            # Discarded (found corrupt) between lookup and open
+            self._respond(404, body=body)
+            return
+
+        with f:
+            size = entry["size"]
+            start, end, status = 0, size - 1, 200
+            # If-Range: resume only if the file is still the one partly downloaded
+            if self.headers.get("Range") and self.headers.get("If-Range", etag) == etag:
+                try:
+                    requested = byte_range(self.headers["Range"], size)
+                except ValueError:
+                    self._respond(416, body=body, headers={"Content-Range": f"bytes */{size}"})
+                    return
+                if requested:
+                    (start, end), status = requested, 206
+                    self.mirror.count("rangeRequests")
+
+            self.send_response(status)
+            self.send_header("Content-Type", APK_CONTENT_TYPE)
+            self.send_header("Content-Length", str(end - start + 1))
+            self.send_header("ETag", etag)
+            self.send_header("Accept-Ranges", "bytes")
+            # The URL names the cache key, so its content never changes
+            self.send_header("Cache-Control", "public, max-age=31536000, immutable")
+            if status == 206:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            self.end_headers()
+            if not body:
+                return
+
+            self.mirror.count("downloads")
+            with self.mirror.lock:
+                self.mirror.active += 1
+            try:
+                # Zero-copy from the page cache to the socket (os.sendfile)
+                sent = self.connection.sendfile(f, offset=start, count=end - start + 1)
+                self.mirror.count("bytesServed", sent)
+            finally:
+                with self.mirror.lock:
+                    self.mirror.active -= 1
+
+    def _respond(self, status: int, content: bytes = b"", content_type: str = "text/plain",
+                 body: bool = True, headers: Optional[dict] = None):
+        self.send_response(status)
+        if status != 304:
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if body and content:
+            self.wfile.write(content)
+
+
+class ArtifactServer:
+    """Serves APKs in the artifact cache (and their SHA-256) over HTTP on the LAN.
+
+    Devices download updates from here instead of through GitHub: whole
+    files or byte ranges for resumed downloads, validated by a strong ETag
+    (the APK's SHA-256) and sent with sendfile. At most max_downloads are
+    served at once; further requests get 503 with Retry-After.
+    """
+
+    def __init__(self, cache: ArtifactCache, port: Optional[int] = None,
+                 max_downloads: Optional[int] = None):
+        self.cache = cache
+        self.port = port if port is not None else config.ARTIFACT_SERVER_PORT
+        self.max_downloads = max_downloads or config.ARTIFACT_SERVER_MAX_DOWNLOADS
+        self.slots = threading.BoundedSemaphore(self.max_downloads)
+        self.lock = threading.Lock()
+        self.counters = {"downloads": 0, "rangeRequests": 0, "notModified": 0,
+                         "rejected": 0, "bytesServed": 0}
+        self.active = 0
+        self.httpd = None
+
+    def start(self):
+        """Serve in a background thread."""
+        handler = type("MirrorHandler", (_Handler,), {"mirror": self})
+        self.httpd = _Server(("0.0.0.0", self.port), handler)
+        self.port = self.httpd.server_address[1]
+        threading.Thread(target=self.httpd.serve_forever, name="artifact-server",
+                         daemon=True).start()
+        logger.info(f"Artifact mirror listening on port {self.port} "
+                    f"(max {self.max_downloads} downloads)")
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+
+    def url(self, key: str, name: str) -> str:
+        """Where devices download the cached APK key, published as name."""
+        return f"{config.ARTIFACT_SERVER_URL.rstrip('/')}/apk/{key}/{name}"
+
+    def count(self, counter: str, amount: int = 1):
+        with self.lock:
+            self.counters[counter] += amount
+
+    def stats(self) -> dict:
+        with self.lock:
+            return dict(self.counters, active=self.active, maxDownloads=self.max_downloads)
@@ -0,0 +1,571 @@
+#!/usr/bin/env python3
+"""
+Benchmark stand-ins - Local MQTT broker, scripted Docker and a GitHub releases API
+
+Used by benchmark.py to run the real BuildService without a broker, a Docker
+daemon or api.github.com. Each stand-in counts what it was asked to do.
+"""
+import gzip
+import hashlib
+import itertools
+import json
+import logging
+import random
+import re
+import socket
+import socketserver
+import struct
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+from builder import task_variant, variant_output_dir
+
+logger = logging.getLogger("BenchFakes")
+
+MB = 1024 * 1024
+# A fake build differs from the shared base APK in this many spots of this many bytes
+APK_CHANGES = 16
+APK_CHANGE_BYTES = 256
+
+
+# --- MQTT -------------------------------------------------------------------
+
+CONNECT, CONNACK, PUBLISH, PUBACK = 1, 2, 3, 4
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK = 8, 9, 10, 11
+PINGREQ, PINGRESP, DISCONNECT = 12, 13, 14
+
+
+def topic_matches(pattern: str, topic: str) -> bool:
+    """MQTT topic filter match (+ one level, # the rest)."""
+    parts = topic.split("/")
+    for index, level in enumerate(pattern.split("/")):
+        if level == "#":
+            return True
+        if index >= len(parts) or (level != "+" and level != parts[index]):
+            return False
+    return len(pattern.split("/")) == len(parts)
+
+
+def _encode_length(length: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        out.append(byte | (0x80 if length else 0))
+        if not length:
+            return bytes(out)
+
+
+def _string(data: bytes, offset: int):
+    length = struct.unpack_from("!H", data, offset)[0]
+    return data[offset + 2:offset + 2 + length], offset + 2 + length
+
+
+class _Session:
+    """One connected MQTT client."""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.client_id = ""
+        self.subscriptions: Dict[str, int] = {}
+        self.lock = threading.Lock()
+        self.packet_ids = itertools.count(1)
+
+    def send(self, packet_type: int, flags: int, body: bytes):
+        with self.lock:
+            try:
+                self.sock.sendall(bytes([packet_type << 4 | flags]) + _encode_length(len(body)) + body)
+            except OSError:
+                pass
+
+    def deliver(self, topic: str, payload: bytes, qos: int, retain: bool):
+        body = struct.pack("!H", len(topic)) + topic.encode()
+        if qos:
+            body += struct.pack("!H", next(self.packet_ids) % 65535 + 1)
+        self.send(PUBLISH, (qos << 1) | (1 if retain else 0), body + payload)
+
+
+class MiniBroker:
+    """Minimal MQTT 3.1.1 broker: QoS 0/1, retained messages and wildcards.
+
+    Enough for the service, workers and benchmark clients on one host; no
+    persistence, no QoS 2 and no will messages. Published messages are
+    counted per client id and per topic.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.sessions: List[_Session] = []
+        self.retained: Dict[str, bytes] = {}
+        self.lock = threading.Lock()
+        self.published = Counter()  # client id -> messages
+        self.topics = Counter()  # topic -> messages
+        broker = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                broker._serve(self.request)
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address
+
+    def start(self) -> "MiniBroker":
+        threading.Thread(target=self.server.serve_forever, name="mini-broker", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset_counters(self):
+        with self.lock:
+            self.published.clear()
+            self.topics.clear()
+
+    def _read(self, sock: socket.socket, size: int) -> bytes:
+        data = b""
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("Client went away")
+            data += chunk
+        return data
+
+    def _serve(self, sock: socket.socket):
+        session = _Session(sock)
+        try:
+            while True:
+                header = self._read(sock, 1)[0]
+                length, shift = 0, 0
+                while True:
+                    byte = self._read(sock, 1)[0]
+                    length += (byte & 0x7F) << shift
+                    shift += 7
+                    if not byte & 0x80:
+                        break
+                body = self._read(sock, length) if length else b""
+                if not self._packet(session, header >> 4, header & 0x0F, body):
+                    break
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            with self.lock:
+                if session in self.sessions:
+                    self.sessions.remove(session)
+            sock.close()
+
+    def _packet(self, session: _Session, packet_type: int, flags: int, body: bytes) -> bool:
+        if packet_type == CONNECT:
+            _, offset = _string(body, 0)  # protocol name
+            offset += 4  # level, flags, keepalive
+            client_id, _ = _string(body, offset)
+            session.client_id = client_id.decode()
+            with self.lock:
+                self.sessions.append(session)
+            session.send(CONNACK, 0, b"\x00\x00")
+        elif packet_type == PUBLISH:
+            qos = (flags >> 1) & 0x03
+            topic, offset = _string(body, 0)
+            if qos:
+                packet_id = body[offset:offset + 2]
+                offset += 2
+                session.send(PUBACK, 0, packet_id)
+            self.publish(topic.decode(), body[offset:], qos, bool(flags & 0x01), session.client_id)
+        elif packet_type == SUBSCRIBE:
+            packet_id, offset, granted = body[:2], 2, bytearray()
+            new = []
+            while offset < len(body):
+                pattern, offset = _string(body, offset)
+                qos = min(body[offset], 1)
+                offset += 1
+                session.subscriptions[pattern.decode()] = qos
+                new.append((pattern.decode(), qos))
+                granted.append(qos)
+            session.send(SUBACK, 0, packet_id + bytes(granted))
+            with self.lock:
+                retained = list(self.retained.items())
+            for pattern, qos in new:
+                for topic, payload in retained:
+                    if topic_matches(pattern, topic):
+                        session.deliver(topic, payload, qos, True)
+        elif packet_type == UNSUBSCRIBE:
+            offset = 2
+            while offset < len(body):
+                pattern, offset = _string(body, offset)
+                session.subscriptions.pop(pattern.decode(), None)
+            session.send(UNSUBACK, 0, body[:2])
+        elif packet_type == PINGREQ:
+            session.send(PINGRESP, 0, b"")
+        elif packet_type == DISCONNECT:
+            return False
+        return True
+
+    def publish(self, topic: str, payload: bytes, qos: int = 0, retain: bool = False,
+                client_id: str = ""):
+        with self.lock:
+            self.published[client_id] += 1
+            self.topics[topic] += 1
+            if retain:
+                if payload:
+                    self.retained[topic] = payload
+                else:
+                    self.retained.pop(topic, None)
+            targets = []
+            for session in self.sessions:
+                granted = [q for pattern, q in session.subscriptions.items() if topic_matches(pattern, topic)]
+                if granted:
+                    targets.append((session, min(qos, max(granted))))
+        for session, delivery_qos in targets:
+            session.deliver(topic, payload, delivery_qos, False)
+
+
+# --- Docker -----------------------------------------------------------------
+
+GRADLE_TASKS = [
+    "preBuild", "preDebugBuild", "generateDebugBuildConfig", "checkDebugAarMetadata",
+    "generateDebugResValues", "mapDebugSourceSetPaths", "generateDebugResources",
+    "mergeDebugResources", "packageDebugResources", "parseDebugLocalResources",
+    "createDebugCompatibleScreenManifests", "extractDeepLinksDebug", "processDebugMainManifest",
+    "processDebugManifest", "processDebugManifestForPackage", "processDebugResources",
+    "compileDebugKotlin", "javaPreCompileDebug", "compileDebugJavaWithJavac",
+    "mergeDebugShaders", "compileDebugShaders", "generateDebugAssets", "mergeDebugAssets",
+    "compressDebugAssets", "checkDebugDuplicateClasses", "desugarDebugFileDependencies",
+    "mergeExtDexDebug", "mergeLibDexDebug", "dexBuilderDebug", "mergeProjectDexDebug",
+    "mergeDebugJniLibFolders", "mergeDebugNativeLibs", "stripDebugDebugSymbols",
+    "validateSigningDebug", "writeDebugAppMetadata", "writeDebugSigningConfigVersions",
+    "packageDebug", "createDebugApkListingFileRedirect", "assembleDebug",
+]
+
+
+def synthetic_gradle_log(tasks: Optional[List[str]] = None) -> List[str]:
+    """Output of a plain-console Gradle build of the app, one entry per line."""
+    lines = ["=== Working directory ===", "/project", "=== Starting build ===",
+             "Starting a Gradle Daemon (subsequent builds will be faster)",
+             "> Configure project :app"]
+    for index, task in enumerate(tasks or GRADLE_TASKS):
+        outcome = " UP-TO-DATE" if index % 7 == 0 else (" FROM-CACHE" if index % 5 == 0 else "")
+        lines.append(f"> Task :app:{task}{outcome}")
+        if "Kotlin" in task:
+            lines.append("w: Parameter 'savedInstanceState' is never used")
+    lines += ["", "BUILD SUCCESSFUL in 1m 12s", f"{len(tasks or GRADLE_TASKS)} actionable tasks: "
+              "28 executed, 6 from cache, 5 up-to-date"]
+    return lines
+
+
+def load_gradle_log(path: Path) -> List[str]:
+    """Lines of a recorded build log (plain or a gzip archive from LogStore)."""
+    path = Path(path)
+    opener = gzip.open if path.suffix == ".gz" else open
+    with opener(path, "rt", encoding="utf-8", errors="ignore") as f:
+        return [line.rstrip("\n") for line in f]
+
+
+class FakeImage:
+    def __init__(self, name: str):
+        self.id = "sha256:" + hashlib.sha256(name.encode()).hexdigest()
+        self.tags = [name]
+
+
+class FakeContainer:
+    """Replays a Gradle log over build_seconds, then leaves APKs in the project."""
+
+    def __init__(self, client: "FakeDockerClient", command: str, project: Path):
+        self.client = client
+        self.command = command
+        self.project = project
+        self.id = hashlib.sha256(f"{time.time()}{id(self)}".encode()).hexdigest()
+        self.short_id = self.id[:12]
+        self.stopped = threading.Event()
+        self.finished = threading.Event()
+        self.exit_code: Optional[int] = None
+        self.started = time.monotonic()
+        self.runtime = 0.0
+
+    def logs(self, stream: bool = True, follow: bool = True):
+        lines = self.client.log_lines
+        delay = self.client.build_seconds / max(len(lines), 1)
+        try:
+            for index, line in enumerate(lines):
+                if self.stopped.wait(delay):
+                    self.exit_code = 137
+                    return
+                yield (line + "\n").encode()
+            self._write_apks()
+            self.exit_code = 0
+        finally:
+            self.runtime = time.monotonic() - self.started
+            self.client.runtimes[self._version()] = self.runtime
+            self.finished.set()
+
+    def _version(self) -> str:
+        """versionName set in the checkout (identifies the build), else the directory."""
+        try:
+            text = (self.project / "app" / "build.gradle.kts").read_text()
+        except OSError:
+            return self.project.name
+        match = re.search(r'versionName\s*=\s*"([^"]+)"', text)
+        return match.group(1) if match else self.project.name
+
+    def _write_apks(self):
+        for task in re.findall(r"assemble[A-Z]\w*", self.command):
+            variant = task_variant(task)
+            out_dir = variant_output_dir(self.project, variant)
+            out_dir.mkdir(parents=True, exist_ok=True)
+            with open(out_dir / f"app-{variant}.apk", "wb") as f:
+                f.write(self.client.apk_content(f"{self._version()}/{variant}"))
+
+    def wait(self, timeout: Optional[float] = None) -> dict:
+        self.finished.wait(timeout)
+        return {"StatusCode": 137 if self.exit_code is None else self.exit_code}
+
+    def stop(self, timeout: int = 10):
+        self.stopped.set()
+
+    def kill(self):
+        self.stopped.set()
+
+    def remove(self, force: bool = False):
+        self.client.counters["removed"] += 1
+
+    def update(self, **limits):
+        pass
+
+    def stats(self, stream: bool = True, decode: bool = True):
+        cpu = 0
+        while not self.finished.wait(0.5):
+            cpu += 500_000_000
+            yield {"memory_stats": {"usage": 512 * MB, "stats": {"inactive_file": 0}},
+                   "cpu_stats": {"cpu_usage": {"total_usage": cpu}}}
+
+
+class _Images:
+    def __init__(self, client: "FakeDockerClient"):
+        self.client = client
+
+    def get(self, name: str) -> FakeImage:
+        return FakeImage(name)
+
+
+class _Containers:
+    def __init__(self, client: "FakeDockerClient"):
+        self.client = client
+
+    def run(self, image: str, command: str = "", volumes: Optional[dict] = None, **kwargs) -> FakeContainer:
+        project = next(host for host, bind in (volumes or {}).items() if bind["bind"] == "/project")
+        self.client.counters["started"] += 1
+        return FakeContainer(self.client, command, Path(project))
+
+    def list(self, **kwargs) -> list:
+        return []
+
+
+class FakeDockerClient:
+    """The parts of docker.DockerClient the builder and scheduler use."""
+
+    def __init__(self, log_lines: Optional[List[str]] = None, build_seconds: float = 2.0,
+                 apk_bytes: int = MB, cores: int = 16, memory_mb: int = 32768, seed: int = 0):
+        self.log_lines = log_lines or synthetic_gradle_log()
+        self.build_seconds = build_seconds
+        self.apk_bytes = apk_bytes
+        # Incompressible like a real APK; all-zero files make bsdiff take minutes
+        self.apk_base = random.Random(seed).randbytes(apk_bytes)
+        self.cores = cores
+        self.memory_mb = memory_mb
+        self.images = _Images(self)
+        self.containers = _Containers(self)
+        self.counters = Counter()
+        self.runtimes: Dict[str, float] = {}  # versionName -> seconds
+
+    def info(self) -> dict:
+        return {"NCPU": self.cores, "MemTotal": self.memory_mb * MB}
+
+    def apk_content(self, build: str) -> bytes:
+        """APK bytes of build: the shared base with a few KB changed, the same every time."""
+        content = bytearray(self.apk_base)
+        rng = random.Random(hashlib.sha256(build.encode()).digest())
+        for _ in range(APK_CHANGES):
+            offset = rng.randrange(max(len(content) - APK_CHANGE_BYTES, 1))
+            content[offset:offset + APK_CHANGE_BYTES] = rng.randbytes(APK_CHANGE_BYTES)
+        return bytes(content[:self.apk_bytes])
+
+
+# --- GitHub -----------------------------------------------------------------
+
+class FakeGitHub:
+    """Releases and uploads API of one repository, served over local HTTP.
+
+    Point GITHUB_API_URL and GITHUB_UPLOADS_URL at url. Responses carry
+    ETags and honour If-None-Match; uploaded bodies are read and counted but
+    not kept (downloads return zeros of the asset's size).
+    """
+
+    def __init__(self, repo: str, host: str = "127.0.0.1", port: int = 0):
+        self.repo = repo
+        self.releases: List[dict] = []  # newest first
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.requests = Counter()  # "METHOD kind" -> count
+        self.uploaded_bytes = 0
+        github = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                github._handle(self, "GET")
+
+            def do_POST(self):
+                github._handle(self, "POST")
+
+            def do_PATCH(self):
+                github._handle(self, "PATCH")
+
+            def do_DELETE(self):
+                github._handle(self, "DELETE")
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://{self.server.server_address[0]}:{self.server.server_address[1]}"
+
+    def start(self) -> "FakeGitHub":
+        threading.Thread(target=self.server.serve_forever, name="fake-github", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _asset_json(self, asset: dict) -> dict:
+        return {
+            "id": asset["id"],
+            "name": asset["name"],
+            "size": asset["size"],
+            "content_type": asset["content_type"],
+            "url": f"{self.url}/repos/{self.repo}/releases/assets/{asset['id']}",
+            "browser_download_url": f"{self.url}/download/{asset['id']}/{asset['name']}"
+        }
+
+    def _release_json(self, release: dict) -> dict:
+        return dict(release, html_url=f"{self.url}/releases/{release['tag_name']}",
+                    assets=[self._asset_json(a) for a in release["assets"]])
+
+    def _find(self, key: str, value) -> Optional[dict]:
+        return next((r for r in self.releases if r[key] == value), None)
+
+    def _handle(self, request: BaseHTTPRequestHandler, method: str):
+        url = urlparse(request.path)
+        query = parse_qs(url.query)
+        body = b""
+        length = int(request.headers.get("Content-Length") or 0)
+        if length:
+            if method == "POST" and url.path.endswith("/assets"):
+                # Upload: read in blocks, keep only the size
+                remaining = length
+                while remaining:
+                    remaining -= len(request.rfile.read(min(remaining, MB)))
+            else:
+                body = request.rfile.read(length)
+
+        prefix = f"/repos/{self.repo}/releases"
+        path = url.path[len(prefix):] if url.path.startswith(prefix) else None
+        with self.lock:
+            status, data = self._route(method, path, url.path, query, body, length)
+            self.requests[f"{method} {self._kind(path)}"] += 1
+
+        if isinstance(data, bytes):
+            payload, content_type = data, "application/octet-stream"
+        else:
+            payload, content_type = (json.dumps(data).encode() if data is not None else b""), "application/json"
+        etag = '"' + hashlib.sha1(payload).hexdigest() + '"'
+        if method == "GET" and status == 200 and request.headers.get("If-None-Match") == etag:
+            status, payload = 304, b""
+
+        request.send_response(status)
+        request.send_header("Content-Type", content_type)
+        request.send_header("Content-Length", str(len(payload)))
+        request.send_header("ETag", etag)
+        request.send_header("X-RateLimit-Remaining", "5000")
+        request.end_headers()
+        request.wfile.write(payload)
+
+    @staticmethod
+    def _kind(path: Optional[str]) -> str:
+        if path is None:
+            return "download"
+        return re.sub(r"/\d+", "/{id}", re.sub(r"/tags/.*", "/tags/{tag}", path)) or "/"
+
+    def _route(self, method: str, path: Optional[str], raw_path: str, query: dict,
+               body: bytes, length: int):
+        if path is None:
+            match = re.match(r"^/download/(\d+)/", raw_path)
+            asset = self._asset(int(match.group(1))) if match else None
+            return (200, bytes(asset[1]["size"])) if asset else (404, {"message": "Not Found"})
+
+        if method == "GET" and path in ("", "/"):
+            per_page = int(query.get("per_page", ["30"])[0])
+            page = int(query.get("page", ["1"])[0])
+            releases = self.releases[(page - 1) * per_page:page * per_page]
+            return 200, [self._release_json(r) for r in releases]
+        if method == "GET" and path == "/latest":
+            release = next((r for r in self.releases if not r["draft"]), None)
+            return (200, self._release_json(release)) if release else (404, {"message": "Not Found"})
+        if method == "GET" and path.startswith("/tags/"):
+            release = self._find("tag_name", path[len("/tags/"):])
+            return (200, self._release_json(release)) if release else (404, {"message": "Not Found"})
+        if method == "POST" and path in ("", "/"):
+            data = json.loads(body)
+            release = {"id": next(self.ids), "tag_name": data["tag_name"], "name": data.get("name"),
+                       "body": data.get("body"), "draft": data.get("draft", False),
+                       "prerelease": data.get("prerelease", False),
+                       "published_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                       "assets": []}
+            self.releases.insert(0, release)
+            return 201, self._release_json(release)
+
+        match = re.match(r"^/(\d+)(/assets)?$", path)
+        if match:
+            release = self._find("id", int(match.group(1)))
+            if release is None:
+                return 404, {"message": "Not Found"}
+            if match.group(2) and method == "GET":
+                return 200, [self._asset_json(a) for a in release["assets"]]
+            if match.group(2) and method == "POST":
+                asset = {"id": next(self.ids), "name": query["name"][0], "size": length,
+                         "content_type": "application/octet-stream"}
+                release["assets"].append(asset)
+                self.uploaded_bytes += length
+                return 201, self._asset_json(asset)
+            if method == "PATCH":
+                release.update({k: v for k, v in json.loads(body).items() if k in ("name", "body")})
+                return 200, self._release_json(release)
+            if method == "GET":
+                return 200, self._release_json(release)
+
+        match = re.match(r"^/assets/(\d+)$", path)
+        found = self._asset(int(match.group(1))) if match else None
+        if found:
+            release, asset = found
+            if method == "DELETE":
+                release["assets"].remove(asset)
+                return 204, None
+            if method == "PATCH":
+                asset["name"] = json.loads(body)["name"]
+                return 200, self._asset_json(asset)
+            if method == "GET":
+                return 200, bytes(asset["size"])
+        return 404, {"message": "Not Found"}
+
+    def _asset(self, asset_id: int):
+        for release in self.releases:
+            for asset in release["assets"]:
+                if asset["id"] == asset_id:
+                    return release, asset
+        return None
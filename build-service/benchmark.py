@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+"""
+Build Service Benchmark
+
+Runs the real BuildService in-process against local stand-ins (bench_fakes):
+a MQTT broker, a Docker client whose containers replay a Gradle log, and a
+GitHub releases/uploads API. Builds check out a generated local repository
+through the normal git mirror, so clone, version, upload and publish are the
+service's own code paths; only Gradle itself is scripted.
+
+Scenarios:
+    sequential  one build at a time: trigger-to-start latency and the
+                orchestration overhead around the container (end-to-end time
+                minus container time)
+    storm       all triggers at once, some of them duplicates: throughput and
+                queueing under load
+    downloads   many devices fetching one APK from the LAN artifact mirror at
+                once, half of them resuming with a Range request
+
+Results are written as JSON (see --output) for comparison between commits:
+
+    python benchmark.py --output before.json
+    git checkout other-branch
+    python benchmark.py --output after.json --compare before.json
+"""
+import argparse
+import json
+import logging
+import platform
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import paho.mqtt.client as mqtt
+
+import config
+from bench_fakes import FakeDockerClient, FakeGitHub, MiniBroker, load_gradle_log
+from telemetry import percentile
+
+logger = logging.getLogger("Benchmark")
+
+# app/build.gradle.kts of the generated repository (update_version rewrites it)
+GRADLE_FILE = """plugins {
+    id("com.android.application")
+}
+
+android {
+    defaultConfig {
+        applicationId = "dk.iocast.kiosk"
+        versionCode = 1
+        versionName = "1.0.0"
+    }
+}
+"""
+
+
+def summary(values: List[float]) -> dict:
+    return {
+        "p50": round(percentile(values, 50), 3),
+        "p95": round(percentile(values, 95), 3),
+        "max": round(max(values, default=0.0), 3)
+    }
+
+
+def create_repository(path: Path) -> str:
+    """Bare repository with a minimal app module; returns its URL."""
+    source = path.with_suffix(".src")
+    (source / "app").mkdir(parents=True)
+    (source / "app" / "build.gradle.kts").write_text(GRADLE_FILE)
+    (source / "gradlew").write_text("#!/bin/sh\n")
+
+    def git(*args, cwd=source):
+        subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True)
+
+    git("init", "-q", "-b", "main")
+    git("add", ".")
+    git("-c", "user.name=bench", "-c", "user.email=bench@localhost", "commit", "-q", "-m", "Bench app")
+    git("clone", "-q", "--bare", str(source), str(path), cwd=path.parent)
+    shutil.rmtree(source)
+    return path.as_uri()
+
+
+def configure(work_dir: Path, broker: MiniBroker, github: FakeGitHub, repo_url: str,
+              args: argparse.Namespace):
+    """Point the service's configuration at the stand-ins and a scratch directory."""
+    cache_dir = work_dir / "cache"
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        mirror_port = probe.getsockname()[1]
+    overrides = {
+        "MQTT_HOST": broker.host,
+        "MQTT_PORT": broker.port,
+        "MQTT_PASSWORD": "bench",
+        "GITHUB_TOKEN": "bench",
+        "GITHUB_API_URL": github.url,
+        "GITHUB_UPLOADS_URL": github.url,
+        "GIT_REPO_URL": repo_url,
+        "BUILD_CACHE_DIR": str(cache_dir),
+        "HOST_BUILD_CACHE_DIR": str(cache_dir),
+        "RELEASES_DIR": str(work_dir / "releases"),
+        "BUILD_WORKERS": args.workers,
+        "BUILD_MODE": "local",
+        "GRADLE_REMOTE_CACHE_PORT": 0,
+        "BUILDER_POOL_SIZE": 0,
+        "PREBUILD_BRANCHES": [],
+        "DELTA_BASE_COUNT": 3 if args.deltas else 0,
+        "ROLLOUT_AUTO": False,
+        "ARTIFACT_SERVER_PORT": mirror_port,
+        "ARTIFACT_SERVER_URL": f"http://127.0.0.1:{mirror_port}",
+        "ARTIFACT_SERVER_MAX_DOWNLOADS": args.max_downloads,
+    }
+    for name, value in overrides.items():
+        setattr(config, name, value)
+
+
+class Observer:
+    """MQTT client that timestamps each build's status and result by version."""
+
+    def __init__(self, broker: MiniBroker):
+        self.client = mqtt.Client(client_id="iocast-benchmark")
+        self.cond = threading.Condition()
+        self.statuses: Dict[str, Dict[str, float]] = {}  # version -> status -> first seen
+        self.results: Dict[str, dict] = {}  # version -> result payload (+ "receivedAt")
+        self.replays = 0
+        self.service_status: Optional[str] = None
+        self.client.on_connect = lambda c, u, f, rc: c.subscribe(
+            [(config.TOPIC_STATUS, 1), (config.TOPIC_RESULT, 1)])
+        self.client.on_message = self._on_message
+        self.client.connect(broker.host, broker.port)
+        self.client.loop_start()
+
+    def _on_message(self, client, userdata, msg):
+        now = time.monotonic()
+        payload = json.loads(msg.payload)
+        with self.cond:
+            version = payload.get("version")
+            if msg.topic == config.TOPIC_STATUS:
+                self.service_status = payload.get("status")
+                if version:
+                    self.statuses.setdefault(version, {}).setdefault(payload["status"], now)
+            elif msg.retain:
+                return
+            elif payload.get("deduplicated"):
+                self.replays += 1
+            elif version:
+                self.results[version] = dict(payload, receivedAt=now)
+            self.cond.notify_all()
+
+    def wait_for(self, predicate, timeout: float) -> bool:
+        with self.cond:
+            return self.cond.wait_for(predicate, timeout)
+
+    def trigger(self, version: str, version_code: int, requested_by: str):
+        payload = {"branch": "main", "version": version, "versionCode": version_code,
+                   "requestedBy": requested_by}
+        self.client.publish(config.TOPIC_TRIGGER, json.dumps(payload), qos=1)
+
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+class Benchmark:
+    def __init__(self, args: argparse.Namespace, broker: MiniBroker, github: FakeGitHub,
+                 docker_client: FakeDockerClient, service, observer: Observer):
+        self.args = args
+        self.broker = broker
+        self.github = github
+        self.docker = docker_client
+        self.service = service
+        self.observer = observer
+        self.runs = 0
+
+    def _versions(self, count: int) -> List[tuple]:
+        self.runs += 1
+        return [(f"0.{self.runs}.{n}", self.runs * 10000 + n) for n in range(count)]
+
+    def _measure(self, name: str, versions: List[tuple], triggered: Dict[str, float], fire):
+        """Run fire(), wait for every version's result and collect the metrics."""
+        self.broker.reset_counters()
+        github_before = sum(self.github.requests.values())
+        usage_before = resource.getrusage(resource.RUSAGE_SELF)
+        replays_before = self.observer.replays
+        started = time.monotonic()
+
+        fire()
+        wanted = [version for version, _ in versions]
+        done = self.observer.wait_for(lambda: all(v in self.observer.results for v in wanted),
+                                      self.args.timeout)
+        wall = time.monotonic() - started
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        if not done:
+            logger.error(f"{name}: timed out waiting for results")
+
+        results = [self.observer.results[v] for v in wanted if v in self.observer.results]
+        builds = len(results)
+        to_start, end_to_end, container, overhead = [], [], [], []
+        for version in wanted:
+            building = self.observer.statuses.get(version, {}).get("building")
+            result = self.observer.results.get(version)
+            runtime = self.docker.runtimes.get(version)
+            if building is not None:
+                to_start.append(building - triggered[version])
+            if result:
+                end_to_end.append(result["receivedAt"] - triggered[version])
+            if runtime is not None:
+                container.append(runtime)
+            if building is not None and result and runtime is not None:
+                # Time from start to result not spent in Gradle: checkout, version,
+                # waiting for a slot, upload and publish
+                overhead.append(result["receivedAt"] - building - runtime)
+
+        service_messages = self.broker.published[config.MQTT_CLIENT_ID]
+        topics = Counter()
+        for topic, count in self.broker.topics.items():
+            if topic.startswith("build/"):
+                topics[topic.split("/", 2)[2]] += count
+        metrics = {
+            "builds": builds,
+            "failed": sum(1 for r in results if r.get("status") != "success"),
+            "triggers": len(triggered) + (self.observer.replays - replays_before),
+            "replayed": self.observer.replays - replays_before,
+            "wallSeconds": round(wall, 3),
+            "throughputPerMin": round(builds * 60 / wall, 2) if wall else 0.0,
+            "triggerToStart": summary(to_start),
+            "endToEnd": summary(end_to_end),
+            "containerSeconds": summary(container),
+            "overhead": summary(overhead),
+            "mqttMessagesPerBuild": round(service_messages / max(builds, 1), 2),
+            "mqttTopicsPerBuild": {t: round(c / max(builds, 1), 2) for t, c in sorted(topics.items())},
+            "githubRequestsPerBuild": round((sum(self.github.requests.values()) - github_before) /
+                                            max(builds, 1), 2),
+            "cpuSecondsPerBuild": round((usage.ru_utime + usage.ru_stime - usage_before.ru_utime -
+                                         usage_before.ru_stime) / max(builds, 1), 3),
+            "peakRssMb": round(usage.ru_maxrss / 1024, 1)
+        }
+        if self.args.deltas:
+            patches = sum(len(v.get("deltas", [])) for r in results for v in r.get("variants", []))
+            metrics["deltasPerBuild"] = round(patches / max(builds, 1), 2)
+        return metrics
+
+    def sequential(self) -> dict:
+        versions = self._versions(self.args.builds)
+        triggered = {}
+
+        def fire():
+            for version, code in versions:
+                triggered[version] = time.monotonic()
+                self.observer.trigger(version, code, "bench-sequential")
+                self.observer.wait_for(lambda: version in self.observer.results, self.args.timeout)
+
+        return self._measure("sequential", versions, triggered, fire)
+
+    def storm(self) -> dict:
+        versions = self._versions(self.args.storm)
+        triggered = {}
+        duplicates = int(len(versions) * self.args.duplicates)
+
+        def fire():
+            for index, (version, code) in enumerate(versions):
+                triggered[version] = time.monotonic()
+                self.observer.trigger(version, code, f"bench-storm-{index}")
+            # Repeats of triggers already in flight are merged, not built again
+            for index in range(duplicates):
+                version, code = versions[index % len(versions)]
+                self.observer.trigger(version, code, f"bench-storm-dup-{index}")
+
+        metrics = self._measure("storm", versions, triggered, fire)
+        metrics["triggers"] = len(versions) + duplicates
+        metrics["merged"] = self.service.dedup.stats().get("merged")
+        return metrics
+
+
+    def downloads(self) -> dict:
+        version, code = self._versions(1)[0]
+        self.observer.trigger(version, code, "bench-downloads")
+        if not self.observer.wait_for(lambda: version in self.observer.results, self.args.timeout):
+            raise RuntimeError("downloads: build for the mirror timed out")
+        result = self.observer.results[version]
+        url, size = result["mirrorUrl"], result["apkSize"]
+
+        def fetch(headers: dict) -> Tuple[int, int]:
+            """Bytes received and 503 retries for one request."""
+            retries = 0
+            while True:
+                try:
+                    with urllib.request.urlopen(urllib.request.Request(url, headers=headers)) as response:
+                        received = 0
+                        while chunk := response.read(1024 * 1024):
+                            received += len(chunk)
+                        return received, retries
+                except urllib.error.HTTPError as e:
+                    if e.code != 503:
+                        raise
+                    retries += 1
+                    time.sleep(0.05)
+
+        def device(index: int) -> Tuple[float, int, int]:
+            started = time.monotonic()
+            if index % 2:
+                # Interrupted halfway, then resumed
+                first, retries = fetch({"Range": f"bytes=0-{size // 2 - 1}"})
+                rest, more = fetch({"Range": f"bytes={size // 2}-", "If-Range": f'"{result["sha256"]}"'})
+                received, retries = first + rest, retries + more
+            else:
+                received, retries = fetch({})
+            if received != size:
+                raise RuntimeError(f"Device {index} got {received} of {size} bytes")
+            return time.monotonic() - started, received, retries
+
+        usage_before = resource.getrusage(resource.RUSAGE_SELF)
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.args.downloads) as executor:
+            fetched = list(executor.map(device, range(self.args.downloads)))
+        wall = time.monotonic() - started
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        received = sum(f[1] for f in fetched)
+        return {
+            "downloads": len(fetched),
+            "wallSeconds": round(wall, 3),
+            "throughputMbPerSec": round(received / wall / (1024 * 1024), 1),
+            "downloadSeconds": summary([f[0] for f in fetched]),
+            "retried503": sum(f[2] for f in fetched),
+            "cpuSeconds": round(usage.ru_utime + usage.ru_stime - usage_before.ru_utime -
+                                usage_before.ru_stime, 3),
+            "mirror": self.service.artifact_server.stats()
+        }
+
+
+def git_commit() -> Optional[str]:
+    result = subprocess.run(["git", "rev-parse", "HEAD"], cwd=Path(__file__).parent,
+                            capture_output=True, text=True)
+    return result.stdout.strip() or None
+
+
+def compare(current: dict, baseline: dict, prefix: str = "") -> List[str]:
+    """Lines "metric: old -> new (+x%)" for numeric values present in both."""
+    lines = []
+    for key, value in current.items():
+        old = baseline.get(key) if isinstance(baseline, dict) else None
+        name = f"{prefix}{key}"
+        if isinstance(value, dict) and isinstance(old, dict):
+            lines += compare(value, old, f"{name}.")
+        elif isinstance(value, (int, float)) and isinstance(old, (int, float)) and \
+                not isinstance(value, bool):
+            change = f" ({(value - old) * 100 / old:+.1f}%)" if old else ""
+            lines.append(f"{name}: {old} -> {value}{change}")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the build service offline")
+    parser.add_argument("--scenarios", default="sequential,storm,downloads")
+    parser.add_argument("--builds", type=int, default=5, help="builds in the sequential run")
+    parser.add_argument("--storm", type=int, default=20, help="triggers in the storm run")
+    parser.add_argument("--duplicates", type=float, default=0.25,
+                        help="extra identical triggers in the storm, as a share of --storm")
+    parser.add_argument("--workers", type=int, default=2, help="BUILD_WORKERS")
+    parser.add_argument("--build-seconds", type=float, default=2.0,
+                        help="seconds a fake container takes to replay the Gradle log")
+    parser.add_argument("--gradle-log", type=Path,
+                        help="recorded build log (plain or .log.gz) instead of a synthetic one")
+    parser.add_argument("--apk-mb", type=float, default=8.0, help="size of the fake APKs")
+    parser.add_argument("--deltas", action="store_true", help="also publish delta patches")
+    parser.add_argument("--downloads", type=int, default=50,
+                        help="devices downloading from the artifact mirror at once")
+    parser.add_argument("--max-downloads", type=int, default=32, help="ARTIFACT_SERVER_MAX_DOWNLOADS")
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--output", type=Path, help="write the JSON results here (default stdout)")
+    parser.add_argument("--compare", type=Path, help="earlier results to compare against")
+    parser.add_argument("--verbose", action="store_true", help="show the service's log")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    work_dir = Path(tempfile.mkdtemp(prefix="iocast-bench-"))
+    broker = MiniBroker().start()
+    github = FakeGitHub(config.GITHUB_REPO).start()
+    configure(work_dir, broker, github, create_repository(work_dir / "origin.git"), args)
+    docker_client = FakeDockerClient(
+        log_lines=load_gradle_log(args.gradle_log) if args.gradle_log else None,
+        build_seconds=args.build_seconds,
+        apk_bytes=int(args.apk_mb * 1024 * 1024)
+    )
+
+    # Imported after configure(): module-level logging setup of the service
+    import build_service
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+
+    service = build_service.BuildService()
+    service.docker_client = docker_client
+    observer = Observer(broker)
+    results = {}
+    try:
+        service.start()
+        service.client.loop_start()
+        if not observer.wait_for(lambda: observer.service_status == "idle", 30):
+            raise RuntimeError("Build service did not come online")
+
+        bench = Benchmark(args, broker, github, docker_client, service, observer)
+        for name in args.scenarios.split(","):
+            print(f"Running {name}...", file=sys.stderr)
+            results[name] = getattr(bench, name)()
+    finally:
+        service.stop()
+        service.client.loop_stop()
+        observer.close()
+        github.stop()
+        broker.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "benchmark": "iocast-build-service",
+        "commit": git_commit(),
+        "timestamp": int(time.time()),
+        "python": platform.python_version(),
+        "settings": {
+            "builds": args.builds,
+            "storm": args.storm,
+            "duplicates": args.duplicates,
+            "workers": args.workers,
+            "buildSeconds": args.build_seconds,
+            "apkMb": args.apk_mb,
+            "logLines": len(docker_client.log_lines),
+            "deltas": args.deltas,
+            "downloads": args.downloads,
+            "maxDownloads": args.max_downloads
+        },
+        "scenarios": results
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())
+        for line in compare(report["scenarios"], baseline.get("scenarios", {})):
+            print(line, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Build Cache Server - Local Gradle HTTP build cache for task output reuse
+"""
+import base64
+import hmac
+import json
+import logging
+import os
+import re
+import secrets
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Optional
+from urllib.parse import urlparse
+
+import config
+from gradle_cache import GradleCache
+
+logger = logging.getLogger("BuildCacheServer")
+
+KEY_PATTERN = re.compile(r"^/cache/([0-9a-f]{16,128})$")
+INIT_SCRIPT_NAME = "iocast-build-cache.gradle"
+
+# Applied to every build through GRADLE_USER_HOME/init.d
+INIT_SCRIPT = """\
+gradle.settingsEvaluated {{ settings ->
+    settings.buildCache {{
+        remote(HttpBuildCache) {{
+            url = '{url}'
+            push = true
+            allowInsecureProtocol = true
+            credentials {{
+                username = '{username}'
+                password = '{password}'
+            }}
+        }}
+    }}
+}}
+"""
+
+
+class CacheStore:
+    """Content-addressed on-disk store of Gradle cache entries with LRU eviction."""
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0,
+                      "bytesServed": 0, "bytesStored": 0}
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.size = sum(p.stat().st_size for p in self.root.glob("*/*") if p.is_file())
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    def get(self, key: str) -> Optional[Path]:
+        path = self._path(key)
+        with self.lock:
+            if not path.exists():
+                self.stats["misses"] += 1
+                return None
+            os.utime(path)  # mark as recently used
+            self.stats["hits"] += 1
+            self.stats["bytesServed"] += path.stat().st_size
+        return path
+
+    def put(self, key: str, stream, length: int):
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        tmp = path.with_name(f".{key}.{threading.get_ident()}.tmp")
+        remaining = length
+        with open(tmp, "wb") as f:
+            while remaining > 0:
+                chunk = stream.read(min(remaining, 1024 * 1024))
+                if not chunk:
+                    break
+                f.write(chunk)
+                remaining -= len(chunk)
+        if remaining:
+            tmp.unlink(missing_ok=True)
+            raise IOError("Truncated cache entry upload")
+
+        with self.lock:
+            previous = path.stat().st_size if path.exists() else 0
+            os.replace(tmp, path)
+            self.size += length - previous
+            self.stats["stores"] += 1
+            self.stats["bytesStored"] += length
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Remove least recently used entries until below 90% of max_bytes."""
+        target = int(self.max_bytes * 0.9)
+        entries = []
+        for path in self.root.glob("*/*"):
+            if path.name.startswith("."):
+                continue
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+
+        for _, size, path in sorted(entries):
+            if self.size <= target:
+                break
+            path.unlink(missing_ok=True)
+            self.size -= size
+            self.stats["evictions"] += 1
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return dict(self.stats, size=self.size,
+                        hitRate=round(self.stats["hits"] / lookups, 3) if lookups else None)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    store: CacheStore = None
+    authorization: str = None  # expected Authorization header
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _authorized(self) -> bool:
+        """Check the build's credentials; answers 401 if they are wrong."""
+        if hmac.compare_digest(self.headers.get("Authorization", ""), self.authorization):
+            return True
+        self.send_response(401)
+        self.send_header("WWW-Authenticate", 'Basic realm="gradle-build-cache"')
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+        return False
+
+    def do_GET(self):
+        if self.path == "/stats":
+            body = json.dumps(self.store.snapshot()).encode("utf-8")
+            self._respond(200, body, "application/json")
+            return
+
+        match = KEY_PATTERN.match(self.path)
+        if not match:
+            self._respond(404)
+            return
+        if not self._authorized():
+            return
+
+        path = self.store.get(match.group(1))
+        if path is None:
+            self._respond(404)
+            return
+
+        try:
+            with open(path, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(size))
+                self.end_headers()
+                while chunk := f.read(1024 * 1024):
+                    self.wfile.write(chunk)
+        except FileNotFoundError:
+            # Evicted between lookup and open
+            self._respond(404)
+
+    def do_PUT(self):
+        match = KEY_PATTERN.match(self.path)
+        if not match:
+            self._respond(404)
+            return
+        # Anything stored here ends up in the APKs
+        if not self._authorized():
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        if length > self.store.max_bytes // 4:
+            self._respond(413)
+            return
+
+        try:
+            self.store.put(match.group(1), self.rfile, length)
+        except IOError as e:
+            logger.warning(f"Cache upload failed: {e}")
+            self._respond(400)
+            return
+        self._respond(201)
+
+    def _respond(self, status: int, body: bytes = b"", content_type: str = "text/plain"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+
+class BuildCacheServer:
+    """Serves the Gradle HTTP build cache protocol (GET/PUT /cache/<key>).
+
+    Build containers are pointed at it through an init script in the shared
+    Gradle home, so task outputs are reused across throwaway containers.
+    Cache entries are only served to and accepted from clients with the
+    credentials in that script, and the server listens on the address builds
+    reach it on (the Docker host gateway), not on every interface.
+    """
+
+    def __init__(self, port: Optional[int] = None, root: Optional[Path] = None,
+                 max_bytes: Optional[int] = None, bind: Optional[str] = None):
+        self.port = port if port is not None else config.GRADLE_REMOTE_CACHE_PORT
+        self.bind = bind or config.GRADLE_REMOTE_CACHE_BIND or urlparse(config.GRADLE_REMOTE_CACHE_URL).hostname
+        self.username = config.GRADLE_REMOTE_CACHE_USER
+        self.password = config.GRADLE_REMOTE_CACHE_PASSWORD or secrets.token_urlsafe(24)
+        root = Path(root) if root else Path(config.BUILD_CACHE_DIR) / "gradle-remote-cache"
+        max_bytes = max_bytes if max_bytes is not None else config.GRADLE_REMOTE_CACHE_MAX_MB * 1024 * 1024
+        self.store = CacheStore(root, max_bytes)
+        self.httpd = None
+
+    def start(self):
+        """Serve in a background thread."""
+        token = base64.b64encode(f"{self.username}:{self.password}".encode("utf-8")).decode("ascii")
+        handler = type("CacheHandler", (_Handler,), {"store": self.store,
+                                                     "authorization": f"Basic {token}"})
+        self.httpd = ThreadingHTTPServer((self.bind, self.port), handler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, name="build-cache-server",
+                         daemon=True).start()
+        logger.info(f"Gradle build cache listening on {self.bind}:{self.port} "
+                    f"({self.store.size // (1024 * 1024)} MB cached)")
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd = None
+
+    def install_init_script(self, gradle_cache: GradleCache, url: Optional[str] = None):
+        """Point every Gradle build using gradle_cache at this server."""
+        init_dir = gradle_cache.root / "init.d"
+        init_dir.mkdir(parents=True, exist_ok=True)
+        script = INIT_SCRIPT.format(url=url or config.GRADLE_REMOTE_CACHE_URL,
+                                    username=self.username, password=self.password)
+        path = init_dir / INIT_SCRIPT_NAME
+        path.touch(mode=0o600)
+        path.chmod(0o600)
+        path.write_text(script)
+
+    @staticmethod
+    def remove_init_script(gradle_cache: GradleCache):
+        (gradle_cache.root / "init.d" / INIT_SCRIPT_NAME).unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        return self.store.snapshot()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Build Queue - Prioritised FIFO of build jobs shared by the worker pool
+"""
+import heapq
+import itertools
+import threading
+import time
+import uuid
+from typing import List, Optional
+
+
+class BuildJob:
+    """A single build request and its lifecycle state."""
+
+    def __init__(self, branch: str, version: Optional[str], version_code: Optional[int],
+                 commit: Optional[str] = None, requested_by: str = "unknown",
+                 priority: int = 0, variants: Optional[List[str]] = None,
+                 speculative: bool = False):
+        self.id = uuid.uuid4().hex[:12]
+        self.branch = branch
+        self.commit = commit
+        self.version = version
+        self.version_code = version_code
+        self.requested_by = requested_by
+        self.priority = priority
+        self.variants = variants or ["debug"]
+        self.speculative = speculative  # prebuild of a branch head, not published
+        self.key: Optional[str] = None  # dedup key of the trigger (dedup.request_key)
+        self.requesters = [requested_by]  # everyone whose identical trigger was merged in
+        self.rollout: Optional[dict] = None  # {"devices", "variant"} to update once published
+        self.profile = False  # run Gradle with profiling (see GradleProfile)
+        self.resume: Optional[dict] = None  # progress before a restart (see JobJournal.pending)
+
+        self.state = "queued"  # queued, running, success, failed, cancelled, timeout
+        self.stage: Optional[str] = None  # prepare, build, publish while running
+        self.queued_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.worker: Optional[int] = None
+        self.builders = []
+        self.cancelled = False
+        self.build_started_at: Optional[float] = None  # entered the build stage
+        self.last_output: Optional[float] = None  # monotonic, last progress of a leased build
+        self.timed_out: Optional[str] = None  # why the watchdog stopped it
+        self.cancel_requested_at: Optional[float] = None  # monotonic
+        self.cancel_latency: Optional[float] = None  # cancel request -> slot freed
+        # Time spent waiting for the next stage or a build slot; not held against BUILD_TIMEOUT
+        self.paused = 0  # waits in progress
+        self.paused_at: Optional[float] = None
+        self.paused_seconds = 0.0
+        self.clock_lock = threading.Lock()
+        self.published_status: Optional[str] = None
+
+    def pause(self):
+        """Start waiting on something other than this job's own work."""
+        with self.clock_lock:
+            if self.paused == 0:
+                self.paused_at = time.time()
+            self.paused += 1
+
+    def unpause(self):
+        """End a wait started by pause(); extra calls are ignored."""
+        with self.clock_lock:
+            if self.paused == 0:
+                return
+            self.paused -= 1
+            if self.paused == 0:
+                self.paused_seconds += time.time() - self.paused_at
+                self.paused_at = None
+
+    def active_time(self, now: Optional[float] = None) -> float:
+        """Seconds since leaving the queue, minus the time spent paused."""
+        now = now or time.time()
+        with self.clock_lock:
+            paused = self.paused_seconds + (now - self.paused_at if self.paused else 0.0)
+        return now - self.started_at - paused
+
+    @property
+    def wait_time(self) -> float:
+        """Seconds spent in the queue (so far, if still queued)."""
+        return (self.started_at or time.time()) - self.queued_at
+
+    def to_dict(self) -> dict:
+        return {
+            "jobId": self.id,
+            "state": self.state,
+            "stage": self.stage,
+            "branch": self.branch,
+            "commit": self.commit,
+            "version": self.version,
+            "versionCode": self.version_code,
+            "variants": self.variants,
+            "requestedBy": self.requested_by,
+            "requesters": self.requesters,
+            "priority": self.priority,
+            "speculative": self.speculative,
+            "worker": self.worker,
+            "queuedAt": int(self.queued_at),
+            "startedAt": int(self.started_at) if self.started_at else None,
+            "finishedAt": int(self.finished_at) if self.finished_at else None,
+            "waitTime": round(self.wait_time, 1)
+        }
+
+
+class BuildQueue:
+    """Thread-safe priority queue of BuildJobs.
+
+    Higher priority jobs are taken first; jobs with equal priority are taken
+    in arrival order.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def put(self, job: BuildJob):
+        with self._cond:
+            heapq.heappush(self._heap, (-job.priority, next(self._counter), job))
+            self._cond.notify()
+
+    def get(self, timeout: Optional[float] = None) -> Optional[BuildJob]:
+        """Block until a job is available. Returns None on timeout or close."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while not self._heap:
+                if self._closed:
+                    return None
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            return heapq.heappop(self._heap)[2]
+
+    def remove(self, job_id: str) -> Optional[BuildJob]:
+        """Remove a queued job. Returns it, or None if it is not queued."""
+        with self._cond:
+            for i, (_, _, job) in enumerate(self._heap):
+                if job.id == job_id:
+                    self._heap.pop(i)
+                    heapq.heapify(self._heap)
+                    return job
+        return None
+
+    def snapshot(self) -> List[BuildJob]:
+        """Queued jobs in the order they will be taken."""
+        with self._cond:
+            return [job for _, _, job in sorted(self._heap)]
+
+    def close(self):
+        """Wake all waiting workers; get() returns None once drained."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._heap)
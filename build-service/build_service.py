@@ -7,17 +7,47 @@ and uploads to GitHub Releases.
 """
 import json
 import logging
+import shutil
 import signal
+import sqlite3
 import sys
 import time
 import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from pathlib import Path
+from typing import Optional
 
+import docker
 import paho.mqtt.client as mqtt
+import requests
 
 import config
-from builder import AndroidBuilder
+from artifact_cache import ArtifactCache
+from artifact_server import ArtifactServer
+from build_cache_server import BuildCacheServer
+from build_queue import BuildJob, BuildQueue
+from builder import (DEFAULT_VARIANT, VARIANT_NAME, AndroidBuilder, build_command,
+                     remove_stale_containers, task_variant)
+from container_pool import ContainerPool
+from dedup import Deduplicator, request_key
+from delta import DeltaPublisher
+from estimator import ProgressEstimator
+from git_mirror import GitMirror
 from github_release import GitHubReleaser
+from gradle_cache import GradleCache
+from gradle_profile import find_regressions, profile_summary
+from journal import MAX_RESUMES, JobJournal
+from log_sink import LogStore
+from pipeline import BuildGroup, BuildRun, Stage
+from prebuild import PREBUILD_PRIORITY, PrebuildStore, PrebuildWatcher
+from progress import ProgressPublisher
+from resources import ResourceScheduler
+from rollout import RolloutManager
+from telemetry import BuildTimer, TelemetryStore, percentile
+from watchdog import BuildWatchdog
+from worker_registry import WorkerRegistry
 
 # Setup logging
 logging.basicConfig(
@@ -26,6 +56,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger("BuildService")
 
+# Number of finished jobs kept for jobs/query lookups
+FINISHED_JOBS_KEPT = 50
+
 
 def validate_config():
     """Validate required configuration at startup."""
@@ -37,6 +70,21 @@ def validate_config():
     if not config.GITHUB_TOKEN:
         errors.append("GITHUB_TOKEN environment variable is not set")
 
+    if config.BUILD_WORKERS < 1:
+        errors.append("BUILD_WORKERS must be at least 1")
+
+    if config.PIPELINE_IO_WORKERS < 1:
+        errors.append("PIPELINE_IO_WORKERS must be at least 1")
+
+    if config.BUILD_MODE not in ("local", "coordinator"):
+        errors.append("BUILD_MODE must be local or coordinator")
+
+    if config.ARTIFACT_SERVER_PORT > 0 and not config.ARTIFACT_SERVER_URL:
+        errors.append("ARTIFACT_SERVER_URL must be set when ARTIFACT_SERVER_PORT is")
+
+    if config.GRADLE_REGRESSION_ACTION not in ("warn", "fail"):
+        errors.append("GRADLE_REGRESSION_ACTION must be warn or fail")
+
     if errors:
         for error in errors:
             logger.error(f"Configuration error: {error}")
@@ -48,10 +96,53 @@ class BuildService:
 
     def __init__(self):
         self.client = mqtt.Client(client_id=config.MQTT_CLIENT_ID)
-        self.builder = AndroidBuilder()
+        self.mqtt_out = ProgressPublisher(self.client)
         self.releaser = GitHubReleaser()
-        self.current_build = None
+        self.artifact_cache = ArtifactCache()
+        self.deltas = DeltaPublisher(self.releaser) if config.DELTA_BASE_COUNT > 0 else None
+        self.telemetry = TelemetryStore()
+        self.logs = LogStore()
+        self.dedup = Deduplicator()
+        self.journal = JobJournal() if config.JOB_JOURNAL else None
+        self.queue = BuildQueue()
+        self.running_jobs = {}
+        self.finished_jobs = OrderedDict()
+        self.recent_waits = deque(maxlen=FINISHED_JOBS_KEPT)
+        self.cancel_latencies = deque(maxlen=FINISHED_JOBS_KEPT)
+        self.watchdog = BuildWatchdog(self._running_jobs, self._timed_out)
         self.build_lock = threading.Lock()
+        # GitHub lookups for releases/query stay off the MQTT network thread
+        self.release_queries = ThreadPoolExecutor(max_workers=1, thread_name_prefix="releases")
+        # Triggers resolve their commit (a mirror fetch); one thread keeps them in order
+        self.triggers = ThreadPoolExecutor(max_workers=1, thread_name_prefix="triggers")
+        self.docker_client = None
+        self.resources = None
+        self.prebuilds = None
+        self.prebuild_watcher = None
+        self.gradle_cache = None
+        self.mirror = None
+        # In coordinator mode the compile stage only waits for leased builds
+        self.registry = WorkerRegistry(self.client) if config.BUILD_MODE == "coordinator" else None
+        self.rollouts = RolloutManager(self.client, self.mqtt_out)
+        self.prepare_stage = Stage(
+            "prepare", self._prepare,
+            workers=config.PIPELINE_IO_WORKERS,
+            source=lambda timeout: self.queue.get(timeout=timeout)
+        )
+        self.compile_stage = Stage(
+            "compile", self._compile_remote if self.registry else self._compile,
+            workers=config.REMOTE_MAX_BUILDS if self.registry else config.BUILD_WORKERS,
+            capacity=config.PIPELINE_DEPTH
+        )
+        self.publish_stage = Stage(
+            "publish", self._publish,
+            workers=config.PIPELINE_IO_WORKERS, capacity=config.PIPELINE_DEPTH
+        )
+        self.reaper = Stage("reaper", self._reap)
+        self.stages = [self.prepare_stage, self.compile_stage, self.publish_stage, self.reaper]
+        self.pool = None
+        self.cache_server = None
+        self.artifact_server = None
         self.running = True
 
     def connect(self):
@@ -71,10 +162,21 @@ class BuildService:
             # Subscribe to build topics
             client.subscribe(config.TOPIC_TRIGGER)
             client.subscribe(config.TOPIC_CANCEL)
-            logger.info(f"Subscribed to {config.TOPIC_TRIGGER} and {config.TOPIC_CANCEL}")
+            client.subscribe(config.TOPIC_JOBS_QUERY)
+            client.subscribe(config.TOPIC_METRICS_QUERY)
+            client.subscribe(config.TOPIC_LOGS_QUERY)
+            client.subscribe(config.TOPIC_RELEASES_QUERY)
+            logger.info(f"Subscribed to {config.TOPIC_TRIGGER}, {config.TOPIC_CANCEL}, "
+                        f"{config.TOPIC_JOBS_QUERY}, {config.TOPIC_METRICS_QUERY}, "
+                        f"{config.TOPIC_LOGS_QUERY} and {config.TOPIC_RELEASES_QUERY}")
+            if self.registry:
+                self.registry.subscribe()
+            self.rollouts.subscribe()
 
             # Publish online status
             self._publish_status("idle", "Build service online and ready")
+            self._publish_queue()
+            self.release_queries.submit(self._publish_latest_release)
         else:
             logger.error(f"Failed to connect to MQTT broker: {rc}")
 
@@ -93,177 +195,1002 @@ class BuildService:
             logger.error(f"Invalid JSON payload on {topic}")
             return
 
+        # Worker heartbeats and progress, and device telemetry, are too frequent to log
+        if self.registry and self.registry.handle(topic, payload):
+            return
+        if self.rollouts.handle(topic, payload):
+            return
+
         logger.info(f"Received message on {topic}: {payload}")
 
         if topic == config.TOPIC_TRIGGER:
-            self._handle_trigger(payload)
+            self.triggers.submit(self._handle_trigger, payload)
         elif topic == config.TOPIC_CANCEL:
             self._handle_cancel(payload)
+        elif topic == config.TOPIC_JOBS_QUERY:
+            self._handle_jobs_query(payload)
+        elif topic == config.TOPIC_METRICS_QUERY:
+            self._handle_metrics_query(payload)
+        elif topic == config.TOPIC_LOGS_QUERY:
+            self._handle_logs_query(payload)
+        elif topic == config.TOPIC_RELEASES_QUERY:
+            self.release_queries.submit(self._handle_releases_query, payload)
 
     def _handle_trigger(self, payload):
-        """Handle build trigger request."""
+        """Handle build trigger request by queueing a job."""
+        # Extract build parameters
+        branch = payload.get("branch", "main")
+        commit = payload.get("commit")
+        version = payload.get("version")
+        version_code = payload.get("versionCode")
+        requested_by = payload.get("requestedBy", "unknown")
+
+        try:
+            variants = self._parse_variants(payload)
+        except ValueError as e:
+            logger.error(f"Invalid variants in trigger payload: {e}")
+            self._publish_status("error", str(e))
+            return
+
+        if not version or not version_code:
+            logger.error("Missing version or versionCode in trigger payload")
+            self._publish_status("error", "Missing version or versionCode")
+            return
+
+        try:
+            priority = int(payload.get("priority", 0))
+        except (TypeError, ValueError):
+            logger.error("Invalid priority in trigger payload")
+            self._publish_status("error", "Invalid priority")
+            return
+
+        try:
+            rollout = self._parse_rollout(payload, variants)
+        except ValueError as e:
+            logger.error(f"Invalid rollout in trigger payload: {e}")
+            self._publish_status("error", str(e))
+            return
+
+        profile = payload.get("profile", config.GRADLE_PROFILE)
+        if not isinstance(profile, bool):
+            logger.error("Invalid profile in trigger payload")
+            self._publish_status("error", "profile must be true or false")
+            return
+
+        # The exact commit identifies the build; a branch that moved is a new one
+        try:
+            commit = self.mirror.resolve(commit or branch)
+        except Exception as e:
+            logger.error(f"Could not resolve {commit or branch}: {e}")
+            self._publish_status("error", f"Unknown branch or commit: {commit or branch}")
+            return
+
+        key = request_key(payload, variants, commit)
+        existing, result = self.dedup.lookup(key)
+        if existing is not None:
+            if rollout and not existing.rollout:
+                existing.rollout = rollout
+            self._merge_trigger(existing, requested_by, priority)
+            return
+        if result is not None:
+            self._replay_result(result, requested_by)
+            return
+
+        job = BuildJob(
+            branch=branch,
+            version=version,
+            version_code=version_code,
+            commit=commit,
+            requested_by=requested_by,
+            priority=priority,
+            variants=variants
+        )
+        job.key = key
+        job.rollout = rollout
+        job.profile = profile
+        self.dedup.register(key, job)
+        if self.journal:
+            self.journal.queued(job)
+        self.queue.put(job)
+
+        logger.info(f"Queued job {job.id} (v{version}, priority {priority}), "
+                    f"queue depth {len(self.queue)}")
+        self._publish_status("queued", f"Build v{version} queued", job)
+        self._preempt_prebuilds(job)
+        self._publish_queue()
+
+    def _merge_trigger(self, job: BuildJob, requested_by: str, priority: int):
+        """Subscribe the requester of an identical trigger to a job in flight."""
+        job.requesters.append(requested_by)
+        # A more urgent duplicate moves a queued job up
+        if priority > job.priority and self.queue.remove(job.id):
+            job.priority = priority
+            self.queue.put(job)
+        self._journal(job, "merged", requesters=job.requesters, priority=job.priority,
+                      rollout=job.rollout)
+
+        logger.info(f"Merged trigger from {requested_by} into job {job.id} "
+                    f"({len(job.requesters)} requesters)")
+        self._publish_status(
+            job.published_status or "queued",
+            f"Build v{job.version} already {job.state} as job {job.id}",
+            job, force=True
+        )
+        self._publish_queue()
+
+    def _replay_result(self, result: dict, requested_by: str):
+        """Answer a repeated trigger with the result of the identical build."""
+        logger.info(f"Answering trigger from {requested_by} with result of job {result['jobId']}")
+        payload = dict(result, deduplicated=True, requestedBy=requested_by,
+                       timestamp=int(time.time()))
+        # Not retained - the retained result stays that of the latest build
+        self.mqtt_out.publish(config.TOPIC_RESULT, payload, force=True)
+
+    def _submit_prebuild(self, branch: str, sha: str):
+        """Queue a speculative build of a new branch head (called by the watcher)."""
+        job = BuildJob(
+            branch=branch,
+            version=None,
+            version_code=None,
+            commit=sha,
+            requested_by="prebuild",
+            priority=PREBUILD_PRIORITY,
+            variants=config.PREBUILD_VARIANTS,
+            speculative=True
+        )
+        self.queue.put(job)
+        self._publish_queue()
+
+    def _running_jobs(self) -> list:
         with self.build_lock:
-            if self.current_build is not None:
-                logger.warning("Build already in progress, rejecting request")
-                self._publish_status("busy", "Build already in progress")
-                return
+            return list(self.running_jobs.values())
+
+    def _timed_out(self, job: BuildJob, reason: str):
+        """Called by the watchdog when it stops a job that ran out of time."""
+        self._publish_status("timeout", reason, job)
+
+    def _is_idle(self) -> bool:
+        with self.build_lock:
+            return not self.running_jobs and len(self.queue) == 0
+
+    def _preempt_prebuilds(self, job: BuildJob):
+        """Make way for a real build.
+
+        Queued prebuilds are dropped (a real build must never wait for one
+        that has not started) and running ones are cancelled unless they are
+        building what job is going to build.
+        """
+        for queued in self.queue.snapshot():
+            if queued.speculative and self.queue.remove(queued.id):
+                logger.info(f"Dropping queued prebuild {queued.id} for job {job.id}")
+                queued.cancelled = True
+                self._finish_job(queued, "cancelled")
+
+        with self.build_lock:
+            for other in self.running_jobs.values():
+                if not other.speculative or other.cancelled:
+                    continue
+                if other.commit == job.commit or (not job.commit and other.branch == job.branch):
+                    continue
+                logger.info(f"Cancelling prebuild {other.id} for job {job.id}")
+                self.watchdog.cancel(other)
 
-            # Extract build parameters
-            branch = payload.get("branch", "main")
-            version = payload.get("version")
-            version_code = payload.get("versionCode")
-            requested_by = payload.get("requestedBy", "unknown")
+    @staticmethod
+    def _parse_rollout(payload, variants: list) -> Optional[dict]:
+        """Rollout of a trigger: "rollout": true, or {"devices": [...], "variant": ...}."""
+        rollout = payload.get("rollout", config.ROLLOUT_AUTO)
+        if not rollout:
+            return None
+        if not isinstance(rollout, dict):
+            rollout = {}
+        devices = rollout.get("devices")
+        if devices is not None and (not isinstance(devices, list) or
+                                    not all(isinstance(d, str) for d in devices)):
+            raise ValueError("rollout devices must be a list of device ids")
+        variant = rollout.get("variant", variants[0])
+        if variant not in variants:
+            raise ValueError(f"rollout variant {variant} is not built")
+        return {"devices": devices, "variant": variant}
 
-            if not version or not version_code:
-                logger.error("Missing version or versionCode in trigger payload")
-                self._publish_status("error", "Missing version or versionCode")
+    @staticmethod
+    def _parse_variants(payload) -> list:
+        """Variants to build from a trigger's "variants" and/or assemble "tasks"."""
+        variants = payload.get("variants") or []
+        tasks = payload.get("tasks") or []
+        if not isinstance(variants, list) or not isinstance(tasks, list):
+            raise ValueError("variants and tasks must be lists")
+
+        result = []
+        for variant in variants:
+            if not isinstance(variant, str) or not VARIANT_NAME.match(variant):
+                raise ValueError(f"Invalid variant: {variant}")
+            result.append(variant)
+        for task in tasks:
+            variant = task_variant(task) if isinstance(task, str) else None
+            if variant is None:
+                raise ValueError(f"Unsupported task (only assemble tasks): {task}")
+            result.append(variant)
+
+        # Keep order, drop duplicates
+        return list(dict.fromkeys(result)) or [DEFAULT_VARIANT]
+
+    def _handle_cancel(self, payload):
+        """Handle build cancel request for a queued or running job.
+
+        Without a jobId the running build is cancelled if there is exactly one.
+        """
+        job_id = payload.get("jobId")
+
+        with self.build_lock:
+            if job_id is None:
+                if len(self.running_jobs) != 1:
+                    logger.info("Cancel without jobId is ambiguous or nothing is running")
+                    return
+                job_id = next(iter(self.running_jobs))
+
+            job = self.running_jobs.get(job_id)
+            if job is not None:
+                logger.info(f"Cancelling running job {job_id}")
+                self.watchdog.cancel(job)
+                self._publish_status("cancelled", "Build cancelled by user", job)
                 return
 
-            self.current_build = {
-                "branch": branch,
-                "version": version,
-                "versionCode": version_code,
-                "requestedBy": requested_by,
-                "startedAt": int(time.time())
+        job = self.queue.remove(job_id)
+        if job is None:
+            logger.info(f"No queued or running job {job_id} to cancel")
+            return
+
+        logger.info(f"Removed queued job {job_id}")
+        job.cancelled = True
+        self._finish_job(job, "cancelled")
+        self._publish_status("cancelled", "Build cancelled by user", job)
+        self._publish_queue()
+
+    def _handle_jobs_query(self, payload):
+        """Answer a jobs query with the job list, or a single job by jobId."""
+        job_id = payload.get("jobId")
+        if job_id is None:
+            self._publish_queue()
+            return
+
+        job = self._find_job(job_id)
+        response = job.to_dict() if job else {"jobId": job_id, "error": "Unknown job"}
+        self.client.publish(config.TOPIC_JOBS_INFO, json.dumps(response))
+
+    def _handle_logs_query(self, payload):
+        """Answer a log query with a byte range of a job's build log."""
+        job_id = payload.get("jobId")
+        try:
+            offset = int(payload.get("offset", 0))
+            length = int(payload.get("length", config.BUILD_LOG_CHUNK_BYTES))
+        except (TypeError, ValueError):
+            offset, length = -1, 0
+
+        if not job_id or offset < 0:
+            response = {"jobId": job_id, "error": "jobId and a valid offset are required"}
+        else:
+            response = self.logs.read(job_id, offset, length) or {
+                "jobId": job_id, "error": "No log for job"
             }
+        self.client.publish(config.TOPIC_LOGS, json.dumps(response))
+
+    def _handle_releases_query(self, payload):
+        """Answer a release query from the cached GitHub release metadata.
+
+        {"version": ...} returns that release, {"latest": true} the latest
+        one and otherwise the newest "limit" (default 10) releases.
+        """
+        response = {"requestId": payload.get("requestId")}
+        try:
+            if payload.get("version"):
+                response["release"] = self.releaser.get_release(str(payload["version"]))
+            elif payload.get("latest"):
+                response["release"] = self.releaser.get_latest_release()
+            else:
+                limit = min(max(int(payload.get("limit", 10)), 1), 100)
+                response["releases"] = self.releaser.list_releases(limit)
+        except (TypeError, ValueError) as e:
+            response["error"] = f"Invalid query: {e}"
+        except requests.RequestException as e:
+            logger.warning(f"Release query failed: {e}")
+            response["error"] = f"GitHub request failed: {e}"
+        response["cache"] = self.releaser.stats()
+        response["timestamp"] = int(time.time())
+        self.mqtt_out.publish(config.TOPIC_RELEASES, response, force=True)
 
-        # Start build in separate thread
-        build_thread = threading.Thread(
-            target=self._run_build,
-            args=(branch, version, version_code)
+    def _publish_latest_release(self):
+        """Republish the retained latest release after a publish."""
+        try:
+            release = self.releaser.get_latest_release()
+        except requests.RequestException as e:
+            logger.warning(f"Could not refresh the latest release: {e}")
+            return
+        self.mqtt_out.publish(
+            config.TOPIC_RELEASES_LATEST,
+            {"release": release, "timestamp": int(time.time())},
+            retain=True, force=True
         )
-        build_thread.start()
 
-    def _handle_cancel(self, payload):
-        """Handle build cancel request."""
+    def _find_job(self, job_id: str):
         with self.build_lock:
-            if self.current_build is None:
-                logger.info("No build in progress to cancel")
+            job = self.running_jobs.get(job_id) or self.finished_jobs.get(job_id)
+        if job is None:
+            job = next((j for j in self.queue.snapshot() if j.id == job_id), None)
+        return job
+
+    def _new_builder(self) -> AndroidBuilder:
+        return AndroidBuilder(
+            docker_client=self.docker_client,
+            gradle_cache=self.gradle_cache,
+            mirror=self.mirror,
+            pool=self.pool
+        )
+
+    def _prepare(self, job: BuildJob):
+        """I/O stage: resolve the commit, look up the cache, check out and set the version."""
+        if job.cancelled:
+            return
+        # Build workers check out and build themselves in coordinator mode
+        builder = None if self.registry else self._new_builder()
+        run = BuildRun(job, builder)
+
+        with self.build_lock:
+            job.state = "running"
+            job.stage = "prepare"
+            job.started_at = time.time()
+            job.builders = run.builders
+            self.running_jobs[job.id] = job
+            self.recent_waits.append(job.wait_time)
+
+        logger.info(f"Starting job {job.id} after {job.wait_time:.1f}s in queue")
+        self._publish_queue()
+
+        try:
+            if job.speculative:
+                self._prepare_prebuild(run)
                 return
 
-            logger.info("Cancelling current build")
-            self.builder.cancel()
-            self.current_build = None
-            self._publish_status("cancelled", "Build cancelled by user")
+            # Step 1: Resolve the exact commit and look for cached artifacts
+            self._publish_progress(job, 5, "Resolving commit")
+            with run.timer.phase("resolve"):
+                run.commit = job.commit = self.mirror.resolve(job.commit or job.branch)
+                self._journal(job, "resolved", commit=run.commit)
+                run.image_id = self.registry.image_id() if self.registry else builder.image_id()
+                for variant in run.variants:
+                    run.keys[variant] = ArtifactCache.make_key(
+                        run.commit, job.version, job.version_code, run.image_id,
+                        build_command([variant])
+                    )
+                    # Pinned until the run is reaped, so eviction cannot pull it from under publish
+                    cached = self.artifact_cache.lookup(run.keys[variant], pin=True)
+                    if cached:
+                        run.cached[variant] = cached
+
+            missing = [v for v in run.variants if v not in run.cached]
+            if not missing:
+                logger.info(f"Artifact cache hit for {run.commit[:12]} v{job.version}")
+                self._hand_over(run, self.publish_stage)
+                return
+            if self.registry:
+                self._hand_over(run, self.compile_stage)
+                return
+
+            # Variants get their own container and worktree when a build's share
+            # of cores covers all of them, otherwise one Gradle invocation builds them all
+            if (len(missing) > 1 and
+                    self.resources.build_cpus >= config.MATRIX_CORES_PER_BUILD * len(missing)):
+                plan = [[variant] for variant in missing]
+            else:
+                plan = [missing]
+            for index, variants in enumerate(plan):
+                group_builder = builder if index == 0 else self._new_builder()
+                log_id = job.id if len(plan) == 1 else f"{job.id}-{variants[0]}"
+                run.groups.append(BuildGroup(group_builder, variants, log_id))
+            with self.build_lock:
+                job.builders = run.builders
+            logger.info(f"Building {', '.join(missing)} for job {job.id} in "
+                        f"{len(plan)} Gradle run(s)")
+
+            # A speculative build of this commit leaves a checkout with Gradle
+            # outputs; building there only redoes what the version change touches
+            first = run.groups[0]
+            if job.resume and job.resume.get("workDirs"):
+                self._adopt_checkouts(run)
+            elif self.prebuilds:
+                first.prebuilt = self.prebuilds.take(run.commit, timeout=config.BUILD_TIMEOUT,
+                                                     cancelled=lambda: job.cancelled)
+                if job.cancelled:
+                    raise RuntimeError("Build cancelled")
+                if first.prebuilt:
+                    first.clone_dir = first.builder.adopt_worktree(
+                        Path(first.prebuilt["path"]), run.commit
+                    )
+
+            # Step 2: Check out repository from the local mirror
+            self._publish_progress(job, 10, "Cloning repository")
+            with run.timer.phase("clone"):
+                for group in run.groups:
+                    if not group.clone_dir:
+                        group.clone_dir = group.builder.clone_repo(job.branch, run.commit)
+            # Prebuilt checkouts belong to the prebuild store, not to this job
+            work_dirs = [None if g.prebuilt else str(g.clone_dir) for g in run.groups]
+            self._journal(job, "cloned", workDirs=work_dirs)
 
-    def _run_build(self, branch: str, version: str, version_code: int):
-        """Run the build process."""
-        start_time = time.time()
+            # Step 3: Update version in build.gradle
+            self._publish_progress(job, 20, "Updating version")
+            with run.timer.phase("version"):
+                for group in run.groups:
+                    if not (group.resumed and job.resume["stage"] == "versioned"):
+                        group.builder.update_version(group.clone_dir, job.version, job.version_code)
+            self._journal(job, "versioned")
 
+            # Waits here while all build slots are busy and the handoff is full
+            self._hand_over(run, self.compile_stage)
+
+        except Exception as e:
+            self._fail_build(run, e)
+
+    @staticmethod
+    def _hand_over(run: BuildRun, stage: Stage):
+        """Pass run to the next stage, giving up if the job is cancelled while waiting.
+
+        The job's clock is paused until the stage picks it up (see BuildJob.active_time).
+        """
+        run.job.pause()
+        if run.job.cancelled or not stage.put(run, cancelled=lambda: run.job.cancelled):
+            run.job.unpause()
+            raise RuntimeError("Build cancelled")
+
+    def _adopt_checkouts(self, run: BuildRun):
+        """Build in the worktrees a job had before a restart, if it still plans the same groups."""
+        work_dirs = run.job.resume.pop("workDirs")
+        if len(work_dirs) == len(run.groups):
+            for group, work_dir in zip(run.groups, work_dirs):
+                if work_dir and Path(work_dir).is_dir():
+                    group.clone_dir = group.builder.adopt_worktree(Path(work_dir), run.commit)
+                    group.resumed = True
+            return
+        # Split into groups differently now (other cores free): start from fresh checkouts
+        for work_dir in work_dirs:
+            if work_dir:
+                self.mirror.remove_worktree(Path(work_dir))
+
+    def _prepare_prebuild(self, run: BuildRun):
+        """Check out a branch head for a speculative build, keeping the repo's version."""
+        job = run.job
+        group = BuildGroup(run.builder, job.variants, job.id)
+        run.groups.append(group)
+        with run.timer.phase("clone"):
+            group.clone_dir = group.builder.clone_repo(
+                job.branch, job.commit, dest=self.prebuilds.path_for(job.commit)
+            )
+        self._hand_over(run, self.compile_stage)
+
+    def _compile(self, run: BuildRun):
+        """CPU stage: run Gradle in build containers, one per variant group."""
+        job = run.job
+        job.unpause()
         try:
-            # Step 1: Clone repository
-            self._publish_progress(10, "Cloning repository")
-            clone_dir = self.builder.clone_repo(branch)
-
-            # Step 2: Update version in build.gradle
-            self._publish_progress(20, "Updating version")
-            self.builder.update_version(clone_dir, version, version_code)
-
-            # Step 3: Build APK
-            self._publish_progress(30, "Building APK (this may take a while)")
-            apk_path = self.builder.build_apk(
-                clone_dir,
-                progress_callback=self._build_progress_callback
+            if job.cancelled:
+                raise RuntimeError("Build cancelled")
+            job.stage = "build"
+            job.build_started_at = time.time()
+
+            # Step 4: Build APKs
+            self._publish_progress(job, 30, "Building APK (this may take a while)")
+            with run.timer.phase("build"):
+                if len(run.groups) == 1:
+                    self._compile_group(run, run.groups[0], run.timer)
+                else:
+                    self._compile_parallel(run)
+
+            if job.speculative:
+                # Nothing to publish, the checkout is kept for the real build
+                run.status = "success"
+                self._finish_job(job, run.status)
+                logger.info(f"Prebuild {job.id} of {run.commit[:12]} done in {run.build_time}s")
+                self.reaper.put(run)
+                return
+
+            for group in run.groups:
+                if group.builder.profile:
+                    run.profiles.append(dict(group.builder.profile, variants=group.variants))
+            self._check_profiles(run)
+            self._journal_built(run)
+            self._stage_uploads(run)
+            self.publish_stage.put(run)
+
+        except Exception as e:
+            self._fail_build(run, e)
+
+    def _compile_remote(self, run: BuildRun):
+        """CPU stage in coordinator mode: lease the build to a worker and wait for it."""
+        job = run.job
+        job.unpause()
+        try:
+            if job.cancelled:
+                raise RuntimeError("Build cancelled")
+            job.stage = "build"
+            job.build_started_at = time.time()
+
+            self._publish_progress(job, 30, "Waiting for a build worker")
+            request = {
+                "jobId": job.id,
+                "branch": job.branch,
+                "commit": run.commit,
+                "version": job.version,
+                "versionCode": job.version_code,
+                "variants": [v for v in run.variants if v not in run.cached],
+                "imageId": run.image_id,
+                "profile": self.telemetry.task_profile(config.ETA_HISTORY_BUILDS),
+                "gradleProfile": job.profile
+            }
+            with run.timer.phase("build"):
+                run.lease = self.registry.run(
+                    request,
+                    progress=lambda progress, step, eta=None: self._lease_progress(
+                        job, progress, step, eta),
+                    cancelled=lambda: job.cancelled
+                )
+            run.timer.merge(run.lease.get("phases", {}), run.lease.get("tasks", []))
+            if run.lease.get("log"):
+                # Served by logs/query like a local build log
+                shutil.move(str(self.registry.store_path(run.lease["log"])), str(self.logs.path(job.id)))
+
+            if run.lease["status"] != "success":
+                raise RuntimeError(run.lease.get("error") or f"Build {run.lease['status']} on worker")
+            for variant, artifact in run.lease["artifacts"].items():
+                run.apks[variant] = self.registry.store_path(artifact["path"])
+
+            if run.lease.get("gradleProfile"):
+                run.profiles.append(dict(run.lease["gradleProfile"], variants=request["variants"]))
+            self._check_profiles(run)
+            self._journal_built(run)
+            self._stage_uploads(run)
+            self.publish_stage.put(run)
+
+        except Exception as e:
+            self._fail_build(run, e)
+
+    def _check_profiles(self, run: BuildRun):
+        """Compare the build's Gradle profiles with recent builds of the same variants.
+
+        Regressions go in the result; with GRADLE_REGRESSION_ACTION=fail they
+        also fail the build.
+        """
+        job = run.job
+        for profile in run.profiles:
+            baseline = self.telemetry.profile_baseline(profile["variants"],
+                                                       config.GRADLE_PROFILE_BASELINE_BUILDS)
+            if baseline["builds"] < config.GRADLE_PROFILE_BASELINE_MIN:
+                continue
+            for regression in find_regressions(profile, baseline, config.GRADLE_REGRESSION_THRESHOLD,
+                                               config.GRADLE_REGRESSION_MIN_SECONDS):
+                regression["variants"] = profile["variants"]
+                run.regressions.append(regression)
+        if not run.regressions:
+            return
+
+        summary = ", ".join(f"{r['phase']} {r['seconds']}s (baseline {r['baseline']}s)"
+                            for r in run.regressions)
+        if config.GRADLE_REGRESSION_ACTION == "fail":
+            raise RuntimeError(f"Build regressed: {summary}")
+        logger.warning(f"Job {job.id} regressed: {summary}")
+        self._publish_progress(job, 86, f"Build regressed: {summary}")
+
+    def _lease_progress(self, job: BuildJob, progress: int, step: str, eta: int = None):
+        # The worker's progress is all the watchdog sees of a leased build's output
+        job.last_output = time.monotonic()
+        self._build_progress_callback(job, progress, step, eta)
+
+    def _journal_built(self, run: BuildRun):
+        apks = {variant: {"path": str(apk), "size": apk.stat().st_size, "key": run.keys[variant]}
+                for variant, apk in run.apks.items()}
+        self._journal(run.job, "built", apks=apks)
+
+    def _stage_uploads(self, run: BuildRun):
+        """Have the upload pass also copy each built APK into the artifact cache."""
+        job = run.job
+        for variant in run.apks:
+            key = run.keys[variant]
+
+            def on_hashed(sha: str, size: int, key=key, variant=variant):
+                self.artifact_cache.commit(
+                    key, sha, commit=run.commit, version=job.version,
+                    versionCode=job.version_code, variant=variant
+                )
+            run.uploads[variant] = {
+                "copy_to": self.artifact_cache.begin(key),
+                "on_hashed": on_hashed
+            }
+
+    def _compile_parallel(self, run: BuildRun):
+        """Build every group in its own container at the same time."""
+        with ThreadPoolExecutor(max_workers=len(run.groups),
+                                thread_name_prefix=f"matrix-{run.job.id}") as executor:
+            # Task timings are only recorded for the first group; interleaved
+            # output of concurrent runs would garble them
+            futures = [
+                executor.submit(self._compile_group, run, group, run.timer if i == 0 else None)
+                for i, group in enumerate(run.groups)
+            ]
+            try:
+                for future in futures:
+                    future.result()
+            except Exception:
+                # One variant failing fails the build, stop the others
+                for group in run.groups:
+                    group.builder.cancel()
+                raise
+
+    def _compile_group(self, run: BuildRun, group: BuildGroup, timer: Optional[BuildTimer]):
+        job = run.job
+        label = f"[{', '.join(group.variants)}] " if len(run.groups) > 1 else ""
+
+        def progress_callback(progress: int, message: str, eta: int = None):
+            self._build_progress_callback(job, progress, label + message, eta)
+
+        # Parallel groups split one build's share of cores and memory
+        share = len(run.groups)
+        job.pause()
+        try:
+            group.allocation = self.resources.acquire(
+                cpus=max(self.resources.build_cpus // share, 1),
+                memory_mb=self.resources.build_memory_mb // share,
+                timeout=config.BUILD_TIMEOUT,
+                cancelled=lambda: job.cancelled
             )
+        finally:
+            job.unpause()
+        logger.info(f"Job {job.id} admitted with {group.allocation.to_dict()}")
 
-            # Step 4: Calculate checksum
-            self._publish_progress(85, "Calculating checksum")
-            sha256 = self.builder.calculate_sha256(apk_path)
-            apk_size = self.builder.get_file_size(apk_path)
-
-            # Step 5: Upload to GitHub
-            self._publish_progress(90, "Uploading to GitHub Releases")
-            release_url = self.releaser.create_release(
-                version=version,
-                apk_path=apk_path,
-                notes=f"Automated build v{version} (versionCode: {version_code})"
+        group.log_sink = self.logs.open(group.log_id)
+        try:
+            apks = group.builder.build_apk(
+                group.clone_dir,
+                progress_callback=progress_callback,
+                timer=timer,
+                estimator=ProgressEstimator.from_history(self.telemetry),
+                log_sink=group.log_sink,
+                variants=group.variants,
+                allocation=group.allocation,
+                # Incremental builds in a prebuilt checkout say nothing about the baseline
+                profile=job.profile and not group.prebuilt
             )
+        finally:
+            group.usage = group.builder.usage
+            self.resources.release(group.allocation)
+        run.apks.update(apks)
+
+    def _publish(self, run: BuildRun):
+        """I/O stage: hash and upload the APKs, then publish the result."""
+        job = run.job
+        job.unpause()
+        try:
+            if job.cancelled:
+                raise RuntimeError("Build cancelled")
+            job.stage = "publish"
+
+            # The default build keeps its plain asset name
+            default_only = run.variants == [DEFAULT_VARIANT]
+            assets = []
+            for variant in run.variants:
+                asset = {
+                    "path": run.cached[variant]["path"] if variant in run.cached else run.apks[variant],
+                    "name": self.releaser.asset_name(job.version, None if default_only else variant)
+                }
+                asset.update(run.uploads.get(variant, {}))
+                assets.append(asset)
+
+            # Step 5: Hash and upload to GitHub in a single pass per APK
+            self._publish_progress(job, 90, "Uploading to GitHub Releases")
+            uploaded = job.resume and job.resume.get("uploaded")
+            if uploaded and len(run.cached) == len(run.variants):
+                # Uploaded before a restart, and the cached APKs are what was uploaded
+                published = uploaded
+            else:
+                with run.timer.phase("publish"):
+                    published = self.releaser.publish_assets(
+                        version=job.version,
+                        assets=assets,
+                        notes=f"Automated build v{job.version} (versionCode: {job.version_code})"
+                    )
+                self._journal(job, "uploaded", uploaded=published)
+
+            results = []
+            for variant, asset, result in zip(run.variants, assets, published):
+                cached = run.cached.get(variant)
+                if cached and result["sha256"] != cached["sha256"]:
+                    self.artifact_cache.discard(run.keys[variant])
+                    raise RuntimeError(f"Cached {variant} APK {run.keys[variant][:12]} is corrupt, "
+                                       "entry dropped")
+                results.append({
+                    "variant": variant,
+                    "apkUrl": result["url"],
+                    "apkSize": result["size"],
+                    "sha256": result["sha256"],
+                    "cache": "hit" if cached else "miss"
+                })
+                if self.artifact_server:
+                    # Uploading also put the APK in the artifact cache the mirror serves
+                    results[-1]["mirrorUrl"] = self.artifact_server.url(run.keys[variant], asset["name"])
+
+            # Patches from earlier releases, for devices on slow links
+            if self.deltas:
+                self._publish_progress(job, 95, "Publishing delta updates")
+                with run.timer.phase("delta"):
+                    for asset, result, entry in zip(assets, published, results):
+                        delta = self.deltas.publish(job.version, job.version_code,
+                                                    asset["name"], asset["path"], result)
+                        if delta:
+                            entry.update(delta)
 
             # Success!
-            build_time = int(time.time() - start_time)
-            self._publish_result(
-                status="success",
-                version=version,
-                version_code=version_code,
-                apk_url=release_url,
-                apk_size=apk_size,
-                sha256=sha256,
-                build_time=build_time
+            run.status = "success"
+            result = self._result_payload(
+                job,
+                status=run.status,
+                apk_url=results[0]["apkUrl"],
+                apk_size=results[0]["apkSize"],
+                sha256=results[0]["sha256"],
+                mirror_url=results[0].get("mirrorUrl"),
+                build_time=run.build_time,
+                commit=run.commit,
+                cache=run.cache_status,
+                log_size=run.log_size,
+                variants=results,
+                resources=run.resources,
+                prebuilt=bool(run.groups and run.groups[0].prebuilt),
+                profiles=run.profiles,
+                regressions=run.regressions
             )
+            # Identical triggers get this result from the moment the job stops being in flight
+            self._finish_job(job, run.status, result)
+            self._publish_result(job, result)
 
-            logger.info(f"Build completed successfully in {build_time}s")
+            logger.info(f"Job {job.id} completed successfully in {run.build_time}s")
+            self.release_queries.submit(self._publish_latest_release)
+            if job.rollout:
+                entry = next(r for r in results if r["variant"] == job.rollout["variant"])
+                url = entry["apkUrl"]
+                if config.ROLLOUT_FROM_MIRROR and entry.get("mirrorUrl"):
+                    url = entry["mirrorUrl"]
+                self.rollouts.start(job.version, job.version_code, url,
+                                    devices=job.rollout["devices"], apk_size=entry["apkSize"],
+                                    manifest_url=entry.get("manifestUrl"))
+            if self.cache_server:
+                logger.info(f"Gradle build cache: {self.cache_server.stats()}")
+            self.reaper.put(run)
 
         except Exception as e:
-            logger.exception(f"Build failed: {e}")
-            self._publish_result(
-                status="failed",
-                version=version,
-                version_code=version_code,
-                error=str(e),
-                build_time=int(time.time() - start_time)
-            )
+            self._fail_build(run, e)
 
-        finally:
-            with self.build_lock:
-                self.current_build = None
-            self.builder.cleanup()
+    def _fail_build(self, run: BuildRun, error: Exception):
+        """End a build that failed (or was cancelled) in any stage."""
+        job = run.job
+        logger.exception(f"Build failed: {error}")
+        if job.timed_out:
+            run.status = "timeout"
+        else:
+            run.status = "cancelled" if job.cancelled else "failed"
+        self._finish_job(job, run.status)
+        self._publish_result(job, self._result_payload(
+            job,
+            status=run.status,
+            error=job.timed_out or str(error),
+            build_time=run.build_time,
+            commit=run.commit,
+            cache=run.cache_status,
+            log_size=run.log_size,
+            resources=run.resources,
+            profiles=run.profiles,
+            regressions=run.regressions
+        ))
+        self.reaper.put(run)
+
+    def _reap(self, run: BuildRun):
+        """Background stage: remove the worktrees and record the build's metrics."""
+        for variant in run.cached:
+            self.artifact_cache.unpin(run.keys[variant])
+        for group in run.groups:
+            if group.log_sink:
+                self.logs.close(group.log_id)
+        self._keep_prebuilt(run)
+        with run.timer.phase("cleanup"):
+            for builder in run.builders:
+                builder.cleanup()
+            if run.lease:
+                shutil.rmtree(self.registry.store_path(run.lease["leaseId"]), ignore_errors=True)
+        if not run.job.speculative:
+            # Incremental runs in a prebuilt checkout would pull the ETA history down
+            prebuilt = run.groups and run.groups[0].prebuilt and run.cache_status == "miss"
+            self._record_metrics(run.job, run.timer, run.status, run.commit,
+                                 "prebuilt" if prebuilt else run.cache_status, run.profiles)
+        self._publish_queue()
+
+    def _keep_prebuilt(self, run: BuildRun):
+        """Hand successful prebuilt checkouts to the store instead of removing them."""
+        job = run.job
+        group = run.groups[0] if run.groups else None
+        if job.speculative:
+            if run.status == "success":
+                self.prebuilds.finish(run.commit, group.builder.detach_worktree(), job.variants)
+        elif group and group.prebuilt:
+            keep = run.status == "success"
+            if keep:
+                group.builder.detach_worktree()
+            self.prebuilds.give_back(run.commit, group.prebuilt if keep else None)
+
+    def _finish_job(self, job: BuildJob, state: str, result: Optional[dict] = None):
+        """Move a job to the finished set.
+
+        result is the payload of a success, kept for identical triggers. It is
+        handed to the dedup cache first, so a trigger never merges into a job
+        that has already finished.
+        """
+        self.dedup.finish(job, result)
+        with self.build_lock:
+            job.state = state
+            job.finished_at = time.time()
+            job.stage = None
+            job.builders = []
+            if job.cancel_requested_at is not None and job.id in self.running_jobs:
+                # From the cancel (or timeout) to the build slot being free again
+                job.cancel_latency = round(time.monotonic() - job.cancel_requested_at, 3)
+                self.cancel_latencies.append(job.cancel_latency)
+            self.running_jobs.pop(job.id, None)
+            self.finished_jobs[job.id] = job
+            while len(self.finished_jobs) > FINISHED_JOBS_KEPT:
+                self.finished_jobs.popitem(last=False)
+
+        self._journal(job, "finished", state=state)
+        if state != "success" and job.speculative:
+            self.prebuilds.abandon(job.commit)
+
+    def _journal(self, job: BuildJob, event: str, **data):
+        """Record a transition of a (non-speculative) job in the journal."""
+        if self.journal and not job.speculative:
+            self.journal.record(job.id, event, **data)
+
+    def _record_metrics(self, job: BuildJob, timer: BuildTimer, status: str,
+                        commit: str, cache_status: str, profiles: Optional[list] = None):
+        """Store the build's timings and publish the per-phase breakdown."""
+        try:
+            self.telemetry.record(timer, job.id, job.version, commit, status, cache_status,
+                                  profiles=profiles)
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to record build telemetry: {e}")
+
+        self.mqtt_out.publish(
+            config.TOPIC_METRICS,
+            {
+                "jobId": job.id,
+                "status": status,
+                "version": job.version,
+                "commit": commit,
+                "cache": cache_status,
+                "total": round(timer.total, 2),
+                "phases": timer.breakdown(),
+                "slowestTasks": timer.slowest_tasks(),
+                "timestamp": int(time.time())
+            },
+            force=True
+        )
+
+    def _handle_metrics_query(self, payload):
+        """Publish p50/p95 per phase over the last N successful builds."""
+        try:
+            last_n = int(payload.get("lastN", 50))
+        except (TypeError, ValueError):
+            last_n = 50
 
-    def _build_progress_callback(self, progress: int, message: str):
+        self.mqtt_out.publish(
+            config.TOPIC_METRICS_SUMMARY,
+            {
+                "lastN": last_n,
+                "phases": self.telemetry.phase_percentiles(last_n),
+                "timestamp": int(time.time())
+            },
+            force=True
+        )
+
+    def _build_progress_callback(self, job: BuildJob, progress: int, message: str,
+                                 eta: int = None):
         """Callback for build progress updates."""
         # Map builder progress (0-100) to our range (30-85)
         mapped_progress = 30 + int(progress * 0.55)
-        self._publish_progress(mapped_progress, message)
+        self._publish_progress(job, mapped_progress, message, eta)
+
+    def _job_fields(self, job: BuildJob) -> dict:
+        return {
+            "jobId": job.id,
+            "branch": job.branch,
+            "version": job.version,
+            "startedAt": int(job.started_at) if job.started_at else None
+        }
+
+    def _publish_status(self, status: str, message: str, job: BuildJob = None,
+                        force: bool = False):
+        """Publish build status to MQTT.
+
+        The retained status of a job is only republished when its state
+        changes (or force is set); progress steps travel on the progress topic.
+        """
+        if job:
+            if job.speculative or (job.published_status == status and not force):
+                return
+            job.published_status = status
 
-    def _publish_status(self, status: str, message: str):
-        """Publish build status to MQTT."""
         payload = {
             "status": status,
             "message": message,
             "timestamp": int(time.time())
         }
-        if self.current_build:
-            payload.update({
-                "branch": self.current_build["branch"],
-                "version": self.current_build["version"],
-                "startedAt": self.current_build["startedAt"]
-            })
+        if job:
+            payload.update(self._job_fields(job))
+            payload["requesters"] = job.requesters
+            # Progress still pending for this job must not arrive after the new state
+            self.mqtt_out.flush(config.TOPIC_PROGRESS, job.id)
 
-        self.client.publish(
-            config.TOPIC_STATUS,
-            json.dumps(payload),
-            retain=True
-        )
+        self.mqtt_out.publish(config.TOPIC_STATUS, payload, retain=True, force=True)
 
-    def _publish_progress(self, progress: int, step: str):
+    def _publish_progress(self, job: BuildJob, progress: int, step: str,
+                          eta: int = None):
         """Publish build progress to MQTT."""
+        if job.speculative:
+            return
+        self._publish_status("building", step, job)
+
         payload = {
+            "status": "building",
             "progress": progress,
             "step": step,
             "timestamp": int(time.time())
         }
-        if self.current_build:
-            payload.update({
-                "branch": self.current_build["branch"],
-                "version": self.current_build["version"],
-                "startedAt": self.current_build["startedAt"]
-            })
+        if eta is not None:
+            payload["eta"] = eta
+        payload.update(self._job_fields(job))
 
-        self.client.publish(config.TOPIC_PROGRESS, json.dumps(payload))
-        self._publish_status("building", step)
-        logger.info(f"Progress: {progress}% - {step}")
+        self.mqtt_out.publish(config.TOPIC_PROGRESS, payload, key=job.id)
+        logger.info(f"Progress [{job.id}]: {progress}% - {step}")
 
-    def _publish_result(self, status: str, version: str, version_code: int,
-                       apk_url: str = None, apk_size: int = None,
-                       sha256: str = None, build_time: int = None,
-                       error: str = None):
-        """Publish build result to MQTT."""
+    def _result_payload(self, job: BuildJob, status: str,
+                        apk_url: str = None, apk_size: int = None,
+                        sha256: str = None, mirror_url: str = None, build_time: int = None,
+                        error: str = None, commit: str = None,
+                        cache: str = None, log_size: int = None,
+                        variants: list = None, resources: dict = None,
+                        prebuilt: bool = False, profiles: list = None,
+                        regressions: list = None) -> dict:
+        """Build result message of job."""
         payload = {
+            "jobId": job.id,
             "status": status,
-            "version": version,
-            "versionCode": version_code,
+            "version": job.version,
+            "versionCode": job.version_code,
+            "commit": commit,
+            "cache": cache,
             "buildTime": build_time,
+            "requesters": job.requesters,
             "timestamp": int(time.time())
         }
+        if variants is not None:
+            # One entry per built variant; the top-level APK fields are the first
+            payload["variants"] = variants
+        if resources is not None:
+            payload["resources"] = resources
+        if prebuilt:
+            # Built incrementally in the checkout of a speculative build
+            payload["prebuilt"] = True
+        if log_size is not None:
+            # Uncompressed size of the build log, fetchable via logs/query
+            payload["logSize"] = log_size
+        if profiles:
+            # Gradle profile per variant group, without the per-task list
+            payload["profiles"] = [profile_summary(p) for p in profiles]
+        if regressions:
+            # Phases slower than the baseline, with the tasks that got slower
+            payload["regressions"] = regressions
 
         if status == "success":
             payload.update({
@@ -271,41 +1198,220 @@ class BuildService:
                 "apkSize": apk_size,
                 "sha256": sha256
             })
+            if mirror_url:
+                payload["mirrorUrl"] = mirror_url
         else:
             payload["error"] = error
+        return payload
 
-        self.client.publish(
-            config.TOPIC_RESULT,
-            json.dumps(payload),
-            retain=True
-        )
+    def _publish_result(self, job: BuildJob, payload: dict):
+        """Publish build result to MQTT."""
+        if job.speculative:
+            return
+        status = payload["status"]
+        if job.cancel_latency is not None:
+            payload["cancelLatency"] = job.cancel_latency
+
+        self.mqtt_out.flush(config.TOPIC_PROGRESS, job.id)
+        self.mqtt_out.publish(config.TOPIC_RESULT, payload, retain=True, force=True)
 
         # Also update status
         self._publish_status(
             status,
-            f"Build {'completed' if status == 'success' else 'failed'}: v{version}"
+            f"Build {'completed' if status == 'success' else status}: v{job.version}",
+            job
+        )
+
+    def _publish_queue(self):
+        """Publish the job list and queue metrics (both retained)."""
+        queued = self.queue.snapshot()
+        with self.build_lock:
+            running = list(self.running_jobs.values())
+            waits = list(self.recent_waits)
+            cancels = list(self.cancel_latencies)
+
+        self.mqtt_out.publish(
+            config.TOPIC_JOBS,
+            {
+                "running": [job.to_dict() for job in running],
+                "queued": [job.to_dict() for job in queued],
+                "timestamp": int(time.time())
+            },
+            retain=True
+        )
+
+        self.mqtt_out.publish(
+            config.TOPIC_QUEUE,
+            {
+                "depth": len(queued),
+                "running": len(running),
+                "workers": config.BUILD_WORKERS,
+                "oldestWait": round(max((job.wait_time for job in queued), default=0), 1),
+                "avgWait": round(sum(waits) / len(waits), 1) if waits else 0,
+                "maxWait": round(max(waits, default=0), 1),
+                "cancelLatency": {"p50": round(percentile(cancels, 50), 2),
+                                  "max": round(max(cancels, default=0), 2)},
+                "stages": {stage.name: stage.stats() for stage in self.stages},
+                "resources": self.resources.stats() if self.resources else None,
+                "remote": self.registry.stats() if self.registry else None,
+                "mqtt": self.mqtt_out.stats(),
+                "dedup": self.dedup.stats(),
+                "timestamp": int(time.time())
+            },
+            retain=True
         )
 
+    def start(self):
+        """Set up builds and the pipeline and connect; MQTT is not looped yet."""
+        # Drop worktree records left behind by an earlier run
+        self.mirror = GitMirror()
+        self.mirror.prune()
+
+        if self.registry:
+            # Docker, Gradle and the build containers live on the workers
+            Path(config.SHARED_STORE_DIR).mkdir(parents=True, exist_ok=True)
+            if config.PREBUILD_BRANCHES:
+                logger.warning("Prebuilds need local builds, ignoring PREBUILD_BRANCHES")
+        else:
+            self._start_local_builds()
+        interrupted = self._recover()
+
+        for stage in self.stages:
+            stage.start()
+        self.watchdog.start()
+        if config.ARTIFACT_SERVER_PORT > 0:
+            self.artifact_server = ArtifactServer(self.artifact_cache)
+            self.artifact_server.start()
+
+        if config.PREBUILD_BRANCHES and not self.registry:
+            self.prebuilds = PrebuildStore(self.mirror)
+            self.prebuild_watcher = PrebuildWatcher(
+                self.mirror, self.prebuilds, self._submit_prebuild, self._is_idle
+            )
+            self.prebuild_watcher.start()
+
+        self.connect()
+        self._resume_jobs(interrupted)
+
+    def _recover(self) -> list:
+        """Replay the journal and remove what the previous run left behind.
+
+        APKs of interrupted jobs that were built go into the artifact cache
+        and checkouts of jobs that were cloned are kept; every other build
+        checkout, and every build container of this service, is removed.
+        """
+        jobs = self.journal.pending() if self.journal else []
+        keep = set()
+        for job in jobs:
+            stage = job.resume["stage"]
+            if stage == "built" and not self._restore_apks(job):
+                job.resume["stage"] = "resolved"
+            if job.resume["stage"] in ("cloned", "versioned"):
+                keep.update(d for d in job.resume.get("workDirs", []) if d)
+            else:
+                job.resume.pop("workDirs", None)
+
+        # Build workers check out and run containers themselves in coordinator mode
+        if not self.registry:
+            remove_stale_containers(self.docker_client, config.MQTT_CLIENT_ID)
+            for work_dir in Path(config.BUILD_CACHE_DIR).glob("build-*"):
+                if str(work_dir) not in keep:
+                    logger.info(f"Removing orphaned checkout {work_dir}")
+                    self.mirror.remove_worktree(work_dir)
+        self.artifact_cache.clear_staging()
+        if self.journal:
+            self.journal.compact()
+        return jobs
+
+    def _restore_apks(self, job: BuildJob) -> bool:
+        """Move APKs built before a restart into the artifact cache. False if one is gone."""
+        for variant, apk in job.resume["apks"].items():
+            path = Path(apk["path"])
+            if not path.is_file() or path.stat().st_size != apk["size"]:
+                logger.warning(f"APK of job {job.id} missing after restart, rebuilding {variant}")
+                return False
+            self.artifact_cache.ingest(apk["key"], path, commit=job.commit, version=job.version,
+                                       versionCode=job.version_code, variant=variant)
+        return True
+
+    def _resume_jobs(self, jobs: list):
+        """Queue the jobs a restart interrupted; they skip the stages they completed."""
+        for job in jobs:
+            if job.resume["resumed"] >= MAX_RESUMES:
+                logger.error(f"Job {job.id} was interrupted {MAX_RESUMES + 1} times, failing it")
+                self._finish_job(job, "failed")
+                self._publish_result(job, self._result_payload(
+                    job, status="failed", commit=job.commit,
+                    error=f"Interrupted by {MAX_RESUMES + 1} restarts"))
+                continue
+            self.journal.record(job.id, "resumed", stage=job.resume["stage"])
+            self.dedup.register(job.key, job)
+            self.queue.put(job)
+            logger.info(f"Resuming job {job.id} (v{job.version}) after stage {job.resume['stage']}")
+            self._publish_status("queued", f"Build v{job.version} resumed after a restart", job)
+        if jobs:
+            self._publish_queue()
+
     def run(self):
         """Main run loop."""
-        self.connect()
+        self.start()
 
         # Setup signal handlers
         signal.signal(signal.SIGINT, self._signal_handler)
         signal.signal(signal.SIGTERM, self._signal_handler)
 
-        logger.info("Build service started, waiting for commands...")
+        if self.registry:
+            logger.info(f"Build coordinator started with up to {config.REMOTE_MAX_BUILDS} leased "
+                        f"build(s), waiting for workers and commands...")
+        else:
+            logger.info(f"Build service started with {config.BUILD_WORKERS} build worker(s) and "
+                        f"{config.PIPELINE_IO_WORKERS} clone/upload worker(s), waiting for commands...")
 
         # Start MQTT loop
         self.client.loop_forever()
 
+    def _start_local_builds(self):
+        """Docker client, resource scheduler, Gradle caches and container pool."""
+        self.docker_client = self.docker_client or docker.from_env()
+        self.resources = ResourceScheduler(self.docker_client)
+        self.gradle_cache = GradleCache()
+        if config.GRADLE_REMOTE_CACHE_PORT > 0:
+            self.cache_server = BuildCacheServer()
+            self.cache_server.start()
+            self.cache_server.install_init_script(self.gradle_cache)
+        else:
+            BuildCacheServer.remove_init_script(self.gradle_cache)
+
+        if config.BUILDER_POOL_SIZE > 0:
+            self.pool = ContainerPool(self.docker_client, self.gradle_cache)
+            self.pool.start()
+
     def _signal_handler(self, signum, frame):
         """Handle shutdown signals."""
+        self.stop()
+        sys.exit(0)
+
+    def stop(self):
+        """Stop taking builds, shut down the pipeline and go offline."""
         logger.info("Shutting down...")
         self.running = False
+        self.watchdog.stop()
+        self.queue.close()
+        for stage in self.stages:
+            stage.close()
+        if self.prebuild_watcher:
+            self.prebuild_watcher.stop()
+        if self.pool:
+            self.pool.shutdown()
+        if self.cache_server:
+            self.cache_server.stop()
+        if self.artifact_server:
+            self.artifact_server.stop()
         self._publish_status("offline", "Build service shutting down")
+        if self.journal:
+            self.journal.close()
+        self.mqtt_out.close()
         self.client.disconnect()
-        sys.exit(0)
 
 
 if __name__ == "__main__":
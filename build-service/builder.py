@@ -6,34 +6,140 @@ import hashlib
 import logging
 import os
 import re
-import shutil
-import subprocess
-import tempfile
+import threading
+import time
 from pathlib import Path
-from typing import Callable, Optional
+from typing import Callable, Dict, List, Optional
 
 import docker
 
 import config
+from container_pool import CACHE_MOUNT_PATH, ContainerPool
+from estimator import ProgressEstimator
+from git_mirror import GitMirror
+from gradle_cache import GradleCache
+from gradle_profile import PROFILE_ARGS, GradleProfile
+from log_sink import LogSink
+from resources import Allocation, UsageMonitor
+from telemetry import BuildTimer
 
 logger = logging.getLogger("Builder")
 
+# Gradle invocation run inside the build container. GRADLE_USER_HOME is the
+# shared, host-persistent cache (see GradleCache); --build-cache uses the remote
+# cache configured there (see BuildCacheServer). {tasks} and {args} are filled
+# in by build_command(); without args the result is part of the artifact cache key.
+BUILD_COMMAND = """
+    echo "=== Working directory ===" && \
+    pwd && \
+    echo "=== Files ===" && \
+    ls -la && \
+    echo "=== Java version ===" && \
+    java -version 2>&1 && \
+    echo "=== Starting build ===" && \
+    chmod +x gradlew && \
+    ./gradlew {tasks}{args} --no-daemon --build-cache --console=plain --stacktrace --gradle-user-home=$GRADLE_USER_HOME
+"""
+
+# Same build, run with exec in a pooled container (see ContainerPool) so the
+# Gradle daemon from the previous build is reused
+WARM_BUILD_COMMAND = (
+    "chmod +x gradlew && "
+    "./gradlew {tasks}{args} --daemon --build-cache --console=plain --stacktrace --gradle-user-home=$GRADLE_USER_HOME"
+)
+
+# Variant built when a trigger names none
+DEFAULT_VARIANT = "debug"
+# Build variant names (e.g. "release", "tvRelease") - also keeps the shell command safe
+VARIANT_NAME = re.compile(r"^[a-z][A-Za-z0-9]*$")
+# Gradle tasks accepted in place of variants: "assembleRelease" or ":app:assembleRelease"
+ASSEMBLE_TASK = re.compile(r"^(?::app:)?assemble([A-Z][A-Za-z0-9]*)$")
+
+
+# Label of cold build containers; the value is the owner (service or worker client
+# id), so a restarted owner can find the containers it left running
+BUILD_LABEL = "iocast.build"
+
+
+def variant_task(variant: str) -> str:
+    """Gradle task that builds the APK of a variant."""
+    return f"assemble{variant[0].upper()}{variant[1:]}"
+
+
+def task_variant(task: str) -> Optional[str]:
+    """Variant built by an assemble task, or None if task is not one."""
+    match = ASSEMBLE_TASK.match(task)
+    if not match:
+        return None
+    name = match.group(1)
+    return name[0].lower() + name[1:]
+
+
+def build_command(variants: List[str], warm: bool = False, args: str = "") -> str:
+    """Gradle command line that builds all variants in one invocation.
+
+    args are extra Gradle flags that do not change the output (resource limits).
+    """
+    template = WARM_BUILD_COMMAND if warm else BUILD_COMMAND
+    return template.format(tasks=" ".join(variant_task(v) for v in variants), args=args)
+
+
+def variant_output_dir(repo_dir: Path, variant: str) -> Path:
+    """APK output directory of a variant: "tvRelease" -> apk/tv/release."""
+    parts = [part.lower() for part in re.findall(r"[A-Z]?[a-z0-9]+", variant)]
+    return repo_dir.joinpath("app", "build", "outputs", "apk", *parts)
+
+
+def remove_stale_containers(docker_client, owner: str) -> int:
+    """Force-remove the build containers owner left behind when it last stopped."""
+    stale = docker_client.containers.list(all=True, filters={"label": f"{BUILD_LABEL}={owner}"})
+    for container in stale:
+        logger.info(f"Removing stale build container {container.short_id}")
+        try:
+            container.remove(force=True)
+        except docker.errors.APIError as e:
+            logger.warning(f"Failed to remove stale build container: {e}")
+    return len(stale)
+
 
 class AndroidBuilder:
     """Handles cloning, building, and packaging Android APKs."""
 
-    def __init__(self):
-        self.docker_client = docker.from_env()
+    def __init__(self, gradle_cache: Optional[GradleCache] = None,
+                 mirror: Optional[GitMirror] = None,
+                 pool: Optional[ContainerPool] = None,
+                 docker_client=None, owner: Optional[str] = None):
+        self.docker_client = docker_client or docker.from_env()
+        self.owner = owner or config.MQTT_CLIENT_ID
+        self.gradle_cache = gradle_cache or GradleCache()
+        self.mirror = mirror or GitMirror()
+        self.pool = pool
+        self.pooled = None
+        self.pool_lock = threading.Lock()  # whoever clears self.pooled owns the container
+        self.timer: Optional[BuildTimer] = None
+        self.estimator: Optional[ProgressEstimator] = None
+        self.log_sink: Optional[LogSink] = None
+        self.allocation: Optional[Allocation] = None
+        self.usage: Optional[dict] = None
+        self.profiler: Optional[GradleProfile] = None
+        self.profile: Optional[dict] = None  # GradleProfile.ingest() of a profiled build
         self.work_dir: Optional[Path] = None
+        self.commit_sha: Optional[str] = None
         self.container = None
         self.cancelled = False
+        self.last_output: Optional[float] = None  # monotonic time of the last output chunk
 
-    def clone_repo(self, branch: str = "main") -> Path:
-        """Clone the GitHub repository.
+    def clone_repo(self, branch: str = "main", commit: Optional[str] = None,
+                   dest: Optional[Path] = None) -> Path:
+        """Check out the repository from the local git mirror.
 
         Note: We use /app/cache for builds because when running Docker-in-Docker,
         the path must be accessible to the host Docker daemon. /app/cache is
         mounted as a host volume in docker-compose.yml.
+
+        If commit is given it is built exactly; otherwise the tip of branch.
+        The resolved SHA is stored in self.commit_sha. dest overrides the
+        generated build directory (it must be under BUILD_CACHE_DIR).
         """
         # Use /app/cache which is mounted from host - this makes it accessible
         # to sibling containers started via Docker-in-Docker
@@ -43,25 +149,38 @@ class AndroidBuilder:
         # Create unique build directory
         import uuid
         build_id = str(uuid.uuid4())[:8]
-        self.work_dir = cache_base / f"build-{build_id}"
-        self.work_dir.mkdir(parents=True, exist_ok=True)
+        self.work_dir = dest or cache_base / f"build-{build_id}"
 
-        repo_url = f"https://github.com/{config.GITHUB_REPO}.git"
+        ref = commit or branch
+        logger.info(f"Resolving {ref} in mirror {self.mirror.path}")
+        self.commit_sha = self.mirror.resolve(ref)
 
-        logger.info(f"Cloning {repo_url} branch {branch} to {self.work_dir}")
+        logger.info(f"Checking out {self.commit_sha[:12]} to {self.work_dir}")
+        self.mirror.add_worktree(self.commit_sha, self.work_dir)
 
-        result = subprocess.run(
-            ["git", "clone", "--depth", "1", "-b", branch, repo_url, str(self.work_dir)],
-            capture_output=True,
-            text=True,
-            timeout=300
-        )
+        logger.info(f"Repository checked out successfully")
+        return self.work_dir
 
-        if result.returncode != 0:
-            raise RuntimeError(f"Git clone failed: {result.stderr}")
+    def adopt_worktree(self, work_dir: Path, commit: str) -> Path:
+        """Build in an existing checkout (e.g. a prebuilt one) instead of cloning."""
+        logger.info(f"Reusing checkout of {commit[:12]} at {work_dir}")
+        self.work_dir = work_dir
+        self.commit_sha = commit
+        return work_dir
 
-        logger.info(f"Repository cloned successfully")
-        return self.work_dir
+    def detach_worktree(self) -> Optional[Path]:
+        """Hand over the checkout so cleanup() leaves it in place."""
+        work_dir = self.work_dir
+        self.work_dir = None
+        return work_dir
+
+    def resolve_commit(self, ref: str) -> str:
+        """Resolve a branch or commit SHA to the full SHA that would be built."""
+        return self.mirror.resolve(ref)
+
+    def image_id(self) -> str:
+        """Content digest of the build image."""
+        return self.docker_client.images.get(config.DOCKER_IMAGE).id
 
     def update_version(self, repo_dir: Path, version: str, version_code: int):
         """Update version in build.gradle.kts."""
@@ -96,9 +215,38 @@ class AndroidBuilder:
         logger.info("Version updated successfully")
 
     def build_apk(self, repo_dir: Path,
-                  progress_callback: Optional[Callable[[int, str], None]] = None) -> Path:
-        """Build the APK using Docker."""
-        logger.info(f"Starting Docker build with image {config.DOCKER_IMAGE}")
+                  progress_callback: Optional[Callable[..., None]] = None,
+                  timer: Optional[BuildTimer] = None,
+                  estimator: Optional[ProgressEstimator] = None,
+                  log_sink: Optional[LogSink] = None,
+                  variants: Optional[List[str]] = None,
+                  allocation: Optional[Allocation] = None,
+                  profile: bool = False) -> Dict[str, Path]:
+        """Build the APKs of variants (default: debug) in one Gradle run using Docker.
+
+        Returns the APK path of every variant. With an allocation the container
+        is limited to its cores and memory and Gradle's workers and heap are
+        sized to match; measured usage is left in self.usage.
+
+        progress_callback is called as (progress, step, eta_seconds). If timer
+        is given, Gradle configuration and per-task timings parsed from the
+        build output are recorded on it. estimator supplies progress and ETA
+        (without one, progress is based on task counts only). log_sink archives
+        the build output (without one, only its tail is kept). With profile,
+        Gradle also writes profiling and configuration cache reports; what they
+        report is left in self.profile.
+        """
+        self.timer = timer
+        self.estimator = estimator or ProgressEstimator()
+        self.log_sink = log_sink or LogSink()
+        self.allocation = allocation
+        self.usage = None
+        self.profiler = GradleProfile() if profile else None
+        self.profile = None
+        variants = variants or [DEFAULT_VARIANT]
+        if self.cancelled:
+            raise RuntimeError("Build cancelled")
+        logger.info(f"Starting Docker build of {', '.join(variants)} with image {config.DOCKER_IMAGE}")
 
         if progress_callback:
             progress_callback(0, "Checking Docker image")
@@ -116,85 +264,93 @@ class AndroidBuilder:
         if progress_callback:
             progress_callback(10, "Starting build container")
 
-        # Run the build with clean Gradle home to avoid cache issues
-        build_command = """
-            export GRADLE_USER_HOME=/tmp/gradle-home && \
-            mkdir -p $GRADLE_USER_HOME && \
-            echo "=== Working directory ===" && \
-            pwd && \
-            echo "=== Files ===" && \
-            ls -la && \
-            echo "=== Java version ===" && \
-            java -version 2>&1 && \
-            echo "=== Starting build ===" && \
-            chmod +x gradlew && \
-            ./gradlew assembleDebug --no-daemon --stacktrace --gradle-user-home=$GRADLE_USER_HOME
-        """
-
         logger.info("Running Gradle build in Docker container")
 
+        # Shared lock keeps pruning away while Gradle is using the cache
+        try:
+            with self.gradle_cache.shared():
+                if self.timer:
+                    self.timer.gradle_started()
+                args = allocation.gradle_args() if allocation else ""
+                if profile:
+                    args += PROFILE_ARGS
+                if self.pool:
+                    self._run_warm(repo_dir, build_command(variants, True, args), progress_callback)
+                else:
+                    self._run_cold(repo_dir, build_command(variants, False, args), progress_callback)
+        finally:
+            self.timer = None
+
+        self.gradle_cache.prune()
+        if self.profiler:
+            self.profile = self.profiler.ingest(repo_dir)
+
+        # Find the built APKs
+        apks = {}
+        for variant in variants:
+            apk_dir = variant_output_dir(repo_dir, variant)
+            apk_files = sorted(apk_dir.glob("*.apk"))
+            if not apk_files:
+                raise FileNotFoundError(f"No {variant} APK found in {apk_dir}")
+            apks[variant] = apk_files[0]
+            logger.info(f"APK built successfully: {apks[variant]}")
+
+        return apks
+
+    def _run_cold(self, repo_dir: Path, command: str,
+                  progress_callback: Optional[Callable[..., None]]):
+        """Run the build in a fresh, throwaway container."""
+        monitor = None
         try:
             # For Docker-in-Docker: convert container path to host path
             # /app/cache inside this container maps to /opt/iocast-build-service/build-cache on host
-            host_cache_base = "/opt/iocast-build-service/build-cache"
+            host_cache_base = config.HOST_BUILD_CACHE_DIR
             build_dir_name = repo_dir.name  # e.g., "build-abc12345"
             host_repo_dir = f"{host_cache_base}/{build_dir_name}"
 
             logger.info(f"Container path: {repo_dir}, Host path for DinD: {host_repo_dir}")
 
+            volumes = {host_repo_dir: {'bind': '/project', 'mode': 'rw'}}
+            volumes.update(self.gradle_cache.volume())
+
             self.container = self.docker_client.containers.run(
                 config.DOCKER_IMAGE,
-                command=f"bash -c '{build_command}'",
-                volumes={
-                    host_repo_dir: {'bind': '/project', 'mode': 'rw'}
-                },
+                command=f"bash -c '{command}'",
+                volumes=volumes,
                 working_dir="/project",
+                labels={BUILD_LABEL: self.owner},
                 remove=False,
                 detach=True,
                 user="root",  # Run as root to avoid permission issues with mounted volumes
                 environment={
-                    "GRADLE_USER_HOME": "/project/.gradle"
-                }
+                    "GRADLE_USER_HOME": GradleCache.MOUNT_PATH
+                },
+                **(self.allocation.container_limits() if self.allocation else {})
             )
+            self.last_output = time.monotonic()
+            monitor = UsageMonitor(self.container, fresh=True).start()
 
-            # Monitor build progress
-            progress = 10
-            for log in self.container.logs(stream=True, follow=True):
-                if self.cancelled:
-                    self.container.stop()
-                    raise RuntimeError("Build cancelled")
-
-                line = log.decode('utf-8', errors='ignore').strip()
-                if line:
-                    logger.debug(line)
-
-                    # Parse Gradle progress
-                    if "Compiling" in line or "compileReleaseKotlin" in line:
-                        progress = 40
-                        if progress_callback:
-                            progress_callback(progress, "Compiling Kotlin sources")
-                    elif "processReleaseResources" in line:
-                        progress = 60
-                        if progress_callback:
-                            progress_callback(progress, "Processing resources")
-                    elif "packageRelease" in line:
-                        progress = 80
-                        if progress_callback:
-                            progress_callback(progress, "Packaging APK")
-                    elif "BUILD SUCCESSFUL" in line:
-                        progress = 100
-                        if progress_callback:
-                            progress_callback(progress, "Build completed")
+            self._follow_build(
+                self.container.logs(stream=True, follow=True),
+                progress_callback,
+                stop=lambda: self.container.stop(timeout=config.CANCEL_GRACE_SECONDS)
+            )
+            # Stopped by cancel() while silent: the stream just ends
+            if self.cancelled:
+                raise RuntimeError("Build cancelled")
 
             # Check exit code
             result = self.container.wait()
             exit_code = result.get('StatusCode', 1)
 
             if exit_code != 0:
-                logs = self.container.logs().decode('utf-8', errors='ignore')
-                raise RuntimeError(f"Build failed with exit code {exit_code}:\n{logs[-2000:]}")
+                raise RuntimeError(f"Build failed with exit code {exit_code}:\n"
+                                   f"{self.log_sink.tail_text()}")
 
         finally:
+            self.last_output = None
+            if monitor:
+                self.usage = monitor.stop()
             if self.container:
                 try:
                     self.container.remove()
@@ -204,22 +360,88 @@ class AndroidBuilder:
                     logger.warning(f"Unexpected error removing container: {e}")
                 self.container = None
 
-        # Find the built APK
-        apk_dir = repo_dir / "app" / "build" / "outputs" / "apk" / "release"
-        apk_files = list(apk_dir.glob("*.apk"))
+    def _run_warm(self, repo_dir: Path, command: str,
+                  progress_callback: Optional[Callable[..., None]]):
+        """Run the build with exec in a pooled container with a warm Gradle daemon."""
+        pooled = self.pool.acquire(timeout=config.BUILD_TIMEOUT)
+        with self.pool_lock:
+            self.pooled = pooled
+        workdir = f"{CACHE_MOUNT_PATH}/{repo_dir.name}"
+        logger.info(f"Building in pool container {pooled.container.short_id} at {workdir}")
 
-        if not apk_files:
-            # Try debug build
-            apk_dir = repo_dir / "app" / "build" / "outputs" / "apk" / "debug"
-            apk_files = list(apk_dir.glob("*.apk"))
+        if self.allocation:
+            try:
+                pooled.container.update(**self.allocation.container_limits())
+            except docker.errors.APIError as e:
+                logger.warning(f"Could not apply resource limits to pool container: {e}")
+        monitor = UsageMonitor(pooled.container).start()
+        self.last_output = time.monotonic()
 
-        if not apk_files:
-            raise FileNotFoundError(f"No APK found in {repo_dir}/app/build/outputs/apk/")
+        broken = False
+        try:
+            output, exit_code = self.pool.exec_stream(pooled, command, workdir)
+            self._follow_build(output, progress_callback)
+
+            if self.cancelled:
+                raise RuntimeError("Build cancelled")
 
-        apk_path = apk_files[0]
-        logger.info(f"APK built successfully: {apk_path}")
+            code = exit_code()
+            if code != 0:
+                raise RuntimeError(f"Build failed with exit code {code}:\n"
+                                   f"{self.log_sink.tail_text()}")
 
-        return apk_path
+        except docker.errors.APIError:
+            broken = True
+            raise
+
+        finally:
+            self.usage = monitor.stop()
+            self.last_output = None
+            with self.pool_lock:
+                # Unless cancel() already took the container and discarded it
+                owned = self.pooled is pooled
+                self.pooled = None
+            if owned:
+                if broken or self.cancelled:
+                    self.pool.discard(pooled)
+                else:
+                    self.pool.release(pooled)
+
+    def _follow_build(self, logs, progress_callback: Optional[Callable[..., None]],
+                      stop: Optional[Callable[[], None]] = None):
+        """Consume build output once and report estimated progress per Gradle task."""
+        for line, kind, match in self.log_sink.lines(self._touch(logs)):
+            if self.cancelled:
+                if stop:
+                    stop()
+                raise RuntimeError("Build cancelled")
+
+            logger.debug(line)
+            if self.profiler:
+                self.profiler.observe_line(line)
+            if kind == "task":
+                task, outcome = match.group(1), match.group(2)
+                if self.timer:
+                    self.timer.task_started(task, outcome)
+                step = self.estimator.task_started(task)
+            elif kind == "end":
+                if self.timer:
+                    self.timer.build_ended()
+                self.estimator.build_ended()
+                step = "Build completed" if match.group(1) == "SUCCESSFUL" else None
+            else:
+                continue
+
+            if progress_callback and step:
+                percent, eta = self.estimator.estimate()
+                # Gradle covers 10-100 of the builder's progress range
+                progress_callback(10 + percent * 90 // 100, step, eta)
+
+    def _touch(self, chunks):
+        """Pass output chunks through, noting when the last one arrived."""
+        for chunk in chunks:
+            self.last_output = time.monotonic()
+            yield chunk
 
     def calculate_sha256(self, file_path: Path) -> str:
         """Calculate SHA256 checksum of file."""
@@ -233,12 +455,19 @@ class AndroidBuilder:
         """Get file size in bytes."""
         return file_path.stat().st_size
 
-    def cancel(self):
-        """Cancel the current build."""
+    def cancel(self, grace: Optional[int] = None):
+        """Cancel the current build, killing its container after grace seconds."""
+        if grace is None:
+            grace = config.CANCEL_GRACE_SECONDS
         self.cancelled = True
+        with self.pool_lock:
+            pooled, self.pooled = self.pooled, None
+        if pooled:
+            # Killing the container ends the exec stream immediately
+            self.pool.discard(pooled)
         if self.container:
             try:
-                self.container.stop(timeout=5)
+                self.container.stop(timeout=grace)
             except docker.errors.APIError as e:
                 logger.warning(f"Failed to stop container: {e}")
             except Exception as e:
@@ -249,5 +478,6 @@ class AndroidBuilder:
         self.cancelled = False
         if self.work_dir and self.work_dir.exists():
             logger.info(f"Cleaning up {self.work_dir}")
-            shutil.rmtree(self.work_dir, ignore_errors=True)
-            self.work_dir = None
+            self.mirror.remove_worktree(self.work_dir)
+        self.work_dir = None
+        self.commit_sha = None
@@ -2,6 +2,7 @@
 Configuration for MQTT Android Build Service
 """
 import os
+import socket
 
 # MQTT Configuration
 MQTT_HOST = os.getenv("MQTT_HOST", "188.228.60.134")
@@ -16,17 +17,156 @@ TOPIC_CANCEL = "build/iocast-android/cancel"
 TOPIC_STATUS = "build/iocast-android/status"
 TOPIC_PROGRESS = "build/iocast-android/progress"
 TOPIC_RESULT = "build/iocast-android/result"
+TOPIC_JOBS = "build/iocast-android/jobs"
+TOPIC_JOBS_QUERY = "build/iocast-android/jobs/query"
+TOPIC_JOBS_INFO = "build/iocast-android/jobs/info"
+TOPIC_QUEUE = "build/iocast-android/queue"
+TOPIC_METRICS = "build/iocast-android/metrics"
+TOPIC_METRICS_QUERY = "build/iocast-android/metrics/query"
+TOPIC_METRICS_SUMMARY = "build/iocast-android/metrics/summary"
+TOPIC_LOGS_QUERY = "build/iocast-android/logs/query"
+TOPIC_LOGS = "build/iocast-android/logs"
+TOPIC_RELEASES_QUERY = "build/iocast-android/releases/query"
+TOPIC_RELEASES = "build/iocast-android/releases"
+TOPIC_RELEASES_LATEST = "build/iocast-android/releases/latest"
+# Coordinator <-> worker messages: workers/<workerId>/heartbeat|lease|progress|done|cancel
+TOPIC_WORKERS = "build/iocast-android/workers"
+# OTA rollout state (retained) and control: {"action": "start|pause|resume|abort"}
+TOPIC_ROLLOUT = "build/iocast-android/rollout"
+TOPIC_ROLLOUT_CONTROL = "build/iocast-android/rollout/control"
+# Device topics: devices/<deviceId>/telemetry|status|cmd/<command>[/ack]
+DEVICE_TOPIC_PREFIX = "devices"
+# Minimum seconds between progress messages per job (faster updates are coalesced)
+MQTT_PROGRESS_INTERVAL = float(os.getenv("MQTT_PROGRESS_INTERVAL", "1.0"))
+# Progress/ETA estimation: builds of history used, and task count assumed without history
+ETA_HISTORY_BUILDS = int(os.getenv("ETA_HISTORY_BUILDS", "20"))
+ETA_DEFAULT_TASK_COUNT = int(os.getenv("ETA_DEFAULT_TASK_COUNT", "45"))
+# Seconds a successful result answers repeated identical triggers (0 = off)
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", "600"))
 
 # GitHub Configuration
 GITHUB_TOKEN = os.getenv("GITHUB_TOKEN", "")
 GITHUB_REPO = os.getenv("GITHUB_REPO", "ufi-tech/iocast-android")
+# Base URLs - override to test against a local stand-in for the GitHub API
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com")
+GITHUB_UPLOADS_URL = os.getenv("GITHUB_UPLOADS_URL", "https://uploads.github.com")
+GIT_REPO_URL = os.getenv("GIT_REPO_URL", f"https://github.com/{GITHUB_REPO}.git")
+UPLOAD_RETRIES = int(os.getenv("UPLOAD_RETRIES", "5"))
+# Binary patches to each new APK from the APKs of this many earlier releases (0 = off)
+DELTA_BASE_COUNT = int(os.getenv("DELTA_BASE_COUNT", "3"))
+# Seconds release metadata is served from memory before it is revalidated (ETag)
+RELEASE_CACHE_TTL = int(os.getenv("RELEASE_CACHE_TTL", "60"))
+
+# OTA Rollout - update devices in waves after a published build
+# Roll out every successful build, not only triggers with "rollout"
+ROLLOUT_AUTO = os.getenv("ROLLOUT_AUTO", "false").lower() == "true"
+# Devices in the first (canary) wave, and at most in each later wave
+ROLLOUT_CANARY = int(os.getenv("ROLLOUT_CANARY", "1"))
+ROLLOUT_CONCURRENCY = int(os.getenv("ROLLOUT_CONCURRENCY", "10"))
+# Download bandwidth of the fleet's uplink; caps waves to what it delivers in
+# ROLLOUT_SPREAD seconds (0 = no cap)
+ROLLOUT_BANDWIDTH_MBIT = float(os.getenv("ROLLOUT_BANDWIDTH_MBIT", "0"))
+# Seconds over which the update commands of a wave are spread
+ROLLOUT_SPREAD = float(os.getenv("ROLLOUT_SPREAD", "60"))
+# Seconds a device has to report the new version before it counts as failed
+ROLLOUT_WAVE_TIMEOUT = float(os.getenv("ROLLOUT_WAVE_TIMEOUT", "900"))
+# Share of failed devices in a wave that pauses the rollout
+ROLLOUT_MAX_FAILURE_RATE = float(os.getenv("ROLLOUT_MAX_FAILURE_RATE", "0.2"))
+# Send devices the LAN mirror URL (ARTIFACT_SERVER_PORT) instead of GitHub's
+ROLLOUT_FROM_MIRROR = os.getenv("ROLLOUT_FROM_MIRROR", "true").lower() == "true"
 
 # Build Configuration
 BUILD_CACHE_DIR = os.getenv("BUILD_CACHE_DIR", "/app/cache")
+# Host path of BUILD_CACHE_DIR - sibling build containers mount from the host
+HOST_BUILD_CACHE_DIR = os.getenv("HOST_BUILD_CACHE_DIR", "/opt/iocast-build-service/build-cache")
+# Shared Gradle home (dependencies, wrapper dists) is pruned above this size
+GRADLE_CACHE_MAX_MB = int(os.getenv("GRADLE_CACHE_MAX_MB", "8192"))
+# Local Gradle HTTP build cache for task outputs (port 0 = disabled).
+# The URL must be reachable from build containers (default: Docker host gateway).
+GRADLE_REMOTE_CACHE_PORT = int(os.getenv("GRADLE_REMOTE_CACHE_PORT", "5071"))
+GRADLE_REMOTE_CACHE_URL = os.getenv("GRADLE_REMOTE_CACHE_URL", "http://172.17.0.1:5071/cache/")
+GRADLE_REMOTE_CACHE_MAX_MB = int(os.getenv("GRADLE_REMOTE_CACHE_MAX_MB", "4096"))
+# Address the build cache listens on (default: the host of GRADLE_REMOTE_CACHE_URL,
+# so it is not reachable from the LAN)
+GRADLE_REMOTE_CACHE_BIND = os.getenv("GRADLE_REMOTE_CACHE_BIND", "")
+# HTTP basic auth credentials of the build cache; an empty password is replaced
+# by a random one at startup (builds get it through the init script)
+GRADLE_REMOTE_CACHE_USER = os.getenv("GRADLE_REMOTE_CACHE_USER", "iocast")
+GRADLE_REMOTE_CACHE_PASSWORD = os.getenv("GRADLE_REMOTE_CACHE_PASSWORD", "")
 BUILD_TIMEOUT = int(os.getenv("BUILD_TIMEOUT", "1800"))  # 30 minutes
+# Seconds a build may go without any output before it is stopped as hung (0 = off)
+BUILD_SILENCE_TIMEOUT = int(os.getenv("BUILD_SILENCE_TIMEOUT", "600"))
+# Seconds a cancelled build's container gets after SIGTERM before it is killed.
+# The build shell runs as PID 1 and ignores SIGTERM, so a grace period only adds delay.
+CANCEL_GRACE_SECONDS = int(os.getenv("CANCEL_GRACE_SECONDS", "0"))
+# Journal job progress (BUILD_CACHE_DIR/journal.jsonl) and resume interrupted jobs after
+# a restart. Orphaned build checkouts and containers are removed at startup either way.
+JOB_JOURNAL = os.getenv("JOB_JOURNAL", "true").lower() == "true"
+# Profile every build (--profile, --info, configuration cache report); triggers can
+# also ask with "profile": true
+GRADLE_PROFILE = os.getenv("GRADLE_PROFILE", "false").lower() == "true"
+# Profiled builds are compared with the median of the last N successful profiled
+# builds of the same variants, once there are at least GRADLE_PROFILE_BASELINE_MIN
+GRADLE_PROFILE_BASELINE_BUILDS = int(os.getenv("GRADLE_PROFILE_BASELINE_BUILDS", "10"))
+GRADLE_PROFILE_BASELINE_MIN = int(os.getenv("GRADLE_PROFILE_BASELINE_MIN", "3"))
+# A phase regresses when it is this share slower than its baseline and at least
+# GRADLE_REGRESSION_MIN_SECONDS slower; warn reports it in the result, fail fails the build
+GRADLE_REGRESSION_THRESHOLD = float(os.getenv("GRADLE_REGRESSION_THRESHOLD", "0.25"))
+GRADLE_REGRESSION_MIN_SECONDS = float(os.getenv("GRADLE_REGRESSION_MIN_SECONDS", "5"))
+GRADLE_REGRESSION_ACTION = os.getenv("GRADLE_REGRESSION_ACTION", "warn")
+# Build logs (BUILD_CACHE_DIR/logs, gzip per job) - oldest rotated out above this size
+BUILD_LOG_MAX_MB = int(os.getenv("BUILD_LOG_MAX_MB", "256"))
+# Output lines kept in memory for error reports, and default bytes per logs/query
+BUILD_LOG_TAIL_LINES = int(os.getenv("BUILD_LOG_TAIL_LINES", "200"))
+BUILD_LOG_CHUNK_BYTES = int(os.getenv("BUILD_LOG_CHUNK_BYTES", "32768"))
+# Number of builds that run in parallel (each with its own container)
+BUILD_WORKERS = int(os.getenv("BUILD_WORKERS", "1"))
+# Builds are pipelined: clone/version -> Gradle -> upload -> cleanup. Workers for each
+# I/O stage (clone, upload), and builds that may wait between stages per handoff
+PIPELINE_IO_WORKERS = int(os.getenv("PIPELINE_IO_WORKERS", "1"))
+PIPELINE_DEPTH = int(os.getenv("PIPELINE_DEPTH", "1"))
+# Matrix builds: variants get parallel containers only if there are this many cores
+# per variant, otherwise they share one Gradle invocation
+MATRIX_CORES_PER_BUILD = int(os.getenv("MATRIX_CORES_PER_BUILD", "4"))
+# Speculative prebuilds of new heads on these branches (comma separated, empty = off)
+PREBUILD_BRANCHES = [b.strip() for b in os.getenv("PREBUILD_BRANCHES", "").split(",") if b.strip()]
+PREBUILD_VARIANTS = [v.strip() for v in os.getenv("PREBUILD_VARIANTS", "debug").split(",") if v.strip()]
+PREBUILD_POLL_INTERVAL = int(os.getenv("PREBUILD_POLL_INTERVAL", "60"))
+# Prebuilt checkouts kept (oldest removed first)
+PREBUILD_KEEP = int(os.getenv("PREBUILD_KEEP", "2"))
+# Cores/memory of the Docker host kept free for other services, and per-build share
+# (0 = host capacity split evenly over BUILD_WORKERS). Builds wait until their share is free.
+RESOURCE_RESERVED_CORES = int(os.getenv("RESOURCE_RESERVED_CORES", "1"))
+RESOURCE_RESERVED_MEMORY_MB = int(os.getenv("RESOURCE_RESERVED_MEMORY_MB", "2048"))
+BUILD_CPUS = int(os.getenv("BUILD_CPUS", "0"))
+BUILD_MEMORY_MB = int(os.getenv("BUILD_MEMORY_MB", "0"))
+# local: this process builds; coordinator: builds are leased to worker.py processes
+BUILD_MODE = os.getenv("BUILD_MODE", "local")
+# Builds the coordinator keeps leased out at once (workers' slots permitting)
+REMOTE_MAX_BUILDS = int(os.getenv("REMOTE_MAX_BUILDS", "8"))
+# Worker identity and lease timing; a lease not renewed within the TTL is reassigned
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+WORKER_HEARTBEAT_INTERVAL = float(os.getenv("WORKER_HEARTBEAT_INTERVAL", "5"))
+WORKER_LEASE_TTL = float(os.getenv("WORKER_LEASE_TTL", "30"))
+WORKER_LEASE_RETRIES = int(os.getenv("WORKER_LEASE_RETRIES", "3"))
+# Directory shared by coordinator and workers (e.g. NFS) for APKs and build logs
+SHARED_STORE_DIR = os.getenv("SHARED_STORE_DIR", "/app/shared")
+# Warm builder containers with a resident Gradle daemon (0 = fresh container per build)
+BUILDER_POOL_SIZE = int(os.getenv("BUILDER_POOL_SIZE", "0"))
+BUILDER_POOL_MAX_BUILDS = int(os.getenv("BUILDER_POOL_MAX_BUILDS", "20"))
+BUILDER_POOL_MAX_MEMORY_MB = int(os.getenv("BUILDER_POOL_MAX_MEMORY_MB", "6144"))
 # CircleCI Android image with Java 17 (locally cached version)
 # IMPORTANT: Do NOT pull this image - use the pre-loaded Java 17 version
 DOCKER_IMAGE = os.getenv("DOCKER_IMAGE", "cimg/android:2024.01.1")
 
 # Paths
 RELEASES_DIR = os.getenv("RELEASES_DIR", "/app/releases")
+# Built APK cache (RELEASES_DIR/cache) - bounded by size and age
+ARTIFACT_CACHE_MAX_MB = int(os.getenv("ARTIFACT_CACHE_MAX_MB", "2048"))
+ARTIFACT_CACHE_MAX_AGE_DAYS = int(os.getenv("ARTIFACT_CACHE_MAX_AGE_DAYS", "30"))
+# LAN mirror serving the artifact cache to devices (port 0 = off). ARTIFACT_SERVER_URL
+# is the base URL devices reach it on, e.g. http://192.168.1.10:5080
+ARTIFACT_SERVER_PORT = int(os.getenv("ARTIFACT_SERVER_PORT", "0"))
+ARTIFACT_SERVER_URL = os.getenv("ARTIFACT_SERVER_URL", "")
+# Downloads served at once; further requests get 503 with Retry-After
+ARTIFACT_SERVER_MAX_DOWNLOADS = int(os.getenv("ARTIFACT_SERVER_MAX_DOWNLOADS", "32"))
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Container Pool - Pre-started builder containers with a resident Gradle daemon
+"""
+import logging
+import threading
+import time
+from typing import Callable, Iterator, Optional, Tuple
+
+import docker
+
+import config
+from gradle_cache import GradleCache
+
+logger = logging.getLogger("ContainerPool")
+
+# Label on every pooled container, so leftovers can be found after a restart
+POOL_LABEL = "iocast.build-pool"
+
+# Where BUILD_CACHE_DIR (and with it every build worktree) appears in a pooled container
+CACHE_MOUNT_PATH = "/cache"
+
+
+class PooledContainer:
+    """A long-lived builder container and its usage counters."""
+
+    def __init__(self, container):
+        self.container = container
+        self.builds = 0
+        self.created_at = time.time()
+
+    @property
+    def id(self) -> str:
+        return self.container.id
+
+
+class ContainerPool:
+    """Keeps a fixed number of idle, health-checked builder containers.
+
+    Containers mount the whole build cache, so a build runs with exec in its
+    own worktree directory and the Gradle daemon started by the first build
+    stays resident for the next one. A container is replaced after
+    BUILDER_POOL_MAX_BUILDS builds, when its memory use passes
+    BUILDER_POOL_MAX_MEMORY_MB, or when a build in it is cancelled.
+    """
+
+    def __init__(self, docker_client, gradle_cache: GradleCache,
+                 size: Optional[int] = None, max_builds: Optional[int] = None,
+                 max_memory_mb: Optional[int] = None):
+        self.docker_client = docker_client
+        self.gradle_cache = gradle_cache
+        self.size = size if size is not None else config.BUILDER_POOL_SIZE
+        self.max_builds = max_builds if max_builds is not None else config.BUILDER_POOL_MAX_BUILDS
+        self.max_memory = (max_memory_mb if max_memory_mb is not None
+                           else config.BUILDER_POOL_MAX_MEMORY_MB) * 1024 * 1024
+        self.idle = []
+        self.busy = {}
+        self.cond = threading.Condition()
+        self.closed = False
+
+    def start(self):
+        """Remove leftovers from a previous run and fill the pool."""
+        for container in self.docker_client.containers.list(all=True, filters={"label": POOL_LABEL}):
+            logger.info(f"Removing stale pool container {container.short_id}")
+            self._remove(container)
+
+        for _ in range(self.size):
+            self._add()
+        logger.info(f"Builder pool started with {len(self.idle)} container(s)")
+
+    def _add(self) -> Optional[PooledContainer]:
+        try:
+            volumes = {config.HOST_BUILD_CACHE_DIR: {'bind': CACHE_MOUNT_PATH, 'mode': 'rw'}}
+            volumes.update(self.gradle_cache.volume())
+            container = self.docker_client.containers.run(
+                config.DOCKER_IMAGE,
+                command="sleep infinity",
+                volumes=volumes,
+                working_dir=CACHE_MOUNT_PATH,
+                labels={POOL_LABEL: "1"},
+                detach=True,
+                user="root",
+                environment={
+                    "GRADLE_USER_HOME": GradleCache.MOUNT_PATH
+                }
+            )
+        except docker.errors.APIError as e:
+            logger.error(f"Failed to start pool container: {e}")
+            return None
+
+        pooled = PooledContainer(container)
+        if not self._healthy(pooled):
+            logger.error(f"Pool container {container.short_id} failed health check")
+            self._remove(container)
+            return None
+
+        with self.cond:
+            self.idle.append(pooled)
+            self.cond.notify()
+        logger.info(f"Pool container {container.short_id} ready")
+        return pooled
+
+    def _healthy(self, pooled: PooledContainer) -> bool:
+        try:
+            pooled.container.reload()
+            if pooled.container.status != "running":
+                return False
+            result = pooled.container.exec_run(["java", "-version"])
+            return result.exit_code == 0
+        except docker.errors.APIError:
+            return False
+
+    def _memory_usage(self, pooled: PooledContainer) -> int:
+        try:
+            stats = pooled.container.stats(stream=False)
+            return stats.get("memory_stats", {}).get("usage", 0)
+        except docker.errors.APIError:
+            return 0
+
+    def _remove(self, container):
+        try:
+            container.remove(force=True)
+        except docker.errors.APIError as e:
+            logger.warning(f"Failed to remove pool container: {e}")
+
+    def acquire(self, timeout: Optional[float] = None) -> PooledContainer:
+        """Take a healthy idle container, waiting up to timeout seconds."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.cond:
+                while not self.idle:
+                    if self.closed:
+                        raise RuntimeError("Builder pool is shut down")
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise RuntimeError("No builder container available")
+                    self.cond.wait(remaining)
+                pooled = self.idle.pop(0)
+                self.busy[pooled.id] = pooled
+
+            if self._healthy(pooled):
+                return pooled
+
+            logger.warning(f"Pool container {pooled.container.short_id} unhealthy, replacing")
+            self.discard(pooled)
+
+    def release(self, pooled: PooledContainer):
+        """Return a container after a build, recycling it if it is worn out."""
+        pooled.builds += 1
+        memory = self._memory_usage(pooled)
+
+        if pooled.builds >= self.max_builds or (self.max_memory and memory > self.max_memory):
+            logger.info(f"Recycling pool container {pooled.container.short_id} after "
+                        f"{pooled.builds} build(s), {memory // (1024 * 1024)} MB in use")
+            self.discard(pooled)
+            return
+
+        with self.cond:
+            self.busy.pop(pooled.id, None)
+            self.idle.append(pooled)
+            self.cond.notify()
+
+    def discard(self, pooled: PooledContainer):
+        """Remove a container from the pool and start a replacement."""
+        with self.cond:
+            self.busy.pop(pooled.id, None)
+        self._remove(pooled.container)
+        if not self.closed:
+            threading.Thread(target=self._add, daemon=True).start()
+
+    def exec_stream(self, pooled: PooledContainer, command: str,
+                    workdir: str) -> Tuple[Iterator[bytes], Callable[[], int]]:
+        """Run command in a pooled container.
+
+        Returns the raw output chunks (not split into lines, see LogSink) and
+        a function giving the exit code once the stream is exhausted.
+        """
+        api = self.docker_client.api
+        exec_id = api.exec_create(
+            pooled.id,
+            ["bash", "-c", command],
+            workdir=workdir,
+            environment={"GRADLE_USER_HOME": GradleCache.MOUNT_PATH}
+        )["Id"]
+        chunks = api.exec_start(exec_id, stream=True)
+
+        def exit_code() -> int:
+            code = api.exec_inspect(exec_id).get("ExitCode")
+            return 1 if code is None else code
+
+        return chunks, exit_code
+
+    def shutdown(self):
+        """Stop and remove every pooled container."""
+        with self.cond:
+            self.closed = True
+            containers = self.idle + list(self.busy.values())
+            self.idle = []
+            self.busy = {}
+            self.cond.notify_all()
+        for pooled in containers:
+            self._remove(pooled.container)
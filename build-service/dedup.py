@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Trigger Deduplication - Merges identical build requests and replays recent results
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import config
+from build_queue import BuildJob
+
+
+def request_key(payload: dict, variants: list, commit: str) -> str:
+    """Identity of a trigger: its idempotencyKey, else what it would build.
+
+    commit is the SHA the trigger's branch or commit resolved to, so a
+    retrigger after the branch moved is a different build.
+    """
+    if payload.get("idempotencyKey"):
+        return f"key:{payload['idempotencyKey']}"
+    identity = json.dumps({
+        "commit": commit,
+        "version": payload.get("version"),
+        "versionCode": payload.get("versionCode"),
+        "variants": variants
+    }, sort_keys=True)
+    return "build:" + hashlib.sha256(identity.encode("utf-8")).hexdigest()[:24]
+
+
+class Deduplicator:
+    """Tracks queued/running jobs and recent successful results by request key.
+
+    A trigger whose key matches a job in flight joins that job; one matching
+    a success within the TTL is answered with the stored result.
+    """
+
+    def __init__(self, ttl: Optional[int] = None, max_results: int = 200):
+        self.ttl = ttl if ttl is not None else config.RESULT_CACHE_TTL
+        self.max_results = max_results
+        self.in_flight = {}
+        self.recent: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.merged = 0
+        self.replayed = 0
+
+    def lookup(self, key: str) -> Tuple[Optional[BuildJob], Optional[dict]]:
+        """Return (job in flight, None), (None, recent result) or (None, None)."""
+        now = time.time()
+        with self.lock:
+            job = self.in_flight.get(key)
+            if job is not None and not job.cancelled:
+                self.merged += 1
+                return job, None
+
+            while self.recent:
+                oldest_key, (finished, _) = next(iter(self.recent.items()))
+                if now - finished <= self.ttl:
+                    break
+                del self.recent[oldest_key]
+            entry = self.recent.get(key)
+            if entry:
+                self.replayed += 1
+                return None, entry[1]
+        return None, None
+
+    def register(self, key: str, job: BuildJob):
+        with self.lock:
+            self.in_flight[key] = job
+
+    def finish(self, job: BuildJob, result: Optional[dict] = None):
+        """Job is done; a successful result is kept for repeats within the TTL."""
+        if job.key is None:
+            return
+        with self.lock:
+            if self.in_flight.get(job.key) is job:
+                del self.in_flight[job.key]
+            if result is not None and result.get("status") == "success" and self.ttl > 0:
+                self.recent[job.key] = (time.time(), result)
+                self.recent.move_to_end(job.key)
+                while len(self.recent) > self.max_results:
+                    self.recent.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"merged": self.merged, "replayed": self.replayed,
+                    "cachedResults": len(self.recent)}
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Delta Publisher - Binary patches from earlier releases to a new APK
+"""
+import hashlib
+import json
+import logging
+import re
+import shutil
+import threading
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import bsdiff4
+import requests
+
+import config
+from github_release import GitHubReleaser
+from publisher import UploadError
+
+logger = logging.getLogger("DeltaPublisher")
+
+PATCH_ALGORITHM = "bsdiff4"
+CHUNK_SIZE = 1024 * 1024
+
+
+def version_key(version: str) -> Optional[Tuple[int, ...]]:
+    """Sortable form of a version ("2.0.10" -> (2, 0, 10)), None if it has no numbers."""
+    parts = re.findall(r"\d+", version)
+    return tuple(int(p) for p in parts) if parts else None
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DeltaPublisher:
+    """Publishes bsdiff patches from the last DELTA_BASE_COUNT releases.
+
+    For a new APK asset iocast-v2.0.5.apk, every earlier release with the
+    same asset (iocast-v2.0.4.apk, ...) gets a patch
+    iocast-v2.0.5-from-v2.0.4.bsdiff, and iocast-v2.0.5-deltas.json lists
+    each patch with the SHA-256 of the APK it applies to, so a device picks
+    the patch matching its installed APK (or the full APK if none does).
+    Patches that are not smaller than the APK are left out.
+
+    Published APKs are kept in RELEASES_DIR/deltas/bases by SHA-256 to diff
+    against later; bases that are missing (e.g. released before this
+    existed) are downloaded once from the release.
+    """
+
+    def __init__(self, releaser: GitHubReleaser, base_count: Optional[int] = None,
+                 root: Optional[Path] = None):
+        self.releaser = releaser
+        self.base_count = base_count if base_count is not None else config.DELTA_BASE_COUNT
+        self.root = Path(root) if root else Path(config.RELEASES_DIR) / "deltas"
+        self.bases = self.root / "bases"
+        self.index_path = self.bases / "index.json"
+        self.bases.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        try:
+            self.index = json.loads(self.index_path.read_text())  # asset id -> sha256
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.index = {}
+
+    def _save(self):
+        self.index_path.write_text(json.dumps(self.index))
+
+    def remember(self, asset_id: int, path: Path, sha256: str):
+        """Keep a published APK as a base for later patches."""
+        target = self.bases / f"{sha256}.apk"
+        with self.lock:
+            if not target.exists():
+                shutil.copyfile(path, target.with_suffix(".tmp"))
+                target.with_suffix(".tmp").rename(target)
+            self.index[str(asset_id)] = sha256
+            self._save()
+
+    def _base(self, asset: dict) -> Path:
+        """Local copy of a released APK asset, downloading it if needed."""
+        with self.lock:
+            sha256 = self.index.get(str(asset["id"]))
+        if sha256 and (self.bases / f"{sha256}.apk").exists():
+            return self.bases / f"{sha256}.apk"
+
+        logger.info(f"Downloading {asset['name']} as a delta base")
+        staging = self.bases / f".{asset['id']}.download"
+        self.releaser.download_asset(asset, staging)
+        sha256 = file_sha256(staging)
+        target = self.bases / f"{sha256}.apk"
+        staging.rename(target)
+        with self.lock:
+            self.index[str(asset["id"])] = sha256
+            self._save()
+        return target
+
+    def _previous(self, version: str, name: str) -> List[tuple]:
+        """(version, asset) of the same APK in the highest releases below version.
+
+        Releases are ordered by version, not by when they were published, so
+        rebuilding an old version patches from its real predecessors.
+        """
+        current = version_key(version)
+        if current is None:
+            return []
+        earlier = []
+        for release in self.releaser.releases():
+            other = release["tag_name"][1:] if release["tag_name"].startswith("v") else release["tag_name"]
+            key = version_key(other)
+            if release.get("draft") or key is None or key >= current:
+                continue
+            earlier.append((key, other, release))
+
+        found = []
+        for _, other, release in sorted(earlier, key=lambda e: e[0], reverse=True):
+            base_name = name.replace(f"-v{version}", f"-v{other}", 1)
+            asset = next((a for a in release.get("assets", []) if a["name"] == base_name), None)
+            if asset:
+                found.append((other, asset))
+            if len(found) >= self.base_count:
+                break
+        return found
+
+    def publish(self, version: str, version_code: int, name: str, apk_path: Path,
+                published: dict) -> Optional[dict]:
+        """Publish patches and the manifest for one uploaded APK asset.
+
+        published is the upload result of the APK ("url", "assetId",
+        "sha256", "size"). Returns {"manifestUrl", "deltas"} for the build
+        result, or None when there is nothing to publish. Failures are
+        logged, not raised: the full APK is already out.
+        """
+        work_dir = self.root / f".{name}"
+        try:
+            self.remember(published["assetId"], apk_path, published["sha256"])
+            previous = self._previous(version, name)
+            if not previous:
+                return None
+
+            shutil.rmtree(work_dir, ignore_errors=True)
+            work_dir.mkdir(parents=True)
+            stem = name[:-len(".apk")] if name.endswith(".apk") else name
+            new_data = Path(apk_path).read_bytes()
+            patches, assets = [], []
+            for other, asset in previous:
+                base = self._base(asset)
+                patch = bsdiff4.diff(base.read_bytes(), new_data)
+                if len(patch) >= published["size"]:
+                    logger.info(f"Patch from v{other} is not smaller than the APK, skipped")
+                    continue
+                patch_name = f"{stem}-from-v{other}.bsdiff"
+                (work_dir / patch_name).write_bytes(patch)
+                patches.append({
+                    "from": other,
+                    "fromSha256": base.stem,
+                    "name": patch_name,
+                    "algorithm": PATCH_ALGORITHM
+                })
+                assets.append({"path": work_dir / patch_name, "name": patch_name,
+                               "content_type": "application/octet-stream"})
+                logger.info(f"Patch v{other} -> v{version}: {len(patch) // 1024} KiB "
+                            f"of {published['size'] // 1024} KiB")
+            if not patches:
+                return None
+
+            for patch, result in zip(patches, self.releaser.publish_assets(version, assets)):
+                patch.update({"url": result["url"], "size": result["size"], "sha256": result["sha256"]})
+
+            manifest_name = f"{stem}-deltas.json"
+            (work_dir / manifest_name).write_text(json.dumps({
+                "version": version,
+                "versionCode": version_code,
+                "apk": {
+                    "name": name,
+                    "url": published["url"],
+                    "size": published["size"],
+                    "sha256": published["sha256"]
+                },
+                "deltas": patches
+            }, indent=2))
+            manifest = self.releaser.publish_assets(version, [{
+                "path": work_dir / manifest_name, "name": manifest_name,
+                "content_type": "application/json"
+            }])[0]
+
+            self._prune()
+            return {
+                "manifestUrl": manifest["url"],
+                "deltas": [{"from": p["from"], "size": p["size"], "url": p["url"]} for p in patches]
+            }
+        except (OSError, ValueError, requests.RequestException, UploadError) as e:
+            logger.warning(f"Delta publishing for {name} failed: {e}")
+            return None
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def _prune(self):
+        """Drop bases that no longer belong to one of the recent releases."""
+        keep = set()
+        for release in self.releaser.releases(self.base_count + 1):
+            for asset in release.get("assets", []):
+                keep.add(str(asset["id"]))
+        with self.lock:
+            self.index = {asset_id: sha for asset_id, sha in self.index.items() if asset_id in keep}
+            self._save()
+            wanted = set(self.index.values())
+        for path in self.bases.glob("*.apk"):
+            if path.stem not in wanted:
+                path.unlink(missing_ok=True)
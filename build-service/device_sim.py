@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Device Simulator
+
+Simulated IOCast devices for trying out OTA rollouts against a local broker
+(e.g. mosquitto) without a fleet of tablets. Each device publishes status and
+telemetry like the app does, acks update commands, and after a simulated
+download and install reports the new versionCode in its telemetry.
+
+    python device_sim.py --devices 50 --failure-rate 0.05 --version-code 10
+"""
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+import config
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("DeviceSim")
+
+
+class SimulatedFleet:
+    """Devices sim-000, sim-001, ... sharing one MQTT connection."""
+
+    def __init__(self, client, count: int, version_code: int, failure_rate: float,
+                 install_time: float, offline_rate: float):
+        self.client = client
+        self.failure_rate = failure_rate
+        self.install_time = install_time
+        self.devices = {
+            f"sim-{i:03d}": {"versionCode": version_code,
+                             "online": random.random() >= offline_rate}
+            for i in range(count)
+        }
+
+    def _topic(self, device_id: str, kind: str) -> str:
+        return f"{config.DEVICE_TOPIC_PREFIX}/{device_id}/{kind}"
+
+    def announce(self):
+        for device_id, device in self.devices.items():
+            self.client.publish(self._topic(device_id, "status"), json.dumps({
+                "status": "online" if device["online"] else "offline",
+                "deviceId": device_id,
+                "timestamp": int(time.time() * 1000)
+            }), qos=1, retain=True)
+            self._telemetry(device_id)
+        self.client.subscribe(f"{config.DEVICE_TOPIC_PREFIX}/+/cmd/update", qos=1)
+
+    def _telemetry(self, device_id: str):
+        device = self.devices[device_id]
+        self.client.publish(self._topic(device_id, "telemetry"), json.dumps({
+            "deviceId": device_id,
+            "appVersion": f"sim-{device['versionCode']}",
+            "appVersionCode": device["versionCode"],
+            "timestamp": int(time.time() * 1000)
+        }), qos=1, retain=True)
+
+    def on_message(self, client, userdata, msg):
+        device_id = msg.topic.split("/")[1]
+        device = self.devices.get(device_id)
+        if device is None or not device["online"]:
+            return
+        try:
+            command = json.loads(msg.payload.decode("utf-8"))
+        except json.JSONDecodeError:
+            return
+        threading.Thread(target=self._update, args=(device_id, command), daemon=True).start()
+
+    def _update(self, device_id: str, command: dict):
+        failed = random.random() < self.failure_rate
+        time.sleep(random.uniform(0.1, 1.0))
+        self.client.publish(self._topic(device_id, "cmd/update/ack"), json.dumps({
+            "command": "update",
+            "success": not failed,
+            "message": "Download failed" if failed else f"Downloading update from {command.get('url')}",
+            "timestamp": int(time.time() * 1000)
+        }), qos=1)
+        if failed:
+            logger.info(f"{device_id}: update failed")
+            return
+
+        # Download, install and restart
+        time.sleep(random.uniform(0.5, 1.5) * self.install_time)
+        self.devices[device_id]["versionCode"] = int(command.get("versionCode") or
+                                                     self.devices[device_id]["versionCode"] + 1)
+        self._telemetry(device_id)
+        logger.info(f"{device_id}: updated to versionCode {self.devices[device_id]['versionCode']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated IOCast devices for OTA rollouts")
+    parser.add_argument("--devices", type=int, default=20)
+    parser.add_argument("--version-code", type=int, default=1, help="installed versionCode")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--offline-rate", type=float, default=0.0)
+    parser.add_argument("--install-time", type=float, default=5.0, help="seconds per update")
+    args = parser.parse_args()
+
+    client = mqtt.Client(client_id=f"iocast-device-sim-{random.randrange(1 << 16):04x}")
+    client.username_pw_set(config.MQTT_USER, config.MQTT_PASSWORD)
+    fleet = SimulatedFleet(client, args.devices, args.version_code, args.failure_rate,
+                           args.install_time, args.offline_rate)
+    client.on_connect = lambda c, u, f, rc: fleet.announce()
+    client.on_message = fleet.on_message
+
+    logger.info(f"Simulating {args.devices} devices on {config.MQTT_HOST}:{config.MQTT_PORT}")
+    client.connect(config.MQTT_HOST, config.MQTT_PORT, keepalive=60)
+    try:
+        client.loop_forever()
+    except KeyboardInterrupt:
+        client.disconnect()
+
+
+if __name__ == "__main__":
+    main()
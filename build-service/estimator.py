@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Progress Estimator - Build percentage and ETA learned from build history
+"""
+import time
+from typing import Optional, Tuple
+
+import config
+from telemetry import BUILD_END_LINE, TASK_LINE, TelemetryStore, task_phase
+
+# Step shown to users while a task of a given phase runs
+PHASE_STEPS = {
+    "kotlinCompile": "Compiling Kotlin sources",
+    "javaCompile": "Compiling Java sources",
+    "dex": "Converting to dex",
+    "resources": "Processing resources",
+    "packaging": "Packaging APK",
+    "otherTasks": "Running Gradle tasks",
+}
+
+
+class ProgressEstimator:
+    """Estimates how far a Gradle build has come from its task output.
+
+    With history, every task is weighted by its median duration in recent
+    builds: progress is the expected work done so far over the expected total,
+    and the ETA is the expected work left (plus the publish step). Tasks not
+    seen before count for nothing. Without history, progress falls back to the
+    number of tasks started against the expected task count, and the ETA to
+    the average time per task so far.
+    """
+
+    def __init__(self, profile: Optional[dict] = None):
+        profile = profile or {"builds": 0, "tasks": {}}
+        self.tasks = profile.get("tasks", {})
+        self.has_history = profile.get("builds", 0) > 0 and bool(self.tasks)
+        self.expected_count = profile.get("taskCount") or config.ETA_DEFAULT_TASK_COUNT
+        self.configuration = profile.get("gradleConfiguration") or 0.0
+        self.tail = profile.get("publish") or 0.0
+        self.total = self.configuration + sum(t["seconds"] for t in self.tasks.values())
+
+        self.started = time.monotonic()
+        self.seen = set()
+        self.done_work = 0.0  # expected seconds of finished tasks
+        self.current: Optional[str] = None
+        self.current_started: Optional[float] = None
+        self.finished = False
+
+    @classmethod
+    def from_history(cls, telemetry: TelemetryStore) -> "ProgressEstimator":
+        return cls(telemetry.task_profile(config.ETA_HISTORY_BUILDS))
+
+    def observe_line(self, line: str) -> Optional[str]:
+        """Feed one output line. Returns a step description when a task starts."""
+        match = TASK_LINE.match(line)
+        if match:
+            return self.task_started(match.group(1))
+        if BUILD_END_LINE.match(line):
+            self.build_ended()
+        return None
+
+    def task_started(self, task: str) -> str:
+        """Record that a task started. Returns its step description."""
+        self._finish_current()
+        self.seen.add(task)
+        self.current = task
+        self.current_started = time.monotonic()
+        return f"{PHASE_STEPS[task_phase(task)]} ({task})"
+
+    def build_ended(self):
+        self._finish_current()
+        self.finished = True
+
+    def _finish_current(self):
+        if self.current is not None:
+            self.done_work += self._expected(self.current)
+            self.current = None
+
+    def _expected(self, task: str) -> float:
+        return self.tasks.get(task, {}).get("seconds", 0.0)
+
+    def estimate(self) -> Tuple[int, Optional[int]]:
+        """Return (percent 0-100, ETA in seconds or None)."""
+        if self.finished:
+            return 100, int(self.tail) if self.has_history else None
+
+        now = time.monotonic()
+        if self.has_history and self.total > 0:
+            done = self.done_work
+            if self.seen:
+                done += self.configuration
+            else:
+                done += min(now - self.started, self.configuration)
+            if self.current is not None:
+                done += min(now - self.current_started, self._expected(self.current))
+
+            percent = min(int(done * 100 / self.total), 99)
+            eta = max(self.total - done, 0.0) + self.tail
+            return percent, int(eta)
+
+        started = len(self.seen)
+        expected = max(self.expected_count, started + 1)
+        percent = min(int(started * 100 / expected), 99)
+        eta = None
+        if started:
+            per_task = (now - self.started) / started
+            eta = int(per_task * (expected - started))
+        return percent, eta
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Git Mirror - Long-lived bare mirror with per-build worktrees
+"""
+import fcntl
+import logging
+import re
+import shutil
+import subprocess
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import config
+
+logger = logging.getLogger("GitMirror")
+
+SHA_PATTERN = re.compile(r"^[0-9a-f]{7,40}$")
+
+
+class GitMirror:
+    """Keeps a bare mirror of the repository under BUILD_CACHE_DIR.
+
+    The mirror is fetched incrementally, so back-to-back builds only transfer
+    new objects. Each build gets a detached worktree that shares the mirror's
+    object store. All mutations of the mirror are serialised with a file lock.
+    """
+
+    def __init__(self, path: Optional[Path] = None, url: Optional[str] = None):
+        self.path = Path(path) if path else Path(config.BUILD_CACHE_DIR) / "mirror.git"
+        self.url = url or config.GIT_REPO_URL
+        self.lock_path = self.path.parent / f"{self.path.name}.lock"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    @contextmanager
+    def _locked(self):
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _git(self, *args, timeout: int = 300, check: bool = True) -> subprocess.CompletedProcess:
+        result = subprocess.run(
+            ["git", "--git-dir", str(self.path), *args],
+            capture_output=True,
+            text=True,
+            timeout=timeout
+        )
+        if check and result.returncode != 0:
+            raise RuntimeError(f"git {args[0]} failed: {result.stderr.strip()}")
+        return result
+
+    def fetch(self):
+        """Create the mirror on first use, otherwise fetch new objects only."""
+        with self._locked():
+            if not (self.path / "HEAD").exists():
+                logger.info(f"Creating mirror of {self.url} in {self.path}")
+                result = subprocess.run(
+                    ["git", "clone", "--mirror", self.url, str(self.path)],
+                    capture_output=True,
+                    text=True,
+                    timeout=600
+                )
+                if result.returncode != 0:
+                    raise RuntimeError(f"Git mirror clone failed: {result.stderr}")
+                return
+
+            logger.info("Fetching mirror updates")
+            self._git("fetch", "--prune", "origin")
+
+    def ls_remote(self, branches: List[str]) -> Dict[str, str]:
+        """Current head SHA of each branch on the remote, without fetching."""
+        result = subprocess.run(
+            ["git", "ls-remote", self.url, *[f"refs/heads/{b}" for b in branches]],
+            capture_output=True,
+            text=True,
+            timeout=60
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f"git ls-remote failed: {result.stderr.strip()}")
+
+        heads = {}
+        for line in result.stdout.splitlines():
+            sha, ref = line.split("\t", 1)
+            heads[ref[len("refs/heads/"):]] = sha
+        return heads
+
+    def _has_commit(self, sha: str) -> bool:
+        return self._git("cat-file", "-e", f"{sha}^{{commit}}", check=False).returncode == 0
+
+    def resolve(self, ref: str) -> str:
+        """Resolve a branch name or (abbreviated) commit SHA to a full SHA.
+
+        Branches are always fetched first so the tip is current. Commits that
+        are already in the mirror are resolved without touching the network.
+        """
+        if SHA_PATTERN.match(ref) and (self.path / "HEAD").exists() and self._has_commit(ref):
+            return self._git("rev-parse", f"{ref}^{{commit}}").stdout.strip()
+
+        self.fetch()
+
+        if SHA_PATTERN.match(ref):
+            if not self._has_commit(ref):
+                # Full SHAs not reachable from a ref can still be fetched directly
+                with self._locked():
+                    self._git("fetch", "origin", ref, check=False)
+            if self._has_commit(ref):
+                return self._git("rev-parse", f"{ref}^{{commit}}").stdout.strip()
+
+        result = self._git("rev-parse", "--verify", f"refs/heads/{ref}^{{commit}}", check=False)
+        if result.returncode != 0:
+            raise RuntimeError(f"Unknown branch or commit: {ref}")
+        return result.stdout.strip()
+
+    def add_worktree(self, sha: str, dest: Path) -> Path:
+        """Check out sha as a detached worktree at dest."""
+        with self._locked():
+            self._git("worktree", "add", "--detach", "--force", str(dest), sha)
+        logger.info(f"Checked out {sha[:12]} at {dest}")
+        return dest
+
+    def remove_worktree(self, dest: Path):
+        """Remove a worktree and its administrative files."""
+        with self._locked():
+            result = self._git("worktree", "remove", "--force", str(dest), check=False)
+            if result.returncode != 0:
+                # Build outputs owned by the container user can make remove fail
+                shutil.rmtree(dest, ignore_errors=True)
+            self._git("worktree", "prune", check=False)
+
+    def prune(self):
+        """Drop worktree records whose directories no longer exist."""
+        if not (self.path / "HEAD").exists():
+            return
+        with self._locked():
+            self._git("worktree", "prune", check=False)
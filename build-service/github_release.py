@@ -3,133 +3,294 @@
 GitHub Release Manager - Handles creating releases and uploading APKs
 """
 import logging
+import threading
+import time
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Dict, List, Optional, Tuple
 
-from github import Github
-from github.GithubException import GithubException
+import requests
+from requests.adapters import HTTPAdapter
 
 import config
+from publisher import APK_CONTENT_TYPE, StreamingPublisher, publish_file
 
 logger = logging.getLogger("GitHubReleaser")
 
+# Releases per page when listing (GitHub's maximum)
+PAGE_SIZE = 100
+
 
 class GitHubReleaser:
-    """Handles GitHub release creation and asset uploads."""
+    """Handles GitHub release creation and asset uploads.
 
-    def __init__(self):
-        self.github = None
-        self.repo = None
-        self._initialized = False
+    All GitHub API traffic goes through one pooled requests session, shared
+    with the asset uploader. Release metadata is cached: within
+    RELEASE_CACHE_TTL seconds it is served from memory, after that it is
+    revalidated with If-None-Match, which GitHub answers with 304 (not
+    counted against the rate limit) when nothing changed. Releases are
+    listed with their assets in bulk, 100 per page, instead of one request
+    per release.
+    """
 
-    def _ensure_initialized(self):
-        """Lazy initialization - only connect when needed."""
-        if self._initialized:
-            return
+    def __init__(self, session: Optional[requests.Session] = None):
+        self.api_url = config.GITHUB_API_URL.rstrip("/")
+        self.session = session or requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=max(config.PIPELINE_IO_WORKERS * 2, 4))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.publisher = StreamingPublisher(session=self.session)
+        self.ttl = config.RELEASE_CACHE_TTL
+        # url -> (fetched at, etag, json, next page url)
+        self._cache: Dict[str, Tuple[float, Optional[str], object, Optional[str]]] = {}
+        self._lock = threading.Lock()
+        self.counters = {"requests": 0, "notModified": 0, "cached": 0}
+        self.rate_limit_remaining: Optional[int] = None
 
+    def _ensure_token(self):
         if not config.GITHUB_TOKEN:
             raise ValueError("GITHUB_TOKEN environment variable not set")
 
-        self.github = Github(config.GITHUB_TOKEN)
-        self.repo = self.github.get_repo(config.GITHUB_REPO)
-        self._initialized = True
-        logger.info(f"Connected to GitHub repo: {config.GITHUB_REPO}")
+    def _url(self, path: str) -> str:
+        return f"{self.api_url}/repos/{config.GITHUB_REPO}{path}"
 
-    def create_release(self, version: str, apk_path: Path,
-                       notes: Optional[str] = None) -> str:
+    def _get(self, url: str, fresh: bool = False) -> Tuple[object, Optional[str]]:
+        """GET a JSON resource through the cache. Returns (json, next page url).
+
+        Raises requests.HTTPError; a 404 is not cached.
         """
-        Create a GitHub release and upload the APK.
+        self._ensure_token()
+        with self._lock:
+            entry = self._cache.get(url)
+            if entry and not fresh and time.monotonic() - entry[0] < self.ttl:
+                self.counters["cached"] += 1
+                return entry[2], entry[3]
 
-        Args:
-            version: Version string (e.g., "1.3.0")
-            apk_path: Path to the APK file
-            notes: Optional release notes
+        headers = {"If-None-Match": entry[1]} if entry and entry[1] else {}
+        response = self.session.get(url, headers=headers, timeout=30)
+        remaining = response.headers.get("X-RateLimit-Remaining")
+        with self._lock:
+            self.counters["requests"] += 1
+            if remaining is not None:
+                self.rate_limit_remaining = int(remaining)
+            if response.status_code == 304 and entry:
+                self.counters["notModified"] += 1
+                self._cache[url] = (time.monotonic(),) + entry[1:]
+                return entry[2], entry[3]
 
-        Returns:
-            URL to the uploaded APK asset
+        response.raise_for_status()
+        data = response.json()
+        next_url = response.links.get("next", {}).get("url")
+        with self._lock:
+            self._cache[url] = (time.monotonic(), response.headers.get("ETag"), data, next_url)
+        return data, next_url
+
+    def invalidate(self):
+        """Forget cached metadata after a release changed (ETags are kept)."""
+        with self._lock:
+            self._cache = {url: (0.0,) + entry[1:] for url, entry in self._cache.items()}
+
+    def releases(self, limit: Optional[int] = None) -> List[dict]:
+        """Raw release JSON (assets included), newest first, all pages up to limit."""
+        result = []
+        url = self._url(f"/releases?per_page={PAGE_SIZE}")
+        while url and (limit is None or len(result) < limit):
+            page, url = self._get(url)
+            result.extend(page)
+        return result[:limit] if limit is not None else result
+
+    def find_release(self, version: str, fresh: bool = False) -> Optional[dict]:
+        """Raw JSON of the release of version, or None."""
+        try:
+            return self._get(self._url(f"/releases/tags/v{version}"), fresh=fresh)[0]
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                return None
+            raise
+
+    def prepare_release(self, version: str, notes: Optional[str] = None) -> dict:
+        """Return the GitHub release for version, creating it if needed.
+
+        An existing release is kept (with its download URLs and history);
+        its notes are updated if given and publish_assets replaces its assets.
         """
-        self._ensure_initialized()
         tag_name = f"v{version}"
         release_name = f"IOCast v{version}"
 
+        existing = self.find_release(version, fresh=True)
+        if existing:
+            logger.info(f"Release {tag_name} already exists, publishing into it")
+            if notes is not None and (existing.get("body") != notes or
+                                      existing.get("name") != release_name):
+                response = self.session.patch(
+                    self._url(f"/releases/{existing['id']}"),
+                    json={"name": release_name, "body": notes},
+                    timeout=30
+                )
+                response.raise_for_status()
+                existing = response.json()
+            return existing
+
         if notes is None:
             notes = f"Release v{version}"
 
-        # Check if release already exists
-        try:
-            existing = self.repo.get_release(tag_name)
-            logger.info(f"Release {tag_name} already exists, deleting...")
-            existing.delete_release()
-        except GithubException as e:
-            if e.status != 404:
-                raise
-
-        # Create new release
         logger.info(f"Creating release {tag_name}")
-        release = self.repo.create_git_release(
-            tag=tag_name,
-            name=release_name,
-            message=notes,
-            draft=False,
-            prerelease=False
+        response = self.session.post(
+            self._url("/releases"),
+            json={
+                "tag_name": tag_name,
+                "name": release_name,
+                "body": notes,
+                "draft": False,
+                "prerelease": False
+            },
+            timeout=30
         )
+        response.raise_for_status()
+        return response.json()
 
-        # Upload APK
-        apk_name = f"iocast-v{version}.apk"
-        logger.info(f"Uploading {apk_path} as {apk_name}")
+    @staticmethod
+    def asset_name(version: str, variant: Optional[str] = None) -> str:
+        """Release asset name of an APK; variant is omitted for the default build."""
+        if variant is None:
+            return f"iocast-v{version}.apk"
+        return f"iocast-v{version}-{variant}.apk"
 
-        asset = release.upload_asset(
-            path=str(apk_path),
-            name=apk_name,
-            content_type="application/vnd.android.package-archive"
+    def _replace_asset(self, old: dict, new_id: int) -> dict:
+        """Swap an uploaded asset in under the name of an existing one."""
+        self.session.delete(self._url(f"/releases/assets/{old['id']}"), timeout=30).raise_for_status()
+        response = self.session.patch(
+            self._url(f"/releases/assets/{new_id}"), json={"name": old["name"]}, timeout=30
         )
+        response.raise_for_status()
+        return response.json()
 
-        download_url = asset.browser_download_url
-        logger.info(f"APK uploaded successfully: {download_url}")
+    def publish_assets(self, version: str, assets: List[dict],
+                       notes: Optional[str] = None) -> List[dict]:
+        """
+        Create a GitHub release (or reuse the existing one) and upload several APKs to it.
 
-        return download_url
+        An asset that already exists is replaced: the new file is uploaded
+        under a temporary name and renamed once the old one is deleted, so
+        the download URL is only briefly missing, never broken.
+
+        Args:
+            version: Version string (e.g., "1.3.0")
+            assets: dicts with "path" and "name", and optionally "copy_to" and
+                "on_hashed" as for publish_release and "content_type" (default APK)
+            notes: Optional release notes
+
+        Returns:
+            list with the "url", "sha256" and "size" of each asset, in order
+        """
+        release = self.prepare_release(version, notes)
+        existing = {asset["name"]: asset for asset in release.get("assets", [])}
+
+        published = []
+        try:
+            for asset in assets:
+                old = existing.get(asset["name"])
+                upload_name = f"{asset['name']}.new" if old else asset["name"]
+                logger.info(f"Uploading {asset['path']} as {upload_name}")
+                result = publish_file(
+                    self.publisher, asset["path"], release["id"], upload_name,
+                    copy_to=asset.get("copy_to"), on_hashed=asset.get("on_hashed"),
+                    content_type=asset.get("content_type", APK_CONTENT_TYPE)
+                )
+                if old:
+                    logger.info(f"Replacing existing asset {asset['name']}")
+                    result["url"] = self._replace_asset(old, result["assetId"])["browser_download_url"]
+                logger.info(f"APK uploaded successfully: {result['url']}")
+                published.append(result)
+        finally:
+            self.invalidate()
+        return published
+
+    def publish_release(self, version: str, apk_path: Path,
+                        notes: Optional[str] = None,
+                        copy_to: Optional[Path] = None,
+                        on_hashed: Optional[Callable[[str, int], None]] = None) -> dict:
+        """
+        Create a GitHub release and upload the APK in a single read pass.
+
+        Args:
+            version: Version string (e.g., "1.3.0")
+            apk_path: Path to the APK file
+            notes: Optional release notes
+            copy_to: Optional path the APK is copied to while uploading
+            on_hashed: Called with (sha256, size) once the file is fully read,
+                even if the upload fails
+
+        Returns:
+            dict with the APK asset "url", its "sha256" and "size"
+        """
+        return self.publish_assets(version, [{
+            "path": apk_path,
+            "name": self.asset_name(version),
+            "copy_to": copy_to,
+            "on_hashed": on_hashed
+        }], notes)[0]
+
+    def create_release(self, version: str, apk_path: Path,
+                       notes: Optional[str] = None) -> str:
+        """
+        Create a GitHub release and upload the APK.
+
+        Args:
+            version: Version string (e.g., "1.3.0")
+            apk_path: Path to the APK file
+            notes: Optional release notes
+
+        Returns:
+            URL to the uploaded APK asset
+        """
+        return self.publish_release(version, apk_path, notes)["url"]
+
+    def download_asset(self, asset: dict, dest: Path):
+        """Download a release asset (raw JSON from releases()) to dest."""
+        with self.session.get(asset["url"], headers={"Accept": "application/octet-stream"},
+                              stream=True, timeout=(30, 300)) as response:
+            response.raise_for_status()
+            with open(dest, "wb") as f:
+                for chunk in response.iter_content(1024 * 1024):
+                    f.write(chunk)
+
+    @staticmethod
+    def _release_dict(release: dict) -> dict:
+        return {
+            "tag": release["tag_name"],
+            "name": release.get("name"),
+            "url": release["html_url"],
+            "published_at": release.get("published_at"),
+            "assets": [
+                {
+                    "name": asset["name"],
+                    "url": asset["browser_download_url"],
+                    "size": asset["size"]
+                }
+                for asset in release.get("assets", [])
+            ]
+        }
 
     def get_latest_release(self) -> Optional[dict]:
         """Get information about the latest release."""
-        self._ensure_initialized()
         try:
-            release = self.repo.get_latest_release()
-            return {
-                "tag": release.tag_name,
-                "name": release.title,
-                "url": release.html_url,
-                "published_at": release.published_at.isoformat(),
-                "assets": [
-                    {
-                        "name": asset.name,
-                        "url": asset.browser_download_url,
-                        "size": asset.size
-                    }
-                    for asset in release.get_assets()
-                ]
-            }
-        except GithubException as e:
-            if e.status == 404:
+            release, _ = self._get(self._url("/releases/latest"))
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
                 return None
             raise
+        return self._release_dict(release)
+
+    def get_release(self, version: str) -> Optional[dict]:
+        """Get information about the release of version."""
+        release = self.find_release(version)
+        return self._release_dict(release) if release else None
 
     def list_releases(self, limit: int = 10) -> list:
         """List recent releases."""
-        self._ensure_initialized()
-        releases = []
-        for release in self.repo.get_releases()[:limit]:
-            releases.append({
-                "tag": release.tag_name,
-                "name": release.title,
-                "url": release.html_url,
-                "published_at": release.published_at.isoformat() if release.published_at else None,
-                "assets": [
-                    {
-                        "name": asset.name,
-                        "url": asset.browser_download_url,
-                        "size": asset.size
-                    }
-                    for asset in release.get_assets()
-                ]
-            })
-        return releases
+        return [self._release_dict(release) for release in self.releases(limit)]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counters, entries=len(self._cache),
+                        rateLimitRemaining=self.rate_limit_remaining)
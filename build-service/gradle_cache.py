@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Gradle Cache - Host-persistent GRADLE_USER_HOME shared by build containers
+"""
+import fcntl
+import logging
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import config
+
+logger = logging.getLogger("GradleCache")
+
+# Directories (relative to the Gradle home) whose children are pruned as
+# independent units, least recently used first. modules-2 artifacts are
+# pruned per module version (group/module/version).
+PRUNABLE_DIRS = [
+    ("wrapper/dists", 1),
+    ("caches/transforms-3", 1),
+    ("caches/build-cache-1", 1),
+    ("caches/modules-2/files-2.1", 3),
+]
+
+
+class GradleCache:
+    """Manages the Gradle home that is mounted into every build container.
+
+    Builds hold a shared lock while Gradle runs, so any number of builds can
+    use the cache concurrently (Gradle coordinates its own file locks). Pruning
+    takes the exclusive lock and is skipped while builds are running.
+    """
+
+    MOUNT_PATH = "/gradle-home"
+
+    def __init__(self, root: Optional[Path] = None, max_bytes: Optional[int] = None):
+        cache_base = Path(config.BUILD_CACHE_DIR)
+        self.root = Path(root) if root else cache_base / "gradle-home"
+        self.lock_path = self.root.parent / f"{self.root.name}.lock"
+        self.max_bytes = max_bytes if max_bytes is not None else config.GRADLE_CACHE_MAX_MB * 1024 * 1024
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def host_path(self) -> str:
+        """Path of the Gradle home as seen by the host Docker daemon."""
+        relative = self.root.relative_to(Path(config.BUILD_CACHE_DIR))
+        return f"{config.HOST_BUILD_CACHE_DIR}/{relative}"
+
+    def volume(self) -> dict:
+        """Docker volume spec mounting the Gradle home into a build container."""
+        return {self.host_path: {'bind': self.MOUNT_PATH, 'mode': 'rw'}}
+
+    @contextmanager
+    def _lock(self, mode: int):
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, mode)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @contextmanager
+    def shared(self):
+        """Hold the cache for the duration of a build."""
+        with self._lock(fcntl.LOCK_SH):
+            yield
+
+    def size(self) -> int:
+        """Total size of the Gradle home in bytes."""
+        return _tree_size(self.root)
+
+    def usage(self) -> dict:
+        """Size of the Gradle home broken down by prunable section."""
+        usage = {"total": self.size()}
+        for rel_dir, _ in PRUNABLE_DIRS:
+            usage[rel_dir] = _tree_size(self.root / rel_dir)
+        return usage
+
+    def _entries(self) -> List[Tuple[float, int, Path]]:
+        """Return (last_used, size, path) for every prunable entry."""
+        entries = []
+        for rel_dir, depth in PRUNABLE_DIRS:
+            base = self.root / rel_dir
+            if not base.is_dir():
+                continue
+            for path in _children_at_depth(base, depth):
+                last_used = _last_used(path)
+                if last_used is None:
+                    # Removed by Gradle or a concurrent prune meanwhile
+                    continue
+                entries.append((last_used, _tree_size(path), path))
+        return entries
+
+    def prune(self, target_bytes: Optional[int] = None) -> int:
+        """Evict least recently used entries until the cache fits.
+
+        Returns the number of bytes freed. Does nothing if a build currently
+        holds the cache.
+        """
+        limit = self.max_bytes if target_bytes is None else target_bytes
+        if limit <= 0:
+            return 0
+
+        with open(self.lock_path, "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                logger.info("Gradle cache in use, skipping prune")
+                return 0
+
+            try:
+                total = self.size()
+                if total <= limit:
+                    return 0
+
+                logger.info(f"Gradle cache is {total // (1024 * 1024)} MB, pruning to "
+                            f"{limit // (1024 * 1024)} MB")
+                freed = 0
+                for last_used, entry_size, path in sorted(self._entries()):
+                    if total - freed <= limit:
+                        break
+                    logger.info(f"Pruning {path.relative_to(self.root)} "
+                                f"(last used {int(time.time() - last_used) // 86400}d ago)")
+                    shutil.rmtree(path, ignore_errors=True)
+                    freed += entry_size
+
+                logger.info(f"Pruned {freed // (1024 * 1024)} MB from Gradle cache")
+                return freed
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _tree_size(path: Path) -> int:
+    """Sum of file sizes below path (hard links counted once)."""
+    total = 0
+    seen = set()
+    stack = [str(path)]
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            continue
+        with it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        st = entry.stat(follow_symlinks=False)
+                        if st.st_nlink > 1:
+                            if (st.st_dev, st.st_ino) in seen:
+                                continue
+                            seen.add((st.st_dev, st.st_ino))
+                        total += st.st_size
+                except FileNotFoundError:
+                    continue
+    return total
+
+
+def _children_at_depth(base: Path, depth: int) -> List[Path]:
+    level = [base]
+    for _ in range(depth):
+        children = []
+        for parent in level:
+            try:
+                children.extend(child for child in parent.iterdir() if child.is_dir())
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+        level = children
+    return level
+
+
+def _last_used(path: Path) -> Optional[float]:
+    """Most recent access/modification time of an entry and its direct children.
+
+    None if the entry no longer exists.
+    """
+    try:
+        candidates = [path, *path.iterdir()]
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    latest = 0.0
+    for candidate in candidates:
+        try:
+            st = candidate.stat()
+        except FileNotFoundError:
+            continue
+        latest = max(latest, st.st_atime, st.st_mtime)
+    return latest
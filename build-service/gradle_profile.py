@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Gradle Profile - Profiling and configuration cache reports of a build, and regression checks
+"""
+import html
+import json
+import logging
+import re
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from telemetry import task_phase
+
+logger = logging.getLogger("GradleProfile")
+
+# Appended to the Gradle command line of a profiled build. --info is what reports
+# why a task's outputs are not cached; problems are warnings so the build goes on.
+PROFILE_ARGS = " --profile --info --configuration-cache --configuration-cache-problems=warn"
+
+PROFILE_REPORTS = "build/reports/profile"
+CONFIGURATION_CACHE_REPORTS = "build/reports/configuration-cache"
+
+# --info output: "Caching disabled for task ':app:lintVitalRelease' because:" and the
+# reason on the next line
+CACHING_DISABLED_LINE = re.compile(r"^Caching disabled for task '(:\S+)' because:")
+CC_ENTRY_LINE = re.compile(r"^Configuration cache entry (stored|reused|discarded)")
+CC_REUSED_LINE = re.compile(r"^Reusing configuration cache")
+CC_PROBLEMS_LINE = re.compile(r"^(\d+) problems? (?:was|were) found (?:storing|reusing) the configuration cache")
+
+SECTION = re.compile(r"<h2>(.*?)</h2>(.*?)(?=<h2>|\Z)", re.DOTALL)
+ROW = re.compile(r"<tr>\s*<td[^>]*>(.*?)</td>\s*<td class=\"numeric\">(.*?)</td>"
+                 r"(?:\s*<td[^>]*>(.*?)</td>)?\s*</tr>", re.DOTALL)
+DURATION = re.compile(r"^(?:(\d+)h)?(?:(\d+)m)?(?:([\d.]+)s)?$")
+
+# Rows of the profile summary -> reported phase
+SUMMARY_PHASES = {
+    "Startup": "startup",
+    "Settings and buildSrc": "configuration",
+    "Loading Projects": "configuration",
+    "Configuring Projects": "configuration",
+    "Artifact Transforms": "artifactTransforms",
+    "Task Execution": "taskExecution",
+}
+
+# Task outcomes in the profile report; an empty result means the task ran
+CACHED_OUTCOMES = {"FROM-CACHE", "UP-TO-DATE", "NO-SOURCE", "SKIPPED"}
+
+
+def parse_duration(text: str) -> float:
+    """Seconds of a profile report duration: "1m23.45s", "0.012s", "1h2m3.4s"."""
+    match = DURATION.match(text.strip())
+    if not match or not any(match.groups()):
+        return 0.0
+    hours, minutes, seconds = match.groups()
+    return int(hours or 0) * 3600 + int(minutes or 0) * 60 + float(seconds or 0)
+
+
+def parse_profile_report(text: str) -> dict:
+    """Summary phases and task durations of a --profile HTML report."""
+    phases: Dict[str, float] = {}
+    tasks: List[dict] = []
+    for title, body in SECTION.findall(text):
+        title = html.unescape(title.strip())
+        for cells in ROW.findall(body):
+            name, duration, result = (html.unescape(re.sub(r"<[^>]+>", "", c)).strip() for c in cells)
+            if title == "Summary" and name in SUMMARY_PHASES:
+                phase = SUMMARY_PHASES[name]
+                phases[phase] = phases.get(phase, 0.0) + parse_duration(duration)
+            elif title == "Task Execution" and name.count(":") > 1 and result != "(total)":
+                tasks.append({"task": name, "seconds": parse_duration(duration),
+                              "outcome": result or "EXECUTED"})
+    return {"phases": phases, "tasks": tasks}
+
+
+def parse_configuration_cache_report(text: str) -> dict:
+    """Problem count and the tasks behind the problems of a configuration cache report."""
+    start = text.find("// begin-report-data")
+    end = text.find("// end-report-data")
+    if start < 0 or end < 0:
+        return {}
+    try:
+        data = json.loads(text[start + len("// begin-report-data"):end])
+    except json.JSONDecodeError:
+        return {}
+    diagnostics = data.get("diagnostics", [])
+    problems = []
+    for diagnostic in diagnostics:
+        if "problem" not in diagnostic:
+            continue
+        message = "".join(part.get("text") or part.get("name") or "" for part in diagnostic["problem"])
+        tasks = [t.get("path") for t in diagnostic.get("trace", []) if t.get("kind") == "Task"]
+        problems.append({"task": tasks[0] if tasks else None, "message": message})
+    return {
+        "problems": data.get("totalProblemCount", len(problems)),
+        "problemTasks": sorted({p["task"] for p in problems if p["task"]}),
+        "examples": problems[:5]
+    }
+
+
+def _newest(root: Path, pattern: str) -> Optional[Path]:
+    reports = sorted(root.glob(pattern), key=lambda p: p.stat().st_mtime) if root.exists() else []
+    return reports[-1] if reports else None
+
+
+class GradleProfile:
+    """Collects what a profiled build reports, from its output and its report files.
+
+    Build output lines go to observe_line(); once Gradle has finished,
+    ingest() reads the newest profile and configuration cache reports in the
+    checkout and returns the build's profile.
+    """
+
+    def __init__(self):
+        self.non_cacheable: Dict[str, str] = {}  # task -> why its outputs are not cached
+        self.configuration_cache: Optional[str] = None  # stored, reused or discarded
+        self.configuration_cache_problems = 0
+        self._disabled_task: Optional[str] = None
+
+    def observe_line(self, line: str):
+        if self._disabled_task:
+            reason = line.strip()
+            if reason:
+                self.non_cacheable[self._disabled_task] = reason
+                self._disabled_task = None
+            return
+
+        match = CACHING_DISABLED_LINE.match(line)
+        if match:
+            self._disabled_task = match.group(1)
+            return
+        match = CC_ENTRY_LINE.match(line)
+        if match:
+            self.configuration_cache = match.group(1)
+        elif CC_REUSED_LINE.match(line):
+            self.configuration_cache = "reused"
+        else:
+            match = CC_PROBLEMS_LINE.match(line)
+            if match:
+                self.configuration_cache_problems = int(match.group(1))
+
+    def ingest(self, repo_dir: Path) -> Optional[dict]:
+        """The build's profile, or None if Gradle wrote no profile report."""
+        report = _newest(repo_dir / PROFILE_REPORTS, "profile-*.html")
+        if report is None:
+            logger.warning(f"No Gradle profile report in {repo_dir / PROFILE_REPORTS}")
+            return None
+        parsed = parse_profile_report(report.read_text(encoding="utf-8", errors="replace"))
+        tasks = parsed["tasks"]
+        phases = parsed["phases"]
+        for task in tasks:
+            if task["outcome"] == "EXECUTED":
+                phase = task_phase(task["task"])
+                phases[phase] = phases.get(phase, 0.0) + task["seconds"]
+            if task["task"] in self.non_cacheable:
+                task["nonCacheable"] = self.non_cacheable[task["task"]]
+
+        from_cache = sum(1 for t in tasks if t["outcome"] == "FROM-CACHE")
+        # Tasks that could have come from the build cache but ran
+        missed = sum(1 for t in tasks if t["outcome"] == "EXECUTED" and "nonCacheable" not in t)
+        configuration_cache = {"entry": self.configuration_cache,
+                               "problems": self.configuration_cache_problems}
+        cc_report = _newest(repo_dir / CONFIGURATION_CACHE_REPORTS, "**/configuration-cache-report.html")
+        if cc_report:
+            configuration_cache.update(
+                parse_configuration_cache_report(cc_report.read_text(encoding="utf-8", errors="replace")))
+
+        return {
+            "phases": {name: round(seconds, 2) for name, seconds in phases.items()},
+            "tasks": tasks,
+            "fromCache": from_cache,
+            "upToDate": sum(1 for t in tasks if t["outcome"] == "UP-TO-DATE"),
+            "executed": sum(1 for t in tasks if t["outcome"] == "EXECUTED"),
+            "cacheHitRate": round(from_cache / (from_cache + missed), 3) if from_cache + missed else None,
+            "nonCacheable": [{"task": task, "reason": reason}
+                             for task, reason in sorted(self.non_cacheable.items())],
+            "configurationCache": configuration_cache
+        }
+
+
+def find_regressions(profile: dict, baseline: dict, threshold: float,
+                     min_seconds: float, task_limit: int = 5) -> List[dict]:
+    """Phases of profile slower than the baseline medians, with the tasks that got slower.
+
+    A phase regresses when it took more than threshold (a share) longer than
+    its baseline, and at least min_seconds longer.
+    """
+    regressions = []
+    for phase, seconds in profile["phases"].items():
+        base = baseline["phases"].get(phase)
+        if base is None or seconds - base < min_seconds or seconds <= base * (1 + threshold):
+            continue
+
+        slower = []
+        for task in profile["tasks"]:
+            if phase not in ("taskExecution", task_phase(task["task"])):
+                continue
+            task_base = baseline["tasks"].get(task["task"], 0.0)
+            if task["seconds"] - task_base > 0:
+                slower.append({"task": task["task"], "seconds": round(task["seconds"], 2),
+                               "baseline": round(task_base, 2), "outcome": task["outcome"]})
+        slower.sort(key=lambda t: t["seconds"] - t["baseline"], reverse=True)
+        regressions.append({
+            "phase": phase,
+            "seconds": round(seconds, 2),
+            "baseline": round(base, 2),
+            "increase": round(seconds / base - 1, 3) if base else None,
+            "tasks": slower[:task_limit]
+        })
+    return regressions
+
+
+def profile_summary(profile: dict) -> dict:
+    """A profile for the result message: everything but the per-task list."""
+    return {key: value for key, value in profile.items() if key != "tasks"}
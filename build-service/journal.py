@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Job Journal - Append-only record of job state transitions, replayed after a restart
+"""
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import config
+from build_queue import BuildJob
+
+logger = logging.getLogger("JobJournal")
+
+# Stages a job completes, in order; a resumed job continues after the last one
+STAGES = ["queued", "resolved", "cloned", "versioned", "built", "uploaded"]
+
+# A job that was interrupted this many times is failed instead of resumed again
+MAX_RESUMES = 3
+
+# Finished jobs after which the journal is rewritten without them
+COMPACT_AFTER = 100
+
+
+class JobJournal:
+    """JSON lines file with one entry per job state transition.
+
+    Each entry is flushed and fsynced before the job moves on, so a restart
+    loses at most the stage that was in progress. pending() replays the file
+    into the jobs that never finished, each with job.resume set to what they
+    had got done; compact() rewrites the file with only those jobs.
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = Path(path) if path else Path(config.BUILD_CACHE_DIR) / "journal.jsonl"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.file = None
+        self.finished = 0
+
+    def record(self, job_id: str, event: str, **data):
+        """Append a transition of job_id and make it durable."""
+        entry = dict(data, jobId=job_id, event=event, at=round(time.time(), 3))
+        line = json.dumps(entry) + "\n"
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.path, "a", encoding="utf-8")
+            self.file.write(line)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            if event == "finished":
+                self.finished += 1
+            compact = self.finished >= COMPACT_AFTER
+        if compact:
+            self.compact()
+
+    def queued(self, job: BuildJob):
+        self.record(job.id, "queued", job=dict(job.to_dict(), key=job.key, rollout=job.rollout,
+                                                profile=job.profile))
+
+    def _replay(self) -> Dict[str, dict]:
+        """Entries of every unfinished job, in the order the jobs were queued."""
+        jobs: Dict[str, dict] = {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # The line being written when the process died
+                        continue
+                    job_id = entry.get("jobId")
+                    if entry.get("event") == "queued":
+                        jobs[job_id] = {"entries": [entry]}
+                    elif job_id in jobs:
+                        if entry.get("event") == "finished":
+                            del jobs[job_id]
+                        else:
+                            jobs[job_id]["entries"].append(entry)
+        except FileNotFoundError:
+            pass
+        return jobs
+
+    def pending(self) -> List[BuildJob]:
+        """Rebuild the unfinished jobs with job.resume describing their progress.
+
+        job.resume has the last completed "stage" and, when recorded, the
+        job's "workDirs" (cloned), "apks" (built) and "uploaded" assets, plus
+        how often it was "resumed" before.
+        """
+        jobs = []
+        for job_id, state in self._replay().items():
+            fields = state["entries"][0]["job"]
+            job = BuildJob(
+                branch=fields["branch"],
+                version=fields["version"],
+                version_code=fields["versionCode"],
+                commit=fields["commit"],
+                requested_by=fields["requestedBy"],
+                priority=fields["priority"],
+                variants=fields["variants"]
+            )
+            job.id = job_id
+            job.requesters = fields["requesters"]
+            job.key = fields["key"]
+            job.rollout = fields["rollout"]
+            job.profile = fields.get("profile", False)
+            job.queued_at = fields["queuedAt"]
+            job.resume = {"stage": "queued", "resumed": 0}
+
+            for entry in state["entries"][1:]:
+                event = entry["event"]
+                if event in STAGES and STAGES.index(event) > STAGES.index(job.resume["stage"]):
+                    job.resume["stage"] = event
+                if event == "resumed":
+                    job.resume["resumed"] += 1
+                if entry.get("commit"):
+                    job.commit = entry["commit"]
+                if "requesters" in entry:
+                    job.requesters = entry["requesters"]
+                    job.priority = entry["priority"]
+                    job.rollout = entry["rollout"]
+                for field in ("workDirs", "apks", "uploaded"):
+                    if field in entry:
+                        job.resume[field] = entry[field]
+            jobs.append(job)
+        return jobs
+
+    def compact(self):
+        """Rewrite the journal with only the entries of unfinished jobs."""
+        with self.lock:
+            jobs = self._replay()
+            tmp = self.path.with_suffix(".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                for state in jobs.values():
+                    for entry in state["entries"]:
+                        f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            if self.file:
+                self.file.close()
+                self.file = None
+            os.replace(tmp, self.path)
+            self.finished = 0
+        logger.info(f"Compacted job journal to {len(jobs)} unfinished job(s)")
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Log Sink - Single-pass build log parsing with a bounded tail and gzip archive
+"""
+import gzip
+import logging
+import re
+import threading
+import zlib
+from collections import deque
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, Tuple
+
+import config
+from telemetry import BUILD_END_LINE, TASK_LINE
+
+logger = logging.getLogger("LogSink")
+
+# Lines matched by the table below; everything else is "output"
+LINE_MATCHERS = [
+    ("task", TASK_LINE),
+    ("end", BUILD_END_LINE),
+    ("error", re.compile(r"^(e: |FAILURE: |\* What went wrong:|ERROR:|error: )")),
+    ("warning", re.compile(r"^(w: |warning: )")),
+]
+# Cheap prefilter: only lines starting with one of these are run through the table
+MATCH_PREFIXES = ("> Task", "BUILD ", "e: ", "FAILURE", "* What", "ERROR", "error",
+                  "w: ", "warning")
+
+# Longest line kept in the tail / parsed; longer output is split
+MAX_LINE_BYTES = 16 * 1024
+# Largest byte range returned by one log query (keeps MQTT messages small)
+MAX_READ_BYTES = 64 * 1024
+
+
+def classify(line: str) -> Tuple[str, Optional[re.Match]]:
+    """Return (kind, match) for one stripped output line."""
+    if line.startswith(MATCH_PREFIXES):
+        for kind, pattern in LINE_MATCHERS:
+            match = pattern.match(line)
+            if match:
+                return kind, match
+    return "output", None
+
+
+class LogSink:
+    """Consumes one build's output stream once.
+
+    The raw output is written gzip-compressed to path (if given), the last
+    tail_lines lines are kept in a ring buffer for error reports, and lines()
+    yields each line with its kind. Memory use does not grow with log size.
+    """
+
+    def __init__(self, path: Optional[Path] = None, tail_lines: Optional[int] = None):
+        self.path = Path(path) if path else None
+        self.tail = deque(maxlen=tail_lines or config.BUILD_LOG_TAIL_LINES)
+        self.lock = threading.Lock()
+        self.size = 0  # uncompressed bytes written
+        self._file = None
+        if self.path:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = gzip.open(self.path, "wb", compresslevel=6)
+
+    def lines(self, chunks: Iterable[bytes]) -> Iterator[Tuple[str, str, Optional[re.Match]]]:
+        """Archive raw output chunks and yield (line, kind, match) per non-empty line."""
+        pending = b""
+        for chunk in chunks:
+            self._write(chunk)
+            pending += chunk
+            *complete, pending = pending.split(b"\n")
+            if len(pending) > MAX_LINE_BYTES:
+                complete.append(pending)
+                pending = b""
+            for raw in complete:
+                parsed = self._parse(raw)
+                if parsed:
+                    yield parsed
+        if pending:
+            parsed = self._parse(pending)
+            if parsed:
+                yield parsed
+
+    def _write(self, chunk: bytes):
+        if self._file is None:
+            return
+        with self.lock:
+            if self._file is not None:
+                self._file.write(chunk)
+                self.size += len(chunk)
+
+    def _parse(self, raw: bytes):
+        line = raw[:MAX_LINE_BYTES].decode("utf-8", errors="ignore").strip()
+        if not line:
+            return None
+        self.tail.append(line)
+        kind, match = classify(line)
+        return line, kind, match
+
+    def tail_text(self, limit: int = 2000) -> str:
+        """Last output lines, at most limit characters."""
+        return "\n".join(self.tail)[-limit:]
+
+    def flush(self):
+        """Make everything written so far readable from the file."""
+        with self.lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        with self.lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class LogStore:
+    """Directory of compressed build logs, one <job id>.log.gz per build.
+
+    Finished logs are rotated oldest first once the directory exceeds
+    max_bytes. Logs of running builds can be read while they are written.
+    """
+
+    def __init__(self, root: Optional[Path] = None, max_bytes: Optional[int] = None):
+        self.root = Path(root) if root else Path(config.BUILD_CACHE_DIR) / "logs"
+        self.max_bytes = max_bytes if max_bytes is not None else config.BUILD_LOG_MAX_MB * 1024 * 1024
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.active = {}
+
+    def path(self, job_id: str) -> Path:
+        return self.root / f"{job_id}.log.gz"
+
+    def open(self, job_id: str) -> LogSink:
+        sink = LogSink(self.path(job_id))
+        with self.lock:
+            self.active[job_id] = sink
+        return sink
+
+    def close(self, job_id: str):
+        with self.lock:
+            sink = self.active.pop(job_id, None)
+        if sink:
+            sink.close()
+        self.rotate()
+
+    def rotate(self):
+        """Delete the oldest finished logs while over max_bytes."""
+        if self.max_bytes <= 0:
+            return
+        with self.lock:
+            active = {self.path(job_id) for job_id in self.active}
+        logs = []
+        for path in self.root.glob("*.log.gz"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            logs.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in logs)
+        for _, size, path in sorted(logs):
+            if total <= self.max_bytes:
+                break
+            if path in active:
+                continue
+            logger.info(f"Rotating out build log {path.name}")
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def read(self, job_id: str, offset: int = 0, length: int = MAX_READ_BYTES) -> Optional[dict]:
+        """Return uncompressed bytes [offset, offset + length) of a job's log.
+
+        Returns None if there is no log for the job. 'eof' is set when the
+        range reaches the end of what has been written.
+        """
+        path = self.path(job_id)
+        with self.lock:
+            sink = self.active.get(job_id)
+        if sink:
+            sink.flush()
+        if not path.exists():
+            return None
+
+        offset = max(offset, 0)
+        length = max(0, min(length, MAX_READ_BYTES))
+        data, eof = self._decompress_range(path, offset, length)
+        return {
+            "jobId": job_id,
+            "offset": offset,
+            "length": len(data),
+            "data": data.decode("utf-8", errors="replace"),
+            "eof": eof,
+            "running": sink is not None
+        }
+
+    @staticmethod
+    def _decompress_range(path: Path, offset: int, length: int) -> Tuple[bytes, bool]:
+        """Stream-decompress path, keeping only the requested range.
+
+        Tolerates a gzip stream without its trailer (a log still being
+        written). Returns the data and whether it runs to the end of the log.
+        """
+        decompressor = zlib.decompressobj(wbits=31)
+        out = bytearray()
+        position = 0
+        with open(path, "rb") as f:
+            while True:
+                compressed = f.read(64 * 1024)
+                if not compressed:
+                    return bytes(out), True
+                try:
+                    chunk = decompressor.decompress(compressed)
+                except zlib.error:
+                    return bytes(out), True
+                start = max(offset - position, 0)
+                if start < len(chunk):
+                    out += chunk[start:start + length - len(out)]
+                position += len(chunk)
+                if position > offset + length:
+                    return bytes(out), False
+                if decompressor.eof:
+                    return bytes(out), True
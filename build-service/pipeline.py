@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Pipeline - Stage executors and the per-build state handed between them
+"""
+import logging
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from build_queue import BuildJob
+from telemetry import BuildTimer
+
+logger = logging.getLogger("Pipeline")
+
+
+class BuildGroup:
+    """Variants built together by one Gradle invocation in their own worktree."""
+
+    def __init__(self, builder, variants: List[str], log_id: str):
+        self.builder = builder
+        self.variants = variants
+        self.log_id = log_id
+        self.clone_dir: Optional[Path] = None
+        self.log_sink = None
+        self.allocation = None
+        self.usage: Optional[dict] = None
+        self.prebuilt: Optional[dict] = None  # PrebuildStore entry the group builds in
+        self.resumed = False  # builds in the checkout it had before a restart
+
+
+class BuildRun:
+    """Everything one build carries from stage to stage."""
+
+    def __init__(self, job: BuildJob, builder):
+        self.job = job
+        self.builder = builder
+        self.timer = BuildTimer()
+        self.started = time.time()
+        self.commit: Optional[str] = job.commit
+        self.variants: List[str] = job.variants
+        self.keys: Dict[str, str] = {}
+        self.cached: Dict[str, dict] = {}
+        self.groups: List[BuildGroup] = []
+        self.apks: Dict[str, Path] = {}
+        self.uploads: Dict[str, dict] = {}  # copy_to / on_hashed per built variant
+        self.image_id: Optional[str] = None
+        self.lease: Optional[dict] = None  # done message of a build worker
+        self.profiles: List[dict] = []  # Gradle profiles of profiled groups, with their "variants"
+        self.regressions: List[dict] = []  # phases slower than the profile baseline
+        self.status = "failed"
+
+    @property
+    def build_time(self) -> int:
+        return int(time.time() - self.started)
+
+    @property
+    def cache_status(self) -> Optional[str]:
+        """Cache outcome: hit, miss, or partial when only some variants were cached."""
+        if not self.keys:
+            return None
+        if len(self.cached) == len(self.variants):
+            return "hit"
+        return "partial" if self.cached else "miss"
+
+    @property
+    def builders(self) -> list:
+        builders = [self.builder] if self.builder else []
+        return builders + [g.builder for g in self.groups if g.builder is not self.builder]
+
+    @property
+    def resources(self) -> Optional[dict]:
+        """Cores and memory given to the build containers, and what they used."""
+        if self.lease and self.lease.get("allocation"):
+            allocation, usage = self.lease["allocation"], self.lease.get("usage") or {}
+            return {
+                "cpus": allocation["cpus"],
+                "memoryMb": allocation["memoryMb"],
+                "peakRssMb": usage.get("peakRssMb", 0),
+                "cpuSeconds": usage.get("cpuSeconds", 0),
+                "worker": self.lease["workerId"]
+            }
+        groups = [g for g in self.groups if g.allocation]
+        if not groups:
+            return None
+        usage = [g.usage or {} for g in groups]
+        return {
+            "cpus": sum(g.allocation.cpus for g in groups),
+            "memoryMb": sum(g.allocation.memory_mb for g in groups),
+            "peakRssMb": round(sum(u.get("peakRssMb", 0) for u in usage), 1),
+            "cpuSeconds": round(sum(u.get("cpuSeconds", 0) for u in usage), 1)
+        }
+
+    @property
+    def log_size(self) -> Optional[int]:
+        if self.lease:
+            return self.lease.get("logSize")
+        sinks = [g.log_sink for g in self.groups if g.log_sink]
+        return sum(sink.size for sink in sinks) if sinks else None
+
+
+class Stage:
+    """A fixed set of threads running handler on items from a bounded inbox.
+
+    put() blocks while the inbox is full, so a slow stage holds back the one
+    feeding it instead of letting work (and checked-out worktrees) pile up.
+    capacity 0 means unbounded. A stage can take its items from another
+    source, e.g. BuildQueue.get, instead of its inbox.
+    """
+
+    def __init__(self, name: str, handler: Callable, workers: int = 1, capacity: int = 0,
+                 source: Optional[Callable[[float], object]] = None):
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.inbox = queue.Queue(maxsize=capacity)
+        self.source = source or self._take
+        self.threads = []
+        self.busy = 0
+        self.handled = 0
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._loop, name=f"{self.name}-{index}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        logger.info(f"Stage {self.name} started with {self.workers} worker(s)")
+
+    def put(self, item, cancelled: Optional[Callable[[], bool]] = None) -> bool:
+        """Hand an item to this stage, waiting while its inbox is full.
+
+        Returns False, without handing it over, once cancelled() is true.
+        """
+        while True:
+            if cancelled and cancelled():
+                return False
+            try:
+                self.inbox.put(item, timeout=1.0)
+                return True
+            except queue.Full:
+                continue
+
+    def _take(self, timeout: float):
+        try:
+            return self.inbox.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _loop(self):
+        while not self.closed:
+            item = self.source(1.0)
+            if item is None:
+                continue
+            with self.lock:
+                self.busy += 1
+            try:
+                self.handler(item)
+            except Exception:
+                logger.exception(f"Unhandled error in stage {self.name}")
+            finally:
+                with self.lock:
+                    self.busy -= 1
+                    self.handled += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "workers": self.workers,
+                "busy": self.busy,
+                "waiting": self.inbox.qsize(),
+                "handled": self.handled
+            }
+
+    def close(self):
+        """Stop taking new items; items in flight finish."""
+        self.closed = True
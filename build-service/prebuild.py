@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Prebuild - Speculative builds of new branch heads and the checkouts they leave
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import config
+from git_mirror import GitMirror
+
+logger = logging.getLogger("Prebuild")
+
+# Queue priority of speculative builds - below every real trigger
+PREBUILD_PRIORITY = -100
+
+
+class PrebuildStore:
+    """Checkouts with Gradle outputs from speculative builds, by commit SHA.
+
+    A real build of the same commit takes the checkout, so Gradle only redoes
+    what the version change touches, and gives it back afterwards. At most
+    keep checkouts are held; the oldest are removed first. The index survives
+    restarts in BUILD_CACHE_DIR/prebuilds.json.
+    """
+
+    def __init__(self, mirror: GitMirror, keep: Optional[int] = None):
+        self.mirror = mirror
+        self.keep = keep if keep is not None else config.PREBUILD_KEEP
+        self.root = Path(config.BUILD_CACHE_DIR)
+        self.index_path = self.root / "prebuilds.json"
+        self.ready: "OrderedDict[str, dict]" = OrderedDict()
+        self.pending = set()
+        self.in_use = set()
+        self.cond = threading.Condition()
+        self._load()
+
+    def _load(self):
+        try:
+            entries = json.loads(self.index_path.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        for sha, entry in entries.items():
+            if Path(entry["path"]).exists():
+                self.ready[sha] = entry
+        logger.info(f"Loaded {len(self.ready)} prebuilt checkout(s)")
+
+    def _save(self):
+        self.index_path.write_text(json.dumps(self.ready))
+
+    def path_for(self, sha: str) -> Path:
+        return self.root / f"prebuild-{sha[:12]}"
+
+    def begin(self, sha: str) -> bool:
+        """Claim sha for a speculative build. False if it is built or being built."""
+        with self.cond:
+            if sha in self.ready or sha in self.pending or sha in self.in_use:
+                return False
+            self.pending.add(sha)
+            return True
+
+    def finish(self, sha: str, path: Path, variants: List[str]):
+        """Store the checkout of a finished speculative build."""
+        with self.cond:
+            self.pending.discard(sha)
+            self._put(sha, {"path": str(path), "variants": variants, "builtAt": int(time.time())})
+            self.cond.notify_all()
+
+    def abandon(self, sha: str):
+        """A speculative build failed or was cancelled."""
+        with self.cond:
+            self.pending.discard(sha)
+            self.cond.notify_all()
+
+    def take(self, sha: str, timeout: float = 0,
+             cancelled: Optional[Callable[[], bool]] = None) -> Optional[dict]:
+        """Take the checkout of sha for a real build, waiting for one in progress.
+
+        Gives up (returns None) after timeout or once cancelled() is true.
+        """
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            if sha in self.pending:
+                logger.info(f"Waiting for prebuild of {sha[:12]}")
+            while sha in self.pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or (cancelled and cancelled()):
+                    return None
+                self.cond.wait(min(remaining, 1.0))
+            entry = self.ready.pop(sha, None)
+            if entry:
+                self.in_use.add(sha)
+                self._save()
+            return entry
+
+    def give_back(self, sha: str, entry: Optional[dict]):
+        """Return a taken checkout; None means it was not kept."""
+        with self.cond:
+            self.in_use.discard(sha)
+            if entry:
+                self._put(sha, entry)
+
+    def _put(self, sha: str, entry: dict):
+        self.ready[sha] = entry
+        self.ready.move_to_end(sha)
+        while len(self.ready) > self.keep:
+            old_sha, old = self.ready.popitem(last=False)
+            logger.info(f"Dropping prebuilt checkout of {old_sha[:12]}")
+            self.mirror.remove_worktree(Path(old["path"]))
+        self._save()
+
+
+class PrebuildWatcher:
+    """Polls branch heads with ls-remote and submits speculative builds.
+
+    New heads are remembered until the service is idle; only then is a build
+    submitted, so prebuilds never delay real ones.
+    """
+
+    def __init__(self, mirror: GitMirror, store: PrebuildStore,
+                 submit: Callable[[str, str], None], idle: Callable[[], bool],
+                 branches: Optional[List[str]] = None, interval: Optional[float] = None):
+        self.mirror = mirror
+        self.store = store
+        self.submit = submit
+        self.idle = idle
+        self.branches = branches or config.PREBUILD_BRANCHES
+        self.interval = interval or config.PREBUILD_POLL_INTERVAL
+        self.heads: Dict[str, str] = {}
+        self.wanted: Dict[str, str] = {}
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="prebuild-watcher", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        logger.info(f"Watching {', '.join(self.branches)} for prebuilds every {self.interval}s")
+
+    def stop(self):
+        self.stopped.set()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                logger.warning(f"Prebuild poll failed: {e}")
+
+    def poll(self):
+        for branch, sha in self.mirror.ls_remote(self.branches).items():
+            if self.heads.get(branch) != sha:
+                logger.info(f"New head on {branch}: {sha[:12]}")
+                self.heads[branch] = sha
+                self.wanted[branch] = sha
+
+        if not self.wanted or not self.idle():
+            return
+        for branch, sha in list(self.wanted.items()):
+            del self.wanted[branch]
+            if self.store.begin(sha):
+                logger.info(f"Submitting prebuild of {branch} at {sha[:12]}")
+                self.submit(branch, sha)
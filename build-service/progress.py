@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Progress Publisher - Coalesced, rate-limited MQTT publishing
+"""
+import json
+import logging
+import threading
+import time
+from typing import Optional
+
+import config
+
+logger = logging.getLogger("ProgressPublisher")
+
+
+class ProgressPublisher:
+    """Publishes MQTT messages at most once per interval per topic and key.
+
+    Updates arriving faster than the interval are coalesced: only the newest
+    pending payload is sent when the interval has passed, so the last update
+    always gets through. The key separates streams sharing a topic (one per
+    build job). Forced messages (state transitions) are sent immediately,
+    after any pending update for the same topic and key.
+    """
+
+    def __init__(self, client, min_interval: Optional[float] = None):
+        self.client = client
+        self.min_interval = min_interval if min_interval is not None else config.MQTT_PROGRESS_INTERVAL
+        self.last_sent = {}
+        self.pending = {}
+        self.counters = {"sent": 0, "suppressed": 0}
+        self.cond = threading.Condition()
+        self.closed = False
+        self.thread = threading.Thread(target=self._flush_loop, name="progress-publisher",
+                                       daemon=True)
+        self.thread.start()
+
+    def publish(self, topic: str, payload: dict, retain: bool = False,
+                key: Optional[str] = None, force: bool = False):
+        """Publish now, or coalesce if this topic/key was published too recently."""
+        slot = (topic, key)
+        with self.cond:
+            if force:
+                self._send_pending(slot)
+                self._send(slot, payload, retain)
+                return
+
+            elapsed = time.monotonic() - self.last_sent.get(slot, 0)
+            if elapsed >= self.min_interval and slot not in self.pending:
+                self._send(slot, payload, retain)
+                return
+
+            if slot in self.pending:
+                self.counters["suppressed"] += 1
+            self.pending[slot] = (payload, retain)
+            self.cond.notify()
+
+    def flush(self, topic: str, key: Optional[str] = None):
+        """Send the pending update for topic/key right away, if any."""
+        with self.cond:
+            self._send_pending((topic, key))
+
+    def stats(self) -> dict:
+        with self.cond:
+            return dict(self.counters, pending=len(self.pending))
+
+    def close(self):
+        with self.cond:
+            for slot in list(self.pending):
+                self._send_pending(slot)
+            self.closed = True
+            self.cond.notify()
+
+    def _send(self, slot, payload: dict, retain: bool):
+        self.client.publish(slot[0], json.dumps(payload, separators=(",", ":")), retain=retain)
+        self.last_sent[slot] = time.monotonic()
+        self.counters["sent"] += 1
+
+    def _send_pending(self, slot):
+        entry = self.pending.pop(slot, None)
+        if entry:
+            self._send(slot, *entry)
+
+    def _flush_loop(self):
+        with self.cond:
+            while not self.closed:
+                now = time.monotonic()
+                next_due = None
+                for slot in list(self.pending):
+                    due = self.last_sent.get(slot, 0) + self.min_interval
+                    if due <= now:
+                        self._send_pending(slot)
+                    elif next_due is None or due < next_due:
+                        next_due = due
+
+                if next_due is None:
+                    # Forget rate state of idle slots so the dict stays small
+                    cutoff = now - self.min_interval
+                    for slot in [s for s, t in self.last_sent.items() if t < cutoff]:
+                        del self.last_sent[slot]
+                    self.cond.wait()
+                else:
+                    self.cond.wait(next_due - now)
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Publisher - Single-pass APK publishing (hash, local copy and upload together)
+"""
+import hashlib
+import logging
+import time
+from pathlib import Path
+from typing import Callable, Optional
+from urllib.parse import quote
+
+import requests
+
+import config
+
+logger = logging.getLogger("Publisher")
+
+CHUNK_SIZE = 1024 * 1024
+APK_CONTENT_TYPE = "application/vnd.android.package-archive"
+
+
+class HashingReader:
+    """File-like view of an APK that hashes and copies it while it is read.
+
+    Pass it as an HTTP request body: every byte read for the upload also
+    feeds SHA-256 and the optional copy_to file. After a rewind (for an upload
+    retry) bytes that were already processed are only re-sent, not re-hashed
+    or re-copied.
+    """
+
+    def __init__(self, path: Path, copy_to: Optional[Path] = None,
+                 chunk_size: int = CHUNK_SIZE):
+        self.path = Path(path)
+        self.size = self.path.stat().st_size
+        self.chunk_size = chunk_size
+        self._file = open(self.path, "rb")
+        self._copy = open(copy_to, "wb") if copy_to else None
+        self._hash = hashlib.sha256()
+        self._processed = 0  # bytes hashed and copied so far
+        self._position = 0
+
+    def __len__(self):
+        return self.size
+
+    def read(self, size: int = -1) -> bytes:
+        # Always read in large blocks, whatever the HTTP client asks for
+        size = self.chunk_size if size is None or size < 0 else max(size, self.chunk_size)
+        data = self._file.read(size)
+        if not data:
+            return data
+
+        end = self._position + len(data)
+        if end > self._processed:
+            new = memoryview(data)[self._processed - self._position:]
+            self._hash.update(new)
+            if self._copy:
+                self._copy.write(new)
+            self._processed = end
+        self._position = end
+        return data
+
+    def rewind(self):
+        """Restart reading from the beginning (for an upload retry)."""
+        self._file.seek(0)
+        self._position = 0
+
+    def drain(self):
+        """Process the rest of the file without uploading it."""
+        self._file.seek(self._processed)
+        self._position = self._processed
+        while self.read():
+            pass
+
+    @property
+    def complete(self) -> bool:
+        return self._processed == self.size
+
+    @property
+    def sha256(self) -> str:
+        if not self.complete:
+            raise RuntimeError("SHA-256 requested before the file was fully read")
+        return self._hash.hexdigest()
+
+    def close(self):
+        self._file.close()
+        if self._copy:
+            self._copy.close()
+
+
+class UploadError(Exception):
+    """Upload failed with a non-retryable response."""
+
+
+class StreamingPublisher:
+    """Uploads release assets through the GitHub uploads API with retries.
+
+    GitHub offers no ranged uploads, so a retry re-sends the body; the hash
+    and local copy in HashingReader continue where they stopped. The API and
+    uploads base URLs are configurable so a local stand-in can be used.
+    """
+
+    def __init__(self, token: Optional[str] = None, api_url: Optional[str] = None,
+                 uploads_url: Optional[str] = None, repo: Optional[str] = None,
+                 retries: Optional[int] = None, session: Optional[requests.Session] = None):
+        self.api_url = (api_url or config.GITHUB_API_URL).rstrip("/")
+        self.uploads_url = (uploads_url or config.GITHUB_UPLOADS_URL).rstrip("/")
+        self.repo = repo or config.GITHUB_REPO
+        self.retries = retries if retries is not None else config.UPLOAD_RETRIES
+        self.session = session or requests.Session()
+        self.session.headers.update({
+            "Authorization": f"token {token or config.GITHUB_TOKEN}",
+            "Accept": "application/vnd.github+json"
+        })
+
+    def _delete_existing(self, release_id: int, name: str):
+        """Remove an asset left behind by an earlier, interrupted attempt."""
+        response = self.session.get(
+            f"{self.api_url}/repos/{self.repo}/releases/{release_id}/assets",
+            params={"per_page": 100},
+            timeout=30
+        )
+        response.raise_for_status()
+        for asset in response.json():
+            if asset.get("name") == name:
+                logger.info(f"Deleting existing asset {name} ({asset['id']})")
+                self.session.delete(
+                    f"{self.api_url}/repos/{self.repo}/releases/assets/{asset['id']}",
+                    timeout=30
+                ).raise_for_status()
+
+    def upload(self, reader: HashingReader, release_id: int, name: str,
+               content_type: str = APK_CONTENT_TYPE) -> dict:
+        """Upload reader as asset name of a release. Returns the asset JSON."""
+        url = (f"{self.uploads_url}/repos/{self.repo}/releases/{release_id}"
+               f"/assets?name={quote(name)}")
+
+        for attempt in range(1, self.retries + 1):
+            reader.rewind()
+            started = time.monotonic()
+            try:
+                response = self.session.post(
+                    url,
+                    data=reader,
+                    headers={"Content-Type": content_type, "Content-Length": str(len(reader))},
+                    timeout=(30, 300)
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = str(e)
+            else:
+                if response.status_code in (200, 201):
+                    elapsed = time.monotonic() - started
+                    logger.info(f"Uploaded {name} ({len(reader) // 1024} KiB) in {elapsed:.1f}s")
+                    return response.json()
+                if response.status_code < 500 and response.status_code != 422:
+                    raise UploadError(f"Upload of {name} failed: "
+                                      f"{response.status_code} {response.text[:200]}")
+                error = f"{response.status_code} {response.text[:200]}"
+
+            if attempt == self.retries:
+                raise UploadError(f"Upload of {name} failed after {attempt} attempts: {error}")
+
+            delay = min(2 ** attempt, 30)
+            logger.warning(f"Upload attempt {attempt} of {name} failed ({error}), "
+                           f"retrying in {delay}s")
+            time.sleep(delay)
+            try:
+                self._delete_existing(release_id, name)
+            except requests.RequestException as e:
+                logger.warning(f"Could not check for partial asset: {e}")
+
+
+def publish_file(publisher: StreamingPublisher, apk_path: Path, release_id: int,
+                 name: str, copy_to: Optional[Path] = None,
+                 on_hashed: Optional[Callable[[str, int], None]] = None,
+                 content_type: str = APK_CONTENT_TYPE) -> dict:
+    """Upload apk_path while hashing it and copying it to copy_to.
+
+    Returns the uploaded asset's download URL and id with the file's
+    SHA-256 and size. The hash and copy are completed even if the upload fails, and
+    on_hashed(sha256, size) is called either way, so the artifact is never
+    lost to a flaky uplink.
+    """
+    reader = HashingReader(apk_path, copy_to=copy_to)
+    try:
+        asset = publisher.upload(reader, release_id, name, content_type)
+    finally:
+        reader.drain()
+        reader.close()
+        if on_hashed and reader.complete:
+            on_hashed(reader.sha256, reader.size)
+
+    return {
+        "url": asset["browser_download_url"],
+        "assetId": asset["id"],
+        "sha256": reader.sha256,
+        "size": reader.size
+    }
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Resource Scheduler - CPU/memory admission and limits for build containers
+"""
+import logging
+import os
+import threading
+import time
+from typing import Callable, List, Optional
+
+import docker
+
+import config
+
+logger = logging.getLogger("ResourceScheduler")
+
+MB = 1024 * 1024
+# Share of a build's memory limit given to the Gradle daemon heap; the rest is
+# for the Kotlin daemon, aapt2, metaspace and the OS
+GRADLE_HEAP_SHARE = 0.5
+# Smallest heap Gradle is started with, whatever the allocation
+MIN_GRADLE_HEAP_MB = 512
+
+
+def format_cpuset(cores: List[int]) -> str:
+    """[0, 1, 2, 5] -> "0-2,5" (docker --cpuset-cpus syntax)."""
+    ranges = []
+    for core in sorted(cores):
+        if ranges and core == ranges[-1][1] + 1:
+            ranges[-1][1] = core
+        else:
+            ranges.append([core, core])
+    return ",".join(str(a) if a == b else f"{a}-{b}" for a, b in ranges)
+
+
+class Allocation:
+    """Cores and memory reserved for one build container."""
+
+    def __init__(self, cores: List[int], memory_mb: int):
+        self.cores = cores
+        self.memory_mb = memory_mb
+
+    @property
+    def cpus(self) -> int:
+        return len(self.cores)
+
+    @property
+    def cpuset(self) -> str:
+        return format_cpuset(self.cores)
+
+    @property
+    def heap_mb(self) -> int:
+        return max(MIN_GRADLE_HEAP_MB, int(self.memory_mb * GRADLE_HEAP_SHARE))
+
+    def container_limits(self) -> dict:
+        """Keyword arguments for containers.run() / container.update()."""
+        return {
+            "cpuset_cpus": self.cpuset,
+            "cpu_shares": 1024 * self.cpus,
+            "mem_limit": self.memory_mb * MB,
+            "memswap_limit": self.memory_mb * MB  # no swap on top of the limit
+        }
+
+    def gradle_args(self) -> str:
+        """Gradle flags matching the allocation (not part of the artifact cache key)."""
+        return f" --max-workers={self.cpus} -Dorg.gradle.jvmargs=-Xmx{self.heap_mb}m"
+
+    def to_dict(self) -> dict:
+        return {"cpus": self.cpus, "cpuset": self.cpuset, "memoryMb": self.memory_mb,
+                "gradleHeapMb": self.heap_mb}
+
+
+class ResourceScheduler:
+    """Hands out cores and memory of the Docker host to build containers.
+
+    Capacity is the host's cores and memory (as reported by the Docker daemon
+    that runs the builds) minus a reserve for everything else on the host.
+    acquire() blocks until the requested cores and memory are free, so builds
+    are only admitted when they fit.
+    """
+
+    def __init__(self, docker_client=None):
+        total_cores, total_mb = self._host_capacity(docker_client)
+        reserved = min(config.RESOURCE_RESERVED_CORES, total_cores - 1)
+        # The reserved cores are the first ones, which the host tends to use
+        self.cores = list(range(reserved, total_cores))
+        self.memory_mb = max(total_mb - config.RESOURCE_RESERVED_MEMORY_MB, MIN_GRADLE_HEAP_MB * 2)
+        self.free_cores = set(self.cores)
+        self.free_memory_mb = self.memory_mb
+        self.cond = threading.Condition()
+
+        workers = max(config.BUILD_WORKERS, 1)
+        self.build_cpus = min(config.BUILD_CPUS or max(len(self.cores) // workers, 1), len(self.cores))
+        self.build_memory_mb = min(config.BUILD_MEMORY_MB or self.memory_mb // workers, self.memory_mb)
+        logger.info(f"Build capacity {len(self.cores)} core(s), {self.memory_mb} MB; "
+                    f"{self.build_cpus} core(s) and {self.build_memory_mb} MB per build")
+
+    @staticmethod
+    def _host_capacity(docker_client):
+        try:
+            info = docker_client.info() if docker_client else {}
+        except docker.errors.APIError as e:
+            logger.warning(f"Could not read Docker host capacity: {e}")
+            info = {}
+        cores = info.get("NCPU") or os.cpu_count() or 1
+        memory = info.get("MemTotal") or os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+        return cores, memory // MB
+
+    def acquire(self, cpus: Optional[int] = None, memory_mb: Optional[int] = None,
+                timeout: Optional[float] = None,
+                cancelled: Optional[Callable[[], bool]] = None) -> Allocation:
+        """Reserve cores and memory, waiting until they are free.
+
+        Defaults to one build's share. Raises RuntimeError on timeout or when
+        cancelled() becomes true while waiting.
+        """
+        cpus = min(cpus or self.build_cpus, len(self.cores))
+        memory_mb = min(memory_mb or self.build_memory_mb, self.memory_mb)
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self.cond:
+            while len(self.free_cores) < cpus or self.free_memory_mb < memory_mb:
+                if cancelled and cancelled():
+                    raise RuntimeError("Build cancelled")
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise RuntimeError("Timed out waiting for build capacity")
+                # Wake up periodically to notice cancellation
+                self.cond.wait(1.0 if remaining is None else min(remaining, 1.0))
+
+            cores = sorted(self.free_cores)[:cpus]
+            self.free_cores.difference_update(cores)
+            self.free_memory_mb -= memory_mb
+        return Allocation(cores, memory_mb)
+
+    def release(self, allocation: Allocation):
+        with self.cond:
+            self.free_cores.update(allocation.cores)
+            self.free_memory_mb += allocation.memory_mb
+            self.cond.notify_all()
+
+    def stats(self) -> dict:
+        with self.cond:
+            return {
+                "cores": len(self.cores),
+                "freeCores": len(self.free_cores),
+                "memoryMb": self.memory_mb,
+                "freeMemoryMb": self.free_memory_mb
+            }
+
+
+class UsageMonitor:
+    """Samples a container's stats while a build runs.
+
+    Reports the peak memory in use (without page cache) and the CPU time
+    spent. For a fresh container that is all its CPU time; for a pooled
+    container, which outlives the build, the time since monitoring started.
+    """
+
+    def __init__(self, container, fresh: bool = False):
+        self.container = container
+        self.peak_bytes = 0
+        self.cpu_start: Optional[int] = 0 if fresh else None
+        self.cpu_last: Optional[int] = None
+        self.stopped = False
+        self.thread = threading.Thread(target=self._run, name="usage-monitor", daemon=True)
+
+    def start(self) -> "UsageMonitor":
+        self.thread.start()
+        return self
+
+    def _run(self):
+        try:
+            for stats in self.container.stats(stream=True, decode=True):
+                if self.stopped:
+                    break
+                self._sample(stats)
+        except (docker.errors.APIError, ValueError) as e:
+            logger.debug(f"Stats stream ended: {e}")
+
+    def _sample(self, stats: dict):
+        memory = stats.get("memory_stats", {})
+        usage = memory.get("usage")
+        if usage:
+            detail = memory.get("stats", {})
+            # cgroup v2 reports inactive_file, v1 total_inactive_file
+            cache = detail.get("inactive_file", detail.get("total_inactive_file", 0))
+            self.peak_bytes = max(self.peak_bytes, usage - cache)
+
+        total = stats.get("cpu_stats", {}).get("cpu_usage", {}).get("total_usage")
+        if total:
+            if self.cpu_start is None:
+                self.cpu_start = total
+            self.cpu_last = total
+
+    def stop(self) -> dict:
+        """Stop sampling and return {"peakRssMb", "cpuSeconds"}."""
+        self.stopped = True
+        cpu_ns = 0
+        if self.cpu_start is not None and self.cpu_last is not None:
+            cpu_ns = self.cpu_last - self.cpu_start
+        return {
+            "peakRssMb": round(self.peak_bytes / MB, 1),
+            "cpuSeconds": round(cpu_ns / 1e9, 1)
+        }
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Rollout - Staged OTA updates of the device fleet after a successful build
+"""
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+import config
+from progress import ProgressPublisher
+from telemetry import percentile
+
+logger = logging.getLogger("Rollout")
+
+
+class DeviceFleet:
+    """Devices as seen on their retained telemetry and status topics."""
+
+    def __init__(self):
+        self.devices: Dict[str, dict] = {}
+        self.lock = threading.Lock()
+
+    def update(self, device_id: str, **fields):
+        with self.lock:
+            device = self.devices.setdefault(device_id, {"versionCode": None, "online": False})
+            device.update(fields, seen=time.time())
+
+    def version_code(self, device_id: str) -> Optional[int]:
+        with self.lock:
+            return self.devices.get(device_id, {}).get("versionCode")
+
+    def online(self, device_id: str) -> bool:
+        with self.lock:
+            return self.devices.get(device_id, {}).get("online", False)
+
+    def known(self) -> List[str]:
+        with self.lock:
+            return sorted(self.devices)
+
+
+class Rollout:
+    """One staged update of a set of devices to a version."""
+
+    def __init__(self, version: str, version_code: int, url: str, devices: List[str],
+                 apk_size: int = 0, manifest_url: Optional[str] = None):
+        self.id = uuid.uuid4().hex[:12]
+        self.version = version
+        self.version_code = int(version_code)
+        self.url = url
+        self.manifest_url = manifest_url
+        self.apk_size = apk_size
+        self.devices = devices
+        self.state = "running"  # running, paused, done, aborted
+        self.waves: List[dict] = []
+        self.skipped: List[str] = []
+        self.outcomes: Dict[str, dict] = {}  # device -> sent/acked/updated/error
+        self.started_at = time.time()
+
+    def to_dict(self) -> dict:
+        done = [o for o in self.outcomes.values() if o.get("updated")]
+        failed = [o for o in self.outcomes.values() if o.get("error")]
+        return {
+            "rolloutId": self.id,
+            "version": self.version,
+            "versionCode": self.version_code,
+            "state": self.state,
+            "devices": len(self.devices),
+            "updated": len(done),
+            "failed": len(failed),
+            "skipped": len(self.skipped),
+            "pending": len(self.devices) - len(self.skipped) - len(self.outcomes),
+            "waves": self.waves,
+            "startedAt": int(self.started_at),
+            "timestamp": int(time.time())
+        }
+
+
+class RolloutManager:
+    """Sends the update command to devices in waves and follows their progress.
+
+    The first wave is ROLLOUT_CANARY devices; later waves are as large as the
+    concurrency budget: ROLLOUT_CONCURRENCY devices, fewer if
+    ROLLOUT_BANDWIDTH_MBIT cannot deliver that many APKs within
+    ROLLOUT_SPREAD seconds. Within a wave the commands are spread over
+    ROLLOUT_SPREAD seconds with jitter, so downloads do not all start at
+    once. A device counts as updated when its telemetry reports the new
+    versionCode; a failed ack or ROLLOUT_WAVE_TIMEOUT counts as a failure.
+    A wave failing more than ROLLOUT_MAX_FAILURE_RATE pauses the rollout
+    until it is resumed or aborted on the control topic.
+    """
+
+    def __init__(self, client, mqtt_out: ProgressPublisher):
+        self.client = client
+        self.mqtt_out = mqtt_out
+        self.fleet = DeviceFleet()
+        self.current: Optional[Rollout] = None
+        self.cond = threading.Condition()
+
+    def subscribe(self):
+        prefix = config.DEVICE_TOPIC_PREFIX
+        self.client.subscribe(f"{prefix}/+/telemetry")
+        self.client.subscribe(f"{prefix}/+/status")
+        self.client.subscribe(f"{prefix}/+/cmd/update/ack")
+        self.client.subscribe(config.TOPIC_ROLLOUT_CONTROL)
+
+    def handle(self, topic: str, payload: dict) -> bool:
+        """Process a device or rollout control message. False if it is neither."""
+        if topic == config.TOPIC_ROLLOUT_CONTROL:
+            self._control(payload)
+            return True
+
+        parts = topic.split("/")
+        if parts[0] != config.DEVICE_TOPIC_PREFIX or len(parts) < 3:
+            return False
+        device_id, kind = parts[1], "/".join(parts[2:])
+        if kind == "telemetry":
+            self.fleet.update(device_id, versionCode=payload.get("appVersionCode"), online=True)
+        elif kind == "status":
+            self.fleet.update(device_id, online=payload.get("status") == "online")
+        elif kind == "cmd/update/ack":
+            self._acked(device_id, payload)
+        else:
+            return True
+
+        with self.cond:
+            self.cond.notify_all()
+        return True
+
+    def _acked(self, device_id: str, payload: dict):
+        with self.cond:
+            outcome = self.current.outcomes.get(device_id) if self.current else None
+            if outcome is None or outcome.get("acked"):
+                return
+            outcome["acked"] = time.time()
+            if not payload.get("success", False):
+                outcome["error"] = payload.get("message") or "Update rejected"
+
+    def _control(self, payload: dict):
+        action = payload.get("action")
+        if action == "start":
+            try:
+                self.start(payload["version"], payload["versionCode"], payload["url"],
+                           devices=payload.get("devices"), apk_size=payload.get("apkSize", 0),
+                           manifest_url=payload.get("manifestUrl"))
+            except (KeyError, TypeError, ValueError) as e:
+                logger.error(f"Invalid rollout start: {e}")
+            return
+
+        with self.cond:
+            rollout = self.current
+            if rollout is None or payload.get("rolloutId") not in (None, rollout.id):
+                logger.info(f"No matching rollout to {action}")
+                return
+            if action == "pause" and rollout.state == "running":
+                rollout.state = "paused"
+            elif action == "resume" and rollout.state == "paused":
+                rollout.state = "running"
+            elif action == "abort" and rollout.state in ("running", "paused"):
+                rollout.state = "aborted"
+            else:
+                return
+            logger.info(f"Rollout {rollout.id} {rollout.state} on request")
+            self.cond.notify_all()
+        self._publish(rollout)
+
+    def start(self, version: str, version_code: int, url: str,
+              devices: Optional[List[str]] = None, apk_size: int = 0,
+              manifest_url: Optional[str] = None) -> Rollout:
+        """Start rolling out url to devices (default: every known device).
+
+        A rollout still in progress is aborted; the newer version wins.
+        """
+        rollout = Rollout(version, version_code, url, devices or self.fleet.known(),
+                          apk_size=apk_size, manifest_url=manifest_url)
+        with self.cond:
+            if self.current and self.current.state in ("running", "paused"):
+                logger.info(f"Rollout {self.current.id} superseded by v{version}")
+                self.current.state = "aborted"
+            self.current = rollout
+            self.cond.notify_all()
+
+        logger.info(f"Rollout {rollout.id} of v{version} to {len(rollout.devices)} device(s)")
+        threading.Thread(target=self._run, args=(rollout,), name=f"rollout-{rollout.id}",
+                         daemon=True).start()
+        return rollout
+
+    def wave_size(self, apk_size: int) -> int:
+        """Devices per wave within the concurrency and bandwidth budget."""
+        size = config.ROLLOUT_CONCURRENCY
+        if config.ROLLOUT_BANDWIDTH_MBIT > 0 and apk_size > 0:
+            deliverable = config.ROLLOUT_BANDWIDTH_MBIT * 1e6 / 8 * config.ROLLOUT_SPREAD
+            size = min(size, int(deliverable // apk_size))
+        return max(size, 1)
+
+    def _run(self, rollout: Rollout):
+        todo = []
+        for device_id in rollout.devices:
+            current = self.fleet.version_code(device_id)
+            if (current is not None and current >= rollout.version_code) or not self.fleet.online(device_id):
+                rollout.skipped.append(device_id)
+            else:
+                todo.append(device_id)
+        self._publish(rollout)
+
+        first = True
+        while todo:
+            if not self._wait_running(rollout):
+                break
+            size = config.ROLLOUT_CANARY if first else self.wave_size(rollout.apk_size)
+            wave, todo = todo[:size], todo[size:]
+            first = False
+            stats = self._run_wave(rollout, wave)
+            if stats is None:
+                break
+            rollout.waves.append(stats)
+            logger.info(f"Rollout {rollout.id} wave {stats['wave']}: "
+                        f"{stats['succeeded']}/{stats['size']} updated")
+            with self.cond:
+                if (stats["failureRate"] > config.ROLLOUT_MAX_FAILURE_RATE and
+                        rollout.state == "running" and todo):
+                    logger.warning(f"Rollout {rollout.id} paused after wave {stats['wave']}")
+                    rollout.state = "paused"
+            self._publish(rollout)
+
+        with self.cond:
+            if rollout.state in ("running", "paused"):
+                rollout.state = "done"
+        self._publish(rollout)
+
+    def _wait_running(self, rollout: Rollout) -> bool:
+        """Block while paused. False once aborted or superseded."""
+        with self.cond:
+            while rollout.state == "paused":
+                self.cond.wait(1.0)
+            return rollout.state == "running"
+
+    def _run_wave(self, rollout: Rollout, wave: List[str]) -> Optional[dict]:
+        """Send update to the wave's devices spread over ROLLOUT_SPREAD and wait for them."""
+        started = time.time()
+        gap = config.ROLLOUT_SPREAD / len(wave)
+        command = {"url": rollout.url, "version": rollout.version, "versionCode": rollout.version_code}
+        if rollout.manifest_url:
+            command["manifestUrl"] = rollout.manifest_url
+
+        for index, device_id in enumerate(wave):
+            delay = started + index * gap + random.uniform(0, gap) - time.time()
+            with self.cond:
+                if delay > 0:
+                    self.cond.wait_for(lambda: rollout.state == "aborted", delay)
+                if rollout.state == "aborted":
+                    return None
+                rollout.outcomes[device_id] = {"sent": time.time()}
+            self.client.publish(f"{config.DEVICE_TOPIC_PREFIX}/{device_id}/cmd/update",
+                                json.dumps(command), qos=1)
+
+        deadline = time.time() + config.ROLLOUT_WAVE_TIMEOUT
+        with self.cond:
+            while True:
+                for device_id in wave:
+                    outcome = rollout.outcomes[device_id]
+                    if not outcome.get("updated") and not outcome.get("error"):
+                        code = self.fleet.version_code(device_id)
+                        if code is not None and code >= rollout.version_code:
+                            outcome["updated"] = time.time()
+                open_devices = [d for d in wave
+                                if not rollout.outcomes[d].get("updated") and
+                                not rollout.outcomes[d].get("error")]
+                if not open_devices or rollout.state == "aborted":
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    for device_id in open_devices:
+                        rollout.outcomes[device_id]["error"] = "Timed out"
+                    break
+                self.cond.wait(min(remaining, 1.0))
+            if rollout.state == "aborted":
+                return None
+
+        outcomes = [rollout.outcomes[d] for d in wave]
+        acks = [o["acked"] - o["sent"] for o in outcomes if o.get("acked")]
+        updates = [o["updated"] - o["sent"] for o in outcomes if o.get("updated")]
+        failed = [o for o in outcomes if o.get("error")]
+        return {
+            "wave": len(rollout.waves) + 1,
+            "size": len(wave),
+            "succeeded": len(updates),
+            "failed": len(failed),
+            "timedOut": sum(1 for o in failed if o["error"] == "Timed out"),
+            "failureRate": round(len(failed) / len(wave), 3),
+            "ackLatency": {"p50": round(percentile(acks, 50), 1),
+                           "max": round(max(acks, default=0), 1)},
+            "updateLatency": {"p50": round(percentile(updates, 50), 1),
+                              "max": round(max(updates, default=0), 1)},
+            "duration": round(time.time() - started, 1)
+        }
+
+    def _publish(self, rollout: Rollout):
+        with self.cond:
+            payload = rollout.to_dict()
+        self.mqtt_out.publish(config.TOPIC_ROLLOUT, payload, retain=True, force=True)
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+Telemetry - Per-phase build timing and SQLite build history
+"""
+import logging
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import config
+
+logger = logging.getLogger("Telemetry")
+
+# "> Task :app:compileDebugKotlin" or "> Task :app:preBuild UP-TO-DATE" (plain console)
+TASK_LINE = re.compile(r"^> Task (:\S+)(?:\s+(UP-TO-DATE|FROM-CACHE|NO-SOURCE|SKIPPED|FAILED))?")
+BUILD_END_LINE = re.compile(r"^BUILD (SUCCESSFUL|FAILED)")
+
+# Gradle task name patterns -> reported phase, first match wins
+TASK_PHASES = [
+    (re.compile(r"compile\w*Kotlin$"), "kotlinCompile"),
+    (re.compile(r"compile\w*JavaWithJavac$"), "javaCompile"),
+    (re.compile(r"(dex|Dex)"), "dex"),
+    (re.compile(r"(Resources|Manifest)"), "resources"),
+    (re.compile(r"(package|assemble|sign|zipalign)", re.IGNORECASE), "packaging"),
+]
+
+
+def task_phase(task: str) -> str:
+    """Map a Gradle task path to the phase it is reported under."""
+    name = task.rsplit(":", 1)[-1]
+    for pattern, phase in TASK_PHASES:
+        if pattern.search(name):
+            return phase
+    return "otherTasks"
+
+
+class BuildTimer:
+    """Monotonic timings for the stages of one build.
+
+    Stages of _run_build are timed with phase(). Gradle output is fed to
+    observe_line() (or, already parsed, to task_started() and build_ended());
+    a task's duration is the time until the next task starts (Gradle's plain
+    console prints no end marker), and everything before the first task
+    counts as Gradle startup and configuration.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.phases: Dict[str, float] = {}
+        self.tasks: List[dict] = []
+        self._gradle_started: Optional[float] = None
+        self._current_task: Optional[dict] = None
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(name, time.monotonic() - start)
+
+    def add(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def gradle_started(self):
+        self._gradle_started = time.monotonic()
+
+    def observe_line(self, line: str):
+        match = TASK_LINE.match(line)
+        if match:
+            self.task_started(match.group(1), match.group(2))
+        elif BUILD_END_LINE.match(line):
+            self.build_ended()
+
+    def task_started(self, task: str, outcome: Optional[str] = None):
+        now = time.monotonic()
+        if self._current_task is None and self._gradle_started is not None:
+            self.add("gradleConfiguration", now - self._gradle_started)
+        self._close_task(now)
+        self._current_task = {
+            "task": task,
+            "outcome": outcome or "EXECUTED",
+            "position": len(self.tasks),
+            "start": now
+        }
+
+    def build_ended(self):
+        self._close_task(time.monotonic())
+
+    def _close_task(self, now: float):
+        task = self._current_task
+        if task is None:
+            return
+        task["seconds"] = now - task.pop("start")
+        self.tasks.append(task)
+        self.add(task_phase(task["task"]), task["seconds"])
+        self._current_task = None
+
+    def merge(self, phases: Dict[str, float], tasks: List[dict]):
+        """Add the phases and tasks timed by a build worker."""
+        for name, seconds in phases.items():
+            self.add(name, seconds)
+        offset = len(self.tasks)
+        self.tasks.extend(dict(task, position=offset + task["position"]) for task in tasks)
+
+    @property
+    def total(self) -> float:
+        return time.monotonic() - self.started
+
+    def breakdown(self) -> dict:
+        """Phase durations rounded for publishing."""
+        return {name: round(seconds, 2) for name, seconds in self.phases.items()}
+
+    def slowest_tasks(self, limit: int = 10) -> List[dict]:
+        tasks = sorted(self.tasks, key=lambda t: t["seconds"], reverse=True)[:limit]
+        return [{"task": t["task"], "seconds": round(t["seconds"], 2), "outcome": t["outcome"]}
+                for t in tasks]
+
+
+class TelemetryStore:
+    """SQLite history of build timings."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS builds (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id TEXT,
+            version TEXT,
+            commit_sha TEXT,
+            status TEXT,
+            cache TEXT,
+            finished_at INTEGER,
+            total REAL
+        );
+        CREATE TABLE IF NOT EXISTS phases (
+            build_id INTEGER REFERENCES builds(id) ON DELETE CASCADE,
+            phase TEXT,
+            seconds REAL
+        );
+        CREATE TABLE IF NOT EXISTS tasks (
+            build_id INTEGER REFERENCES builds(id) ON DELETE CASCADE,
+            task TEXT,
+            position INTEGER,
+            outcome TEXT,
+            seconds REAL
+        );
+        CREATE TABLE IF NOT EXISTS profile_phases (
+            build_id INTEGER REFERENCES builds(id) ON DELETE CASCADE,
+            variants TEXT,
+            phase TEXT,
+            seconds REAL
+        );
+        CREATE TABLE IF NOT EXISTS profile_tasks (
+            build_id INTEGER REFERENCES builds(id) ON DELETE CASCADE,
+            variants TEXT,
+            task TEXT,
+            outcome TEXT,
+            seconds REAL
+        );
+        CREATE INDEX IF NOT EXISTS idx_phases_build ON phases(build_id);
+        CREATE INDEX IF NOT EXISTS idx_tasks_build ON tasks(build_id);
+        CREATE INDEX IF NOT EXISTS idx_profile_phases_variants ON profile_phases(variants, build_id);
+        CREATE INDEX IF NOT EXISTS idx_profile_tasks_build ON profile_tasks(build_id);
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = Path(path) if path else Path(config.BUILD_CACHE_DIR) / "telemetry.db"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.db.execute("PRAGMA foreign_keys = ON")
+        self.db.executescript(self.SCHEMA)
+
+    def record(self, timer: BuildTimer, job_id: str, version: str,
+               commit: Optional[str], status: str, cache: Optional[str],
+               profiles: Optional[List[dict]] = None) -> int:
+        """Store one finished build. Returns its row id.
+
+        profiles are Gradle profiles (see GradleProfile.ingest) of its
+        Gradle runs, each with the "variants" it built.
+        """
+        with self.lock, self.db:
+            cursor = self.db.execute(
+                "INSERT INTO builds (job_id, version, commit_sha, status, cache, finished_at, total) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, version, commit, status, cache, int(time.time()), timer.total)
+            )
+            build_id = cursor.lastrowid
+            self.db.executemany(
+                "INSERT INTO phases (build_id, phase, seconds) VALUES (?, ?, ?)",
+                [(build_id, name, seconds) for name, seconds in timer.phases.items()]
+            )
+            self.db.executemany(
+                "INSERT INTO tasks (build_id, task, position, outcome, seconds) VALUES (?, ?, ?, ?, ?)",
+                [(build_id, t["task"], t["position"], t["outcome"], t["seconds"]) for t in timer.tasks]
+            )
+            for profile in profiles or []:
+                variants = ",".join(profile["variants"])
+                self.db.executemany(
+                    "INSERT INTO profile_phases (build_id, variants, phase, seconds) VALUES (?, ?, ?, ?)",
+                    [(build_id, variants, name, seconds) for name, seconds in profile["phases"].items()]
+                )
+                self.db.executemany(
+                    "INSERT INTO profile_tasks (build_id, variants, task, outcome, seconds) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [(build_id, variants, t["task"], t["outcome"], t["seconds"]) for t in profile["tasks"]]
+                )
+        return build_id
+
+    def phase_percentiles(self, last_n: int = 50, status: str = "success") -> dict:
+        """p50/p95 of every phase (and the total) over the last N builds."""
+        with self.lock:
+            build_ids = [row[0] for row in self.db.execute(
+                "SELECT id FROM builds WHERE status = ? ORDER BY id DESC LIMIT ?",
+                (status, last_n)
+            )]
+            if not build_ids:
+                return {}
+            marks = ",".join("?" * len(build_ids))
+            rows = self.db.execute(
+                f"SELECT phase, seconds FROM phases WHERE build_id IN ({marks})", build_ids
+            ).fetchall()
+            rows += [("total", row[0]) for row in self.db.execute(
+                f"SELECT total FROM builds WHERE id IN ({marks})", build_ids
+            )]
+
+        samples: Dict[str, List[float]] = {}
+        for phase, seconds in rows:
+            samples.setdefault(phase, []).append(seconds)
+
+        return {
+            phase: {
+                "p50": round(percentile(values, 50), 2),
+                "p95": round(percentile(values, 95), 2),
+                "count": len(values)
+            }
+            for phase, values in samples.items()
+        }
+
+    def task_profile(self, last_n: int = 20) -> dict:
+        """Typical Gradle task durations and positions over the last N successful builds.
+
+        Returns {"builds": n, "tasks": {task: {"seconds", "position"}},
+        "taskCount", "gradleConfiguration", "publish"} using medians.
+        """
+        with self.lock:
+            # Full builds only: not cache hits, partial hits or incremental prebuilt runs
+            build_ids = [row[0] for row in self.db.execute(
+                "SELECT id FROM builds WHERE status = 'success' AND cache = 'miss' "
+                "ORDER BY id DESC LIMIT ?",
+                (last_n,)
+            )]
+            if not build_ids:
+                return {"builds": 0, "tasks": {}}
+            marks = ",".join("?" * len(build_ids))
+            task_rows = self.db.execute(
+                f"SELECT build_id, task, position, seconds FROM tasks WHERE build_id IN ({marks})",
+                build_ids
+            ).fetchall()
+            phase_rows = self.db.execute(
+                f"SELECT phase, seconds FROM phases WHERE build_id IN ({marks}) "
+                "AND phase IN ('gradleConfiguration', 'publish')",
+                build_ids
+            ).fetchall()
+
+        per_task: Dict[str, List[tuple]] = {}
+        counts: Dict[int, int] = {}
+        for build_id, task, position, seconds in task_rows:
+            per_task.setdefault(task, []).append((seconds, position))
+            counts[build_id] = counts.get(build_id, 0) + 1
+
+        phases: Dict[str, List[float]] = {}
+        for phase, seconds in phase_rows:
+            phases.setdefault(phase, []).append(seconds)
+
+        return {
+            "builds": len(build_ids),
+            "tasks": {
+                task: {
+                    "seconds": percentile([s for s, _ in samples], 50),
+                    "position": percentile([p for _, p in samples], 50)
+                }
+                for task, samples in per_task.items()
+            },
+            "taskCount": int(percentile(list(counts.values()), 50)) if counts else 0,
+            "gradleConfiguration": percentile(phases.get("gradleConfiguration", []), 50),
+            "publish": percentile(phases.get("publish", []), 50)
+        }
+
+    def profile_baseline(self, variants: List[str], last_n: int = 10) -> dict:
+        """Median profile phases and task durations of the last N successful profiled
+        builds of the same variants.
+
+        Returns {"builds": n, "phases": {phase: seconds}, "tasks": {task: seconds}}.
+        """
+        key = ",".join(variants)
+        with self.lock:
+            build_ids = [row[0] for row in self.db.execute(
+                "SELECT DISTINCT b.id FROM builds b JOIN profile_phases p ON p.build_id = b.id "
+                "WHERE b.status = 'success' AND p.variants = ? ORDER BY b.id DESC LIMIT ?",
+                (key, last_n)
+            )]
+            if not build_ids:
+                return {"builds": 0, "phases": {}, "tasks": {}}
+            marks = ",".join("?" * len(build_ids))
+            phase_rows = self.db.execute(
+                f"SELECT phase, seconds FROM profile_phases WHERE variants = ? AND build_id IN ({marks})",
+                [key, *build_ids]
+            ).fetchall()
+            task_rows = self.db.execute(
+                f"SELECT task, seconds FROM profile_tasks WHERE variants = ? AND build_id IN ({marks})",
+                [key, *build_ids]
+            ).fetchall()
+
+        phases: Dict[str, List[float]] = {}
+        for phase, seconds in phase_rows:
+            phases.setdefault(phase, []).append(seconds)
+        tasks: Dict[str, List[float]] = {}
+        for task, seconds in task_rows:
+            tasks.setdefault(task, []).append(seconds)
+        return {
+            "builds": len(build_ids),
+            "phases": {phase: percentile(values, 50) for phase, values in phases.items()},
+            "tasks": {task: percentile(values, 50) for task, values in tasks.items()}
+        }
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Linear-interpolated percentile of values."""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
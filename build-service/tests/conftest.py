@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The service's modules are top-level modules of build-service/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,44 @@
+"""Eviction leaves artifact cache entries alone while they are being read."""
+import os
+import time
+
+from artifact_cache import ArtifactCache
+
+
+def store(cache, tmp_path, key, size):
+    apk = tmp_path / f"{key}.apk"
+    apk.write_bytes(b"x" * size)
+    cache.store(key, apk, sha256=key)
+
+
+def test_pinned_entry_survives_eviction(tmp_path):
+    cache = ArtifactCache(tmp_path / "cache", max_bytes=1500, max_age=0)
+    store(cache, tmp_path, "old", 1000)
+    entry = cache.lookup("old", pin=True)
+    # Make it the least recently used entry
+    past = time.time() - 60
+    os.utime(tmp_path / "cache" / "old" / "meta.json", (past, past))
+
+    store(cache, tmp_path, "new", 1000)  # over max_bytes: evicts the oldest unpinned entry
+    assert entry["path"].exists()
+    assert cache.lookup("new") is not None
+
+    cache.unpin("old")
+    cache.evict()
+    assert cache.lookup("old") is None
+
+
+def test_pins_are_counted(tmp_path):
+    cache = ArtifactCache(tmp_path / "cache", max_bytes=0, max_age=1)
+    store(cache, tmp_path, "apk", 10)
+    cache.lookup("apk", pin=True)
+    cache.lookup("apk", pin=True)
+    past = time.time() - 60
+    os.utime(tmp_path / "cache" / "apk" / "meta.json", (past, past))
+
+    cache.unpin("apk")
+    cache.evict()
+    assert (tmp_path / "cache" / "apk").exists()  # one reader left
+    cache.unpin("apk")
+    cache.evict()
+    assert not (tmp_path / "cache" / "apk").exists()
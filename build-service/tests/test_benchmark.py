@@ -0,0 +1,30 @@
+"""
+Benchmark scenarios run end to end against the offline stand-ins
+"""
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+SERVICE_DIR = Path(__file__).resolve().parent.parent
+
+
+def run_benchmark(*args: str, timeout: float) -> dict:
+    # Each run configures the service through config at import, so one process per run
+    result = subprocess.run(
+        [sys.executable, "benchmark.py", *args],
+        cwd=SERVICE_DIR, capture_output=True, text=True, timeout=timeout
+    )
+    assert result.returncode == 0, result.stderr[-4000:]
+    return json.loads(result.stdout)
+
+
+def test_deltas_at_default_apk_size():
+    report = run_benchmark("--scenarios", "sequential", "--builds", "3", "--deltas",
+                           "--timeout", "120", timeout=300)
+    assert report["settings"]["apkMb"] == 8.0
+    sequential = report["scenarios"]["sequential"]
+    assert sequential["builds"] == 3
+    assert sequential["failed"] == 0
+    # The first build has nothing to patch from, the others do
+    assert sequential["deltasPerBuild"] > 0
@@ -0,0 +1,83 @@
+"""Warm pool builds: every acquired container ends in one release or discard."""
+from pathlib import Path
+
+import pytest
+
+from builder import AndroidBuilder
+from estimator import ProgressEstimator
+from gradle_cache import GradleCache
+from git_mirror import GitMirror
+from log_sink import LogSink
+
+
+class StubContainer:
+    short_id = "stub"
+
+    def update(self, **limits):
+        pass
+
+    def stats(self, stream=True, decode=True):
+        return iter(())
+
+
+class StubPooled:
+    id = "stub"
+    container = StubContainer()
+
+
+class RecordingPool:
+    """Just enough of ContainerPool, cancelling the build at a chosen point."""
+
+    def __init__(self, builder_ref, cancel_at):
+        self.builder_ref = builder_ref
+        self.cancel_at = cancel_at
+        self.outcomes = []
+
+    def _maybe_cancel(self, point):
+        if point == self.cancel_at:
+            self.builder_ref[0].cancel()
+
+    def acquire(self, timeout=None):
+        pooled = StubPooled()
+        self._maybe_cancel("acquire")
+        return pooled
+
+    def exec_stream(self, pooled, command, workdir):
+        def output():
+            yield b"> Task :app:compileDebugKotlin\n"
+            self._maybe_cancel("output")
+
+        def exit_code():
+            self._maybe_cancel("exit")
+            return 0
+
+        return output(), exit_code
+
+    def release(self, pooled):
+        self.outcomes.append("release")
+        self._maybe_cancel("release")
+
+    def discard(self, pooled):
+        self.outcomes.append("discard")
+
+
+@pytest.mark.parametrize("cancel_at", ["acquire", "output", "exit", "release", None])
+def test_pooled_container_is_released_or_discarded_once(tmp_path, cancel_at):
+    builder_ref = []
+    pool = RecordingPool(builder_ref, cancel_at)
+    builder = AndroidBuilder(gradle_cache=GradleCache(tmp_path / "gradle"),
+                             mirror=GitMirror(tmp_path / "mirror.git"),
+                             pool=pool, docker_client=object())
+    builder_ref.append(builder)
+    builder.log_sink = LogSink()
+    builder.estimator = ProgressEstimator()
+
+    try:
+        builder._run_warm(Path(tmp_path / "repo"), "gradle assemble", None)
+    except RuntimeError:
+        pass
+
+    assert len(pool.outcomes) == 1
+    if cancel_at in ("acquire", "output", "exit"):
+        assert pool.outcomes == ["discard"]
+    assert builder.pooled is None
@@ -0,0 +1,52 @@
+"""
+BUILD_TIMEOUT counts the time a job works, not the time it waits for a build slot
+"""
+import time
+
+from build_queue import BuildJob
+from watchdog import BuildWatchdog
+
+from test_benchmark import run_benchmark
+
+
+def make_job() -> BuildJob:
+    job = BuildJob(branch="main", version="1.0.0", version_code=1, commit=None,
+                   requested_by="test", priority=0, variants=["debug"])
+    job.stage = "prepare"
+    return job
+
+
+def test_paused_time_is_not_active(monkeypatch):
+    monkeypatch.setattr("config.BUILD_TIMEOUT", 10)
+    now = time.time()
+
+    waited = make_job()
+    waited.started_at = now - 30
+    waited.pause()
+    waited.paused_at = now - 25  # waiting for a slot for the last 25 s
+    assert 4 < waited.active_time(now) < 6
+    assert BuildWatchdog._overdue(waited, now) is None
+
+    worked = make_job()
+    worked.started_at = now - 30
+    assert BuildWatchdog._overdue(worked, now) is not None
+
+
+def test_job_waiting_longer_than_timeout_for_its_slot_succeeds(monkeypatch):
+    # One build slot, 3 s builds, 5 s timeout: the later jobs wait 6 s or more
+    # for the slot but each works for about 3 s
+    monkeypatch.setenv("BUILD_TIMEOUT", "5")
+    report = run_benchmark("--scenarios", "storm", "--storm", "4", "--duplicates", "0",
+                           "--build-seconds", "3", "--workers", "1", "--timeout", "120",
+                           timeout=300)
+    storm = report["scenarios"]["storm"]
+    assert storm["builds"] == 4
+    assert storm["failed"] == 0
+    assert storm["wallSeconds"] > 5 + 3
+
+
+def test_slow_build_still_times_out(monkeypatch):
+    monkeypatch.setenv("BUILD_TIMEOUT", "5")
+    report = run_benchmark("--scenarios", "sequential", "--builds", "1",
+                           "--build-seconds", "8", "--timeout", "60", timeout=300)
+    assert report["scenarios"]["sequential"]["failed"] == 1
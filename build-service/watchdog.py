@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Build Watchdog - Enforces build deadlines and stops cancelled builds
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+import config
+from build_queue import BuildJob
+
+logger = logging.getLogger("BuildWatchdog")
+
+
+class BuildWatchdog:
+    """Times out hung builds and stops the containers of cancelled ones.
+
+    Once a second every running job is checked against two deadlines: from
+    leaving the queue until its build has finished it may be active for
+    BUILD_TIMEOUT seconds (waits for the next stage or a build slot do not
+    count, see BuildJob.active_time), and its build containers (or, for a leased build, the worker's
+    progress) may be silent for BUILD_SILENCE_TIMEOUT seconds. A job over
+    either is marked timed out and cancelled like a user cancel.
+
+    Cancelling stops the job's containers (CANCEL_GRACE_SECONDS, then
+    killed) on the watchdog's own threads, so the MQTT thread that received
+    a cancel is never held up by Docker. Stopping the container ends its
+    log stream, which is what frees the build slot.
+    """
+
+    def __init__(self, running_jobs: Callable[[], List[BuildJob]],
+                 on_timeout: Callable[[BuildJob, str], None], interval: float = 1.0):
+        self.running_jobs = running_jobs
+        self.on_timeout = on_timeout
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.killers = ThreadPoolExecutor(max_workers=4, thread_name_prefix="watchdog-stop")
+        self.thread = threading.Thread(target=self._run, name="build-watchdog", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.killers.shutdown(wait=False)
+
+    def cancel(self, job: BuildJob, reason: str = None):
+        """Cancel a running job; reason marks it as timed out."""
+        if job.cancel_requested_at is None:
+            job.cancel_requested_at = time.monotonic()
+        if reason and not job.timed_out:
+            job.timed_out = reason
+        job.cancelled = True
+        for builder in list(job.builders):
+            self.killers.submit(self._stop_builder, job, builder)
+
+    @staticmethod
+    def _stop_builder(job: BuildJob, builder):
+        try:
+            builder.cancel(grace=config.CANCEL_GRACE_SECONDS)
+        except Exception as e:
+            logger.warning(f"Failed to stop a build container of job {job.id}: {e}")
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            now = time.time()
+            for job in self.running_jobs():
+                if job.cancelled or job.stage not in ("prepare", "build") or job.started_at is None:
+                    continue
+                reason = self._overdue(job, now)
+                if reason:
+                    logger.warning(f"Job {job.id}: {reason}, stopping it")
+                    self.cancel(job, reason)
+                    self.on_timeout(job, reason)
+
+    @staticmethod
+    def _overdue(job: BuildJob, now: float):
+        """Why job has run out of time, or None."""
+        if job.active_time(now) > config.BUILD_TIMEOUT:
+            return f"Build exceeded BUILD_TIMEOUT ({config.BUILD_TIMEOUT}s)"
+        if config.BUILD_SILENCE_TIMEOUT > 0 and job.stage == "build":
+            outputs = [b.last_output for b in job.builders if b.last_output is not None]
+            if job.last_output is not None:
+                outputs.append(job.last_output)
+            if outputs:
+                silent = time.monotonic() - max(outputs)
+                if silent > config.BUILD_SILENCE_TIMEOUT:
+                    return f"No build output for {int(silent)}s (BUILD_SILENCE_TIMEOUT)"
+        return None
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Build Worker
+
+Stateless build process for BUILD_MODE=coordinator: registers with the
+coordinator over MQTT, builds the jobs it leases out and hands the APKs back
+through the shared store.
+"""
+import json
+import logging
+import shutil
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import docker
+import paho.mqtt.client as mqtt
+
+import config
+from build_cache_server import BuildCacheServer
+from builder import AndroidBuilder, remove_stale_containers
+from container_pool import ContainerPool
+from estimator import ProgressEstimator
+from git_mirror import GitMirror
+from gradle_cache import GradleCache
+from log_sink import LogSink
+from progress import ProgressPublisher
+from resources import ResourceScheduler
+from telemetry import BuildTimer
+from worker_registry import worker_topic
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("BuildWorker")
+
+
+class BuildWorker:
+    """Builds leased jobs, BUILD_WORKERS at a time."""
+
+    def __init__(self):
+        self.id = config.WORKER_ID
+        self.owner = f"iocast-build-worker-{self.id}"  # MQTT client id, labels its build containers
+        self.client = mqtt.Client(client_id=self.owner)
+        self.mqtt_out = ProgressPublisher(self.client)
+        self.store = Path(config.SHARED_STORE_DIR)
+        self.slots = config.BUILD_WORKERS
+        self.executor = ThreadPoolExecutor(max_workers=self.slots, thread_name_prefix="lease")
+        # Stopping a container blocks for the grace period; never on the MQTT thread,
+        # or heartbeats stall and the coordinator reassigns this worker's leases
+        self.cancels = ThreadPoolExecutor(max_workers=2, thread_name_prefix="lease-cancel")
+        self.leases = {}  # lease id -> builder
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.docker_client = None
+        self.mirror = None
+        self.gradle_cache = None
+        self.resources = None
+        self.pool = None
+        self.cache_server = None
+        self.image_id = None
+
+    def connect(self):
+        self.client.username_pw_set(config.MQTT_USER, config.MQTT_PASSWORD)
+        # The coordinator reassigns this worker's leases the moment it drops off
+        self.client.will_set(worker_topic(self.id, "heartbeat"),
+                             json.dumps({"workerId": self.id, "state": "offline"}), qos=1)
+        self.client.on_connect = self._on_connect
+        self.client.on_message = self._on_message
+
+        logger.info(f"Connecting to MQTT broker at {config.MQTT_HOST}:{config.MQTT_PORT}")
+        self.client.connect(config.MQTT_HOST, config.MQTT_PORT, keepalive=60)
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            logger.info(f"Worker {self.id} connected to MQTT broker")
+            client.subscribe(worker_topic(self.id, "lease"), qos=1)
+            client.subscribe(worker_topic(self.id, "cancel"), qos=1)
+            self._heartbeat()
+        else:
+            logger.error(f"Failed to connect to MQTT broker: {rc}")
+
+    def _on_message(self, client, userdata, msg):
+        try:
+            payload = json.loads(msg.payload.decode('utf-8'))
+        except json.JSONDecodeError:
+            logger.error(f"Invalid JSON payload on {msg.topic}")
+            return
+
+        if msg.topic == worker_topic(self.id, "lease"):
+            self._handle_lease(payload)
+        elif msg.topic == worker_topic(self.id, "cancel"):
+            with self.lock:
+                builder = self.leases.get(payload.get("leaseId"))
+            if builder:
+                logger.info(f"Cancelling lease {payload['leaseId']}")
+                self.cancels.submit(self._cancel, payload["leaseId"], builder)
+
+    @staticmethod
+    def _cancel(lease_id: str, builder: AndroidBuilder):
+        try:
+            builder.cancel()
+        except Exception as e:
+            logger.warning(f"Failed to stop the build container of lease {lease_id}: {e}")
+
+    def _handle_lease(self, lease: dict):
+        lease_id = lease["leaseId"]
+        if lease.get("imageId") != self.image_id:
+            self._done(lease, "rejected", error="Different build image")
+            return
+        with self.lock:
+            if len(self.leases) >= self.slots:
+                full = True
+            else:
+                full = False
+                self.leases[lease_id] = AndroidBuilder(
+                    docker_client=self.docker_client,
+                    gradle_cache=self.gradle_cache,
+                    mirror=self.mirror,
+                    pool=self.pool,
+                    owner=self.owner
+                )
+        if full:
+            self._done(lease, "rejected", error="No free slot")
+            return
+        logger.info(f"Accepted lease {lease_id} for job {lease['jobId']}")
+        self.executor.submit(self._build, lease)
+        self._heartbeat()
+
+    def _build(self, lease: dict):
+        """Check out, set the version, run Gradle and copy the APKs to the store."""
+        lease_id = lease["leaseId"]
+        builder = self.leases[lease_id]
+        out_dir = self.store / lease_id
+        out_dir.mkdir(parents=True, exist_ok=True)
+        log_sink = LogSink(out_dir / "build.log.gz")
+        timer = BuildTimer()
+        allocation = None
+
+        def progress_callback(progress: int, step: str, eta: int = None):
+            payload = {"leaseId": lease_id, "jobId": lease["jobId"],
+                       "progress": progress, "step": step, "eta": eta}
+            self.mqtt_out.publish(worker_topic(self.id, "progress"), payload, key=lease_id)
+
+        try:
+            progress_callback(0, "Cloning repository")
+            with timer.phase("clone"):
+                clone_dir = builder.clone_repo(lease["branch"], lease["commit"])
+            with timer.phase("version"):
+                builder.update_version(clone_dir, lease["version"], lease["versionCode"])
+
+            allocation = self.resources.acquire(timeout=config.BUILD_TIMEOUT,
+                                                cancelled=lambda: builder.cancelled)
+            apks = builder.build_apk(
+                clone_dir,
+                progress_callback=progress_callback,
+                timer=timer,
+                estimator=ProgressEstimator(lease.get("profile")),
+                log_sink=log_sink,
+                variants=lease["variants"],
+                allocation=allocation,
+                profile=lease.get("gradleProfile", False)
+            )
+
+            artifacts = {}
+            for variant, apk in apks.items():
+                target = out_dir / f"{variant}.apk"
+                shutil.copyfile(apk, target)
+                artifacts[variant] = {"path": f"{lease_id}/{target.name}", "size": target.stat().st_size}
+            status, error = "success", None
+        except Exception as e:
+            logger.exception(f"Lease {lease_id} failed: {e}")
+            artifacts = {}
+            status = "cancelled" if builder.cancelled else "failed"
+            error = str(e)
+        finally:
+            log_sink.close()
+            if allocation:
+                self.resources.release(allocation)
+            builder.cleanup()
+            with self.lock:
+                self.leases.pop(lease_id, None)
+
+        if self.stopped.is_set():
+            # Shutting down: the offline heartbeat makes the coordinator reassign
+            return
+        self._done(lease, status, error=error, artifacts=artifacts, details={
+            "phases": timer.phases,
+            "tasks": timer.tasks,
+            "usage": builder.usage,
+            "gradleProfile": builder.profile,
+            "allocation": allocation.to_dict() if allocation else None,
+            "log": f"{lease_id}/build.log.gz",
+            "logSize": log_sink.size
+        })
+        self._heartbeat()
+
+    def _done(self, lease: dict, status: str, error: str = None, artifacts: dict = None,
+              details: dict = None):
+        payload = {
+            "leaseId": lease["leaseId"],
+            "jobId": lease.get("jobId"),
+            "workerId": self.id,
+            "status": status,
+            "artifacts": artifacts or {},
+            "error": error,
+            "timestamp": int(time.time())
+        }
+        payload.update(details or {})
+        self.mqtt_out.flush(worker_topic(self.id, "progress"), lease["leaseId"])
+        self.client.publish(worker_topic(self.id, "done"), json.dumps(payload), qos=1)
+
+    def _heartbeat(self):
+        with self.lock:
+            leases = list(self.leases)
+        capacity = self.resources.stats() if self.resources else {}
+        payload = {
+            "workerId": self.id,
+            "host": socket.gethostname(),
+            "slots": self.slots,
+            "leases": leases,
+            "cpus": capacity.get("cores"),
+            "memoryMb": capacity.get("memoryMb"),
+            "imageId": self.image_id,
+            "timestamp": int(time.time())
+        }
+        self.client.publish(worker_topic(self.id, "heartbeat"), json.dumps(payload))
+
+    def run(self):
+        self.mirror = GitMirror()
+        self.mirror.prune()
+        self.docker_client = docker.from_env()
+        remove_stale_containers(self.docker_client, self.owner)
+        self.image_id = self.docker_client.images.get(config.DOCKER_IMAGE).id
+        self.resources = ResourceScheduler(self.docker_client)
+        self.gradle_cache = GradleCache()
+        if config.GRADLE_REMOTE_CACHE_PORT > 0:
+            self.cache_server = BuildCacheServer()
+            self.cache_server.start()
+            self.cache_server.install_init_script(self.gradle_cache)
+        else:
+            BuildCacheServer.remove_init_script(self.gradle_cache)
+        if config.BUILDER_POOL_SIZE > 0:
+            self.pool = ContainerPool(self.docker_client, self.gradle_cache)
+            self.pool.start()
+
+        self.connect()
+        signal.signal(signal.SIGINT, self._signal_handler)
+        signal.signal(signal.SIGTERM, self._signal_handler)
+        self.client.loop_start()
+        logger.info(f"Build worker {self.id} started with {self.slots} slot(s)")
+
+        while not self.stopped.wait(config.WORKER_HEARTBEAT_INTERVAL):
+            self._heartbeat()
+
+    def _signal_handler(self, signum, frame):
+        logger.info("Shutting down...")
+        self.stopped.set()
+        with self.lock:
+            builders = list(self.leases.values())
+        for builder in builders:
+            builder.cancel()
+        self.executor.shutdown(wait=True)
+        self.cancels.shutdown(wait=True)
+        if self.pool:
+            self.pool.shutdown()
+        if self.cache_server:
+            self.cache_server.stop()
+        # A clean disconnect does not fire the last will
+        offline = self.client.publish(worker_topic(self.id, "heartbeat"),
+                                      json.dumps({"workerId": self.id, "state": "offline"}), qos=1)
+        if offline.rc == mqtt.MQTT_ERR_SUCCESS:
+            offline.wait_for_publish()
+        self.mqtt_out.close()
+        self.client.loop_stop()
+        self.client.disconnect()
+        sys.exit(0)
+
+
+if __name__ == "__main__":
+    if not config.MQTT_PASSWORD:
+        logger.error("Configuration error: MQTT_PASSWORD environment variable is not set")
+        sys.exit(1)
+    logger.info(f"Using Docker image: {config.DOCKER_IMAGE}")
+    BuildWorker().run()
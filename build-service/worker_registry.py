@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Worker Registry - Build workers known to the coordinator and the leases they hold
+"""
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import config
+
+logger = logging.getLogger("WorkerRegistry")
+
+
+def worker_topic(worker_id: str, kind: str) -> str:
+    """workers/<id>/<kind>: heartbeat, lease, progress, done or cancel."""
+    return f"{config.TOPIC_WORKERS}/{worker_id}/{kind}"
+
+
+class RemoteWorker:
+    """A worker process as seen through its heartbeats."""
+
+    def __init__(self, worker_id: str):
+        self.id = worker_id
+        self.info: dict = {}
+        self.slots = 0
+        self.image_id: Optional[str] = None
+        self.last_seen = 0.0
+        self.leases = set()
+
+    @property
+    def free(self) -> int:
+        return self.slots - len(self.leases)
+
+    def to_dict(self) -> dict:
+        return {
+            "workerId": self.id,
+            "host": self.info.get("host"),
+            "slots": self.slots,
+            "busy": len(self.leases),
+            "cpus": self.info.get("cpus"),
+            "memoryMb": self.info.get("memoryMb"),
+            "lastSeen": round(time.monotonic() - self.last_seen, 1)
+        }
+
+
+class Lease:
+    """One build handed to a worker. It lapses unless renewed within the TTL."""
+
+    def __init__(self, worker: RemoteWorker, request: dict,
+                 progress: Optional[Callable[..., None]], ttl: float):
+        self.id = uuid.uuid4().hex[:12]
+        self.worker = worker
+        self.request = request
+        self.progress = progress
+        self.expires = time.monotonic() + ttl
+        self.result: Optional[dict] = None
+        self.done = threading.Event()
+        self.cancel_sent = False
+
+
+class WorkerRegistry:
+    """Coordinator side of the worker protocol.
+
+    Workers announce themselves (slots, cores, memory, build image) with
+    heartbeats every WORKER_HEARTBEAT_INTERVAL seconds; a heartbeat renews
+    every lease it lists. run() hands a build to the worker with the most free
+    slots and waits for its done message. A lease that is not renewed within
+    WORKER_LEASE_TTL, or whose worker goes offline (MQTT last will), is
+    reassigned to another worker. APKs and logs come back through
+    SHARED_STORE_DIR, which coordinator and workers mount alike.
+    """
+
+    def __init__(self, client, ttl: Optional[float] = None):
+        self.client = client
+        self.ttl = ttl or config.WORKER_LEASE_TTL
+        self.store = Path(config.SHARED_STORE_DIR)
+        self.workers: Dict[str, RemoteWorker] = {}
+        self.leases: Dict[str, Lease] = {}
+        self.cond = threading.Condition()
+        self.reassigned = 0
+
+    def subscribe(self):
+        for kind in ("heartbeat", "progress", "done"):
+            self.client.subscribe(worker_topic("+", kind))
+
+    def handle(self, topic: str, payload: dict) -> bool:
+        """Process a worker message. False if topic is not a worker topic."""
+        prefix = config.TOPIC_WORKERS + "/"
+        if not topic.startswith(prefix):
+            return False
+        parts = topic[len(prefix):].split("/")
+        if len(parts) != 2:
+            return True
+        worker_id, kind = parts
+        if kind == "heartbeat":
+            self._heartbeat(worker_id, payload)
+        elif kind == "progress":
+            self._progress(worker_id, payload)
+        elif kind == "done":
+            self._done(worker_id, payload)
+        return True
+
+    def _heartbeat(self, worker_id: str, payload: dict):
+        with self.cond:
+            if payload.get("state") == "offline":
+                worker = self.workers.pop(worker_id, None)
+                if worker:
+                    logger.warning(f"Worker {worker_id} went offline with {len(worker.leases)} lease(s)")
+                    self._lapse(worker)
+                return
+
+            worker = self.workers.get(worker_id)
+            if worker is None:
+                worker = self.workers[worker_id] = RemoteWorker(worker_id)
+                logger.info(f"Worker {worker_id} registered with {payload.get('slots')} slot(s), "
+                            f"{payload.get('cpus')} core(s), {payload.get('memoryMb')} MB")
+            worker.info = payload
+            worker.slots = int(payload.get("slots", 1))
+            worker.image_id = payload.get("imageId")
+            worker.last_seen = time.monotonic()
+
+            expires = worker.last_seen + self.ttl
+            for lease_id in payload.get("leases", []):
+                lease = self.leases.get(lease_id)
+                if lease and lease.worker is worker:
+                    lease.expires = expires
+            self.cond.notify_all()
+
+    def _progress(self, worker_id: str, payload: dict):
+        with self.cond:
+            lease = self.leases.get(payload.get("leaseId"))
+            if lease is None or lease.worker.id != worker_id:
+                return
+            lease.expires = time.monotonic() + self.ttl
+        if lease.progress:
+            lease.progress(payload.get("progress", 0), payload.get("step", ""), payload.get("eta"))
+
+    def _done(self, worker_id: str, payload: dict):
+        with self.cond:
+            lease = self.leases.get(payload.get("leaseId"))
+            if lease is None or lease.worker.id != worker_id:
+                # A lease that already lapsed and was reassigned
+                logger.info(f"Ignoring result of unknown lease {payload.get('leaseId')} from {worker_id}")
+                return
+            if payload.get("status") == "rejected":
+                # Full until its next heartbeat says otherwise
+                lease.worker.slots = len(lease.worker.leases) - 1
+            self._end(lease)
+            lease.result = payload
+            self.cond.notify_all()
+        lease.done.set()
+
+    def _end(self, lease: Lease):
+        self.leases.pop(lease.id, None)
+        lease.worker.leases.discard(lease.id)
+
+    def _lapse(self, worker: RemoteWorker):
+        for lease_id in worker.leases:
+            lease = self.leases.get(lease_id)
+            if lease:
+                lease.expires = 0
+        self.cond.notify_all()
+
+    def _live(self) -> List[RemoteWorker]:
+        """Workers heard from within the TTL; silent ones are dropped."""
+        now = time.monotonic()
+        for worker in list(self.workers.values()):
+            if now - worker.last_seen > self.ttl:
+                logger.warning(f"Worker {worker.id} missed its heartbeats, dropping it")
+                del self.workers[worker.id]
+                self._lapse(worker)
+        return list(self.workers.values())
+
+    def image_id(self, timeout: Optional[float] = None) -> str:
+        """Build image of the live workers (the one most of them run)."""
+        deadline = time.monotonic() + (timeout or config.BUILD_TIMEOUT)
+        with self.cond:
+            while True:
+                images = Counter(w.image_id for w in self._live() if w.image_id)
+                if images:
+                    return images.most_common(1)[0][0]
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise RuntimeError("No build worker registered")
+                self.cond.wait(min(remaining, 1.0))
+
+    def run(self, request: dict, progress: Optional[Callable[..., None]] = None,
+            cancelled: Optional[Callable[[], bool]] = None) -> dict:
+        """Build request on a worker and return its done message.
+
+        Waits for a worker running request["imageId"] with a free slot. A
+        lapsed lease is reassigned up to WORKER_LEASE_RETRIES times.
+        """
+        cancelled = cancelled or (lambda: False)
+        deadline = time.monotonic() + config.BUILD_TIMEOUT
+        lost = 0
+        while True:
+            lease = self._grant(request, progress, cancelled, deadline)
+            result = self._wait(lease, cancelled, deadline)
+            if result is None:
+                lost += 1
+                with self.cond:
+                    self.reassigned += 1
+                if lost > config.WORKER_LEASE_RETRIES:
+                    raise RuntimeError(f"Build lost on {lost} worker(s)")
+                logger.warning(f"Lease {lease.id} on {lease.worker.id} lapsed, "
+                               f"reassigning job {request['jobId']}")
+                continue
+            if result.get("status") == "rejected":
+                logger.info(f"Worker {lease.worker.id} rejected job {request['jobId']}: "
+                            f"{result.get('error')}")
+                continue
+            return result
+
+    def _grant(self, request: dict, progress, cancelled: Callable[[], bool],
+               deadline: float) -> Lease:
+        with self.cond:
+            while True:
+                if cancelled():
+                    raise RuntimeError("Build cancelled")
+                if time.monotonic() > deadline:
+                    raise RuntimeError("Timed out waiting for a build worker")
+                candidates = [w for w in self._live()
+                              if w.free > 0 and w.image_id == request.get("imageId")]
+                if candidates:
+                    break
+                self.cond.wait(1.0)
+
+            worker = max(candidates, key=lambda w: w.free)
+            lease = Lease(worker, request, progress, self.ttl)
+            self.leases[lease.id] = lease
+            worker.leases.add(lease.id)
+
+        logger.info(f"Leasing job {request['jobId']} to {worker.id} as {lease.id}")
+        self.client.publish(worker_topic(worker.id, "lease"),
+                            json.dumps(dict(request, leaseId=lease.id)), qos=1)
+        return lease
+
+    def _wait(self, lease: Lease, cancelled: Callable[[], bool], deadline: float) -> Optional[dict]:
+        """The lease's done message, or None if the lease lapsed."""
+        while not lease.done.wait(1.0):
+            if cancelled() and not lease.cancel_sent:
+                lease.cancel_sent = True
+                self._cancel(lease)
+            with self.cond:
+                if lease.done.is_set():
+                    break
+                timed_out = time.monotonic() > deadline
+                lapsed = lease.expires < time.monotonic()
+                if timed_out or lapsed:
+                    self._end(lease)
+            if timed_out:
+                self._cancel(lease)
+                raise RuntimeError("Build timed out on worker")
+            if lapsed:
+                # The worker may still be alive behind a partition; stop it
+                self._cancel(lease)
+                return None
+        return lease.result
+
+    def _cancel(self, lease: Lease):
+        self.client.publish(worker_topic(lease.worker.id, "cancel"),
+                            json.dumps({"leaseId": lease.id}), qos=1)
+
+    def store_path(self, relative: str) -> Path:
+        """Resolve a path reported by a worker inside SHARED_STORE_DIR."""
+        path = (self.store / relative).resolve()
+        if self.store.resolve() not in path.parents:
+            raise RuntimeError(f"Worker path outside the shared store: {relative}")
+        return path
+
+    def stats(self) -> dict:
+        with self.cond:
+            return {
+                "workers": [w.to_dict() for w in self._live()],
+                "leases": len(self.leases),
+                "reassigned": self.reassigned
+            }